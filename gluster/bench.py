@@ -0,0 +1,705 @@
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Throughput benchmarks of gluster.gfapi.
+
+    python -m gluster.bench [--only seq_read,stat] [--format text]
+    python -m gluster.bench --host gfshost --volume test
+
+Without --host the benchmarks run against LocalApi, a stand-in for
+libgfapi backed by a local directory, which needs no Gluster server and
+measures the cost of the Python bindings themselves.  Results are written
+as a JSON document (or a text table) so that runs can be compared.
+"""
+
+import ctypes
+from ctypes.util import find_library
+import itertools
+import json
+import optparse
+import os
+import platform
+import random
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import time
+import timeit
+
+from contextlib import contextmanager
+
+import gluster
+from gluster import gfapi
+
+
+_libc = ctypes.CDLL(find_library("c"), use_errno=True)
+
+_c_off_t = ctypes.c_longlong
+for _name, _restype, _argtypes in [
+        ("close", ctypes.c_int, [ctypes.c_int]),
+        ("fallocate", ctypes.c_int, [ctypes.c_int, ctypes.c_int, _c_off_t,
+                                     _c_off_t]),
+        ("fgetxattr", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_char_p,
+                                         ctypes.c_void_p, ctypes.c_size_t]),
+        ("flistxattr", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                          ctypes.c_size_t]),
+        ("fremovexattr", ctypes.c_int, [ctypes.c_int, ctypes.c_char_p]),
+        ("fsetxattr", ctypes.c_int, [ctypes.c_int, ctypes.c_char_p,
+                                     ctypes.c_char_p, ctypes.c_size_t,
+                                     ctypes.c_int]),
+        ("fsync", ctypes.c_int, [ctypes.c_int]),
+        ("ftruncate", ctypes.c_int, [ctypes.c_int, _c_off_t]),
+        ("getxattr", ctypes.c_ssize_t, [ctypes.c_char_p, ctypes.c_char_p,
+                                        ctypes.c_void_p, ctypes.c_size_t]),
+        ("listxattr", ctypes.c_ssize_t, [ctypes.c_char_p, ctypes.c_void_p,
+                                         ctypes.c_size_t]),
+        ("lseek", _c_off_t, [ctypes.c_int, _c_off_t, ctypes.c_int]),
+        ("open", ctypes.c_int, [ctypes.c_char_p, ctypes.c_int,
+                                ctypes.c_int]),
+        ("pread", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_size_t, _c_off_t]),
+        ("preadv", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                      ctypes.c_int, _c_off_t]),
+        ("pwrite", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                      ctypes.c_size_t, _c_off_t]),
+        ("pwritev", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                       ctypes.c_int, _c_off_t]),
+        ("read", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                    ctypes.c_size_t]),
+        ("readv", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_int]),
+        ("removexattr", ctypes.c_int, [ctypes.c_char_p, ctypes.c_char_p]),
+        ("setxattr", ctypes.c_int, [ctypes.c_char_p, ctypes.c_char_p,
+                                    ctypes.c_char_p, ctypes.c_size_t,
+                                    ctypes.c_int]),
+        ("write", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_size_t]),
+        ("writev", ctypes.c_ssize_t, [ctypes.c_int, ctypes.c_void_p,
+                                      ctypes.c_int])]:
+    _func = getattr(_libc, _name)
+    _func.restype = _restype
+    _func.argtypes = _argtypes
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+
+def _bytes(s):
+    if isinstance(s, bytes):
+        return s
+    return s.encode(sys.getfilesystemencoding())
+
+
+def _deref(ref):
+    """
+    Return the ctypes object a byref() argument points to
+    """
+    return getattr(ref, "_obj", ref)
+
+
+def _oscall(func, *args):
+    """
+    Call the os module function 'func' the way libgfapi would: return 0, or
+    -1 with errno set.
+    """
+    try:
+        func(*args)
+    except OSError as e:
+        ctypes.set_errno(e.errno)
+        return -1
+    return 0
+
+
+def _fill_stat(s, st):
+    s.st_dev = st.st_dev
+    s.st_ino = st.st_ino
+    s.st_nlink = st.st_nlink
+    s.st_mode = st.st_mode
+    s.st_uid = st.st_uid
+    s.st_gid = st.st_gid
+    s.st_rdev = st.st_rdev
+    s.st_size = st.st_size
+    s.st_blksize = st.st_blksize
+    s.st_blocks = st.st_blocks
+    for field in ("atime", "mtime", "ctime"):
+        t = getattr(st, "st_" + field)
+        setattr(s, "st_" + field, int(t))
+        setattr(s, "st_%snsec" % field, int(t % 1 * 1000000000))
+
+
+def _d_type(mode):
+    if stat.S_ISDIR(mode):
+        return gfapi.DT_DIR
+    if stat.S_ISREG(mode):
+        return gfapi.DT_REG
+    if stat.S_ISLNK(mode):
+        return gfapi.DT_LNK
+    return gfapi.DT_UNKNOWN
+
+
+class LocalApi(object):
+    """
+    Stand-in for the libgfapi handle, gfapi.api, serving a volume from the
+    local directory 'root'.  It implements the synchronous glfs_* calls
+    that gluster.gfapi makes, with the same arguments, return values and
+    errno reporting, mostly by passing them on to the C library; file
+    handles are plain file descriptors.  Install it with local_api().
+    """
+
+    def __init__(self, root):
+        self.root = _bytes(os.path.abspath(root))
+        self._dirs = {}
+        self._dir_ids = itertools.count(1)
+
+    def _path(self, path):
+        return os.path.join(self.root, _bytes(path).lstrip(b"/"))
+
+    # Volume handles.
+
+    def glfs_new(self, volid):
+        return 1
+
+    def glfs_set_volfile_server(self, fs, proto, host, port):
+        return 0
+
+    def glfs_set_logging(self, fs, path, level):
+        return 0
+
+    def glfs_init(self, fs):
+        return 0
+
+    def glfs_fini(self, fs):
+        return 0
+
+    # Path operations.
+
+    def glfs_creat(self, fs, path, flags, mode):
+        fd = _libc.open(self._path(path), flags | os.O_CREAT, mode)
+        return fd if fd >= 0 else None
+
+    def glfs_open(self, fs, path, flags):
+        fd = _libc.open(self._path(path), flags, 0)
+        return fd if fd >= 0 else None
+
+    def glfs_stat(self, fs, path, buf):
+        try:
+            st = os.stat(self._path(path))
+        except OSError as e:
+            ctypes.set_errno(e.errno)
+            return -1
+        _fill_stat(_deref(buf), st)
+        return 0
+
+    def glfs_lstat(self, fs, path, buf):
+        try:
+            st = os.lstat(self._path(path))
+        except OSError as e:
+            ctypes.set_errno(e.errno)
+            return -1
+        _fill_stat(_deref(buf), st)
+        return 0
+
+    def glfs_mkdir(self, fs, path, mode):
+        return _oscall(os.mkdir, self._path(path), mode)
+
+    def glfs_rmdir(self, fs, path):
+        return _oscall(os.rmdir, self._path(path))
+
+    def glfs_unlink(self, fs, path):
+        return _oscall(os.unlink, self._path(path))
+
+    def glfs_rename(self, fs, opath, npath):
+        return _oscall(os.rename, self._path(opath), self._path(npath))
+
+    def glfs_symlink(self, fs, source, link_name):
+        return _oscall(os.symlink, _bytes(source), self._path(link_name))
+
+    def glfs_getxattr(self, fs, path, key, buf, size):
+        return _libc.getxattr(self._path(path), _bytes(key), buf, size)
+
+    def glfs_setxattr(self, fs, path, key, value, size, flags):
+        return _libc.setxattr(self._path(path), _bytes(key), _bytes(value),
+                              size, flags)
+
+    def glfs_listxattr(self, fs, path, buf, size):
+        return _libc.listxattr(self._path(path), buf, size)
+
+    def glfs_removexattr(self, fs, path, key):
+        return _libc.removexattr(self._path(path), _bytes(key))
+
+    # Directory handles.
+
+    def glfs_opendir(self, fs, path):
+        path = self._path(path)
+        try:
+            names = os.listdir(path)
+        except OSError as e:
+            ctypes.set_errno(e.errno)
+            return None
+        handle = next(self._dir_ids)
+        self._dirs[handle] = (path, iter([b".", b".."] + names))
+        return handle
+
+    def glfs_closedir(self, fd):
+        del self._dirs[fd]
+        return 0
+
+    def _readdir(self, fd, buf, entry, result):
+        path, names = self._dirs[fd]
+        cursor = _deref(result)
+        for name in names:
+            try:
+                st = os.lstat(os.path.join(path, name))
+            except OSError:
+                # Removed since the directory was opened.
+                continue
+            if buf is not None:
+                _fill_stat(_deref(buf), st)
+            entry = _deref(entry)
+            entry.d_ino = st.st_ino
+            entry.d_off = 0
+            entry.d_reclen = len(name)
+            entry.d_type = struct.pack("B", _d_type(st.st_mode))
+            entry.d_name = name
+            cursor.contents = entry
+            return 0
+        ctypes.memset(ctypes.addressof(cursor), 0, ctypes.sizeof(cursor))
+        return 0
+
+    def glfs_readdir_r(self, fd, entry, result):
+        return self._readdir(fd, None, entry, result)
+
+    def glfs_readdirplus_r(self, fd, buf, entry, result):
+        return self._readdir(fd, buf, entry, result)
+
+    # File handles.
+
+    def glfs_close(self, fd):
+        return _libc.close(fd)
+
+    def glfs_read(self, fd, buf, size, flags):
+        return _libc.read(fd, buf, size)
+
+    def glfs_write(self, fd, buf, size, flags=0):
+        return _libc.write(fd, buf, size)
+
+    def glfs_pread(self, fd, buf, size, offset, flags):
+        return _libc.pread(fd, buf, size, offset)
+
+    def glfs_pwrite(self, fd, buf, size, offset, flags):
+        return _libc.pwrite(fd, buf, size, offset)
+
+    def glfs_readv(self, fd, iov, iovcnt, flags):
+        return _libc.readv(fd, iov, iovcnt)
+
+    def glfs_writev(self, fd, iov, iovcnt, flags):
+        return _libc.writev(fd, iov, iovcnt)
+
+    def glfs_preadv(self, fd, iov, iovcnt, offset, flags):
+        return _libc.preadv(fd, iov, iovcnt, offset)
+
+    def glfs_pwritev(self, fd, iov, iovcnt, offset, flags):
+        return _libc.pwritev(fd, iov, iovcnt, offset)
+
+    def glfs_lseek(self, fd, offset, whence):
+        return _libc.lseek(fd, offset, whence)
+
+    def glfs_fsync(self, fd):
+        return _libc.fsync(fd)
+
+    def glfs_ftruncate(self, fd, length):
+        return _libc.ftruncate(fd, length)
+
+    def glfs_fallocate(self, fd, mode, offset, length):
+        return _libc.fallocate(fd, mode, offset, length)
+
+    def glfs_discard(self, fd, offset, length):
+        return _libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                               offset, length)
+
+    def glfs_fgetxattr(self, fd, key, buf, size):
+        return _libc.fgetxattr(fd, _bytes(key), buf, size)
+
+    def glfs_fsetxattr(self, fd, key, value, size, flags):
+        return _libc.fsetxattr(fd, _bytes(key), _bytes(value), size, flags)
+
+    def glfs_flistxattr(self, fd, buf, size):
+        return _libc.flistxattr(fd, buf, size)
+
+    def glfs_fremovexattr(self, fd, key):
+        return _libc.fremovexattr(fd, _bytes(key))
+
+
+@contextmanager
+def local_api(root):
+    """
+    Make the Volumes created within the block use a LocalApi serving
+    'root' instead of libgfapi.
+    """
+    saved = gfapi.api
+    gfapi.api = LocalApi(root)
+    try:
+        yield gfapi.api
+    finally:
+        gfapi.api = saved
+
+
+# Benchmarks.  Each one takes the mounted Volume, the name of the directory
+# to work in and the options, and returns a list of result dicts.  Paths are
+# passed to the Volume as bytes, which is what libgfapi takes on Python 3.
+
+def _result(name, ops, seconds, nbytes=0, **params):
+    result = {"name": name, "ops": ops, "seconds": seconds, "bytes": nbytes,
+              "ops_per_sec": ops / seconds if seconds else None}
+    if nbytes:
+        result["mib_per_sec"] = (nbytes / float(1 << 20) / seconds
+                                 if seconds else None)
+    result.update(params)
+    return result
+
+
+def _make_file(vol, path, size, block_size=1 << 20):
+    block = b"\0" * block_size
+    with vol.creat(path, os.O_WRONLY | os.O_TRUNC, 0o644) as f:
+        for offset in range(0, size, block_size):
+            f.write(block[:min(block_size, size - offset)])
+
+
+def bench_seq_write(vol, workdir, opts):
+    results = []
+    path = _bytes(workdir + "/seq")
+    for bs in opts.block_sizes:
+        block = b"x" * bs
+        nblocks = max(opts.size // bs, 1)
+        with vol.creat(path, os.O_WRONLY | os.O_TRUNC, 0o644) as f:
+            start = timeit.default_timer()
+            for _ in range(nblocks):
+                f.write(block)
+            f.fsync()
+            elapsed = timeit.default_timer() - start
+        results.append(_result("seq_write", nblocks, elapsed, nblocks * bs,
+                               block_size=bs))
+        vol.unlink(path)
+    return results
+
+
+def bench_seq_read(vol, workdir, opts):
+    results = []
+    path = _bytes(workdir + "/seq")
+    _make_file(vol, path, opts.size)
+    for bs in opts.block_sizes:
+        buf = bytearray(bs)
+        ops = nbytes = 0
+        with vol.open(path, os.O_RDONLY) as f:
+            start = timeit.default_timer()
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                ops += 1
+                nbytes += n
+            elapsed = timeit.default_timer() - start
+        results.append(_result("seq_read", ops, elapsed, nbytes,
+                               block_size=bs))
+    vol.unlink(path)
+    return results
+
+
+def _offsets(opts, bs):
+    rand = random.Random(opts.seed)
+    nblocks = max(opts.size // bs, 1)
+    return [rand.randrange(nblocks) * bs for _ in range(opts.ops)]
+
+
+def bench_rand_read(vol, workdir, opts):
+    results = []
+    path = _bytes(workdir + "/rand")
+    _make_file(vol, path, opts.size)
+    with vol.open(path, os.O_RDONLY) as f:
+        for bs in opts.block_sizes:
+            offsets = _offsets(opts, bs)
+            nbytes = 0
+            start = timeit.default_timer()
+            for offset in offsets:
+                nbytes += len(f.pread(bs, offset))
+            elapsed = timeit.default_timer() - start
+            results.append(_result("rand_read", len(offsets), elapsed,
+                                   nbytes, block_size=bs))
+    vol.unlink(path)
+    return results
+
+
+def bench_rand_write(vol, workdir, opts):
+    results = []
+    path = _bytes(workdir + "/rand")
+    _make_file(vol, path, opts.size)
+    with vol.open(path, os.O_WRONLY) as f:
+        for bs in opts.block_sizes:
+            block = b"x" * bs
+            offsets = _offsets(opts, bs)
+            nbytes = 0
+            start = timeit.default_timer()
+            for offset in offsets:
+                nbytes += f.pwrite(block, offset)
+            f.fsync()
+            elapsed = timeit.default_timer() - start
+            results.append(_result("rand_write", len(offsets), elapsed,
+                                   nbytes, block_size=bs))
+    vol.unlink(path)
+    return results
+
+
+def _timed(name, func, items, **params):
+    start = timeit.default_timer()
+    for item in items:
+        func(item)
+    elapsed = timeit.default_timer() - start
+    return _result(name, len(items), elapsed, **params)
+
+
+def bench_small_files(vol, workdir, opts):
+    data = b"x" * opts.small_file_size
+    dirpath = _bytes(workdir + "/small")
+    vol.mkdir(dirpath, 0o755)
+    paths = [_bytes("%s/small/f%06d" % (workdir, i))
+             for i in range(opts.files)]
+
+    def create(path):
+        with vol.creat(path, os.O_WRONLY | os.O_EXCL, 0o644) as f:
+            f.write(data)
+
+    results = [
+        _timed("create", create, paths, file_size=opts.small_file_size),
+        _timed("stat", vol.stat, paths),
+        _timed("lstat", vol.lstat, paths),
+        _timed("unlink", vol.unlink, paths)]
+    vol.rmdir(dirpath)
+    return results
+
+
+def bench_readdir(vol, workdir, opts):
+    dirpath = _bytes(workdir + "/readdir")
+    vol.mkdir(dirpath, 0o755)
+    paths = [_bytes("%s/readdir/e%06d" % (workdir, i))
+             for i in range(opts.entries)]
+    for path in paths:
+        with vol.creat(path, os.O_WRONLY | os.O_EXCL, 0o644):
+            pass
+
+    results = []
+    for name, listing in [
+            ("scandir", lambda: list(vol.scandir(dirpath))),
+            ("listdir_stat", lambda: vol.listdir_stat(dirpath))]:
+        start = timeit.default_timer()
+        count = len(listing())
+        elapsed = timeit.default_timer() - start
+        results.append(_result(name, count, elapsed))
+
+    for path in paths:
+        vol.unlink(path)
+    vol.rmdir(dirpath)
+    return results
+
+
+def bench_xattr(vol, workdir, opts):
+    path = _bytes(workdir + "/xattr")
+    with vol.creat(path, os.O_WRONLY | os.O_EXCL, 0o644):
+        pass
+    value = b"v" * opts.xattr_size
+    keys = [_bytes("user.bench.%d" % (i % opts.xattr_keys))
+            for i in range(opts.ops)]
+    results = [
+        _timed("setxattr",
+               lambda key: vol.setxattr(path, key, value, len(value)), keys,
+               value_size=opts.xattr_size),
+        _timed("getxattr", lambda key: vol.getxattr(path, key), keys,
+               value_size=opts.xattr_size),
+        _timed("listxattr", lambda key: vol.listxattr(path), keys,
+               xattr_keys=opts.xattr_keys)]
+    vol.unlink(path)
+    return results
+
+
+BENCHMARKS = [
+    ("seq_write", bench_seq_write),
+    ("seq_read", bench_seq_read),
+    ("rand_read", bench_rand_read),
+    ("rand_write", bench_rand_write),
+    ("small_files", bench_small_files),
+    ("readdir", bench_readdir),
+    ("xattr", bench_xattr),
+]
+
+
+def run(vol, opts, names=None):
+    """
+    Run the benchmarks 'names' (default: all of them) on the mounted
+    Volume 'vol' and return the list of their results
+    """
+    workdir = "gfapi-bench-%d" % os.getpid()
+    vol.mkdir(_bytes(workdir), 0o755)
+    results = []
+    try:
+        for name, bench in BENCHMARKS:
+            if names is None or name in names:
+                results.extend(bench(vol, workdir, opts))
+    finally:
+        _remove_tree(vol, _bytes(workdir))
+    return results
+
+
+def _remove_tree(vol, top):
+    """
+    Remove what a failed benchmark may have left behind, and 'top'
+    """
+    for dirpath, dirnames, filenames in vol.walk(top, topdown=False):
+        for name in filenames:
+            vol.unlink(os.path.join(dirpath, name))
+        for name in dirnames:
+            vol.rmdir(os.path.join(dirpath, name))
+    vol.rmdir(top)
+
+
+def _parse_size(text):
+    text = text.strip().upper()
+    for suffix, shift in (("K", 10), ("M", 20), ("G", 30)):
+        if text.endswith(suffix):
+            return int(text[:-1]) << shift
+    return int(text)
+
+
+def _parse_sizes(option, opt_str, value, parser):
+    setattr(parser.values, option.dest,
+            [_parse_size(v) for v in value.split(",")])
+
+
+def _parse_size_option(option, opt_str, value, parser):
+    setattr(parser.values, option.dest, _parse_size(value))
+
+
+def make_parser():
+    parser = optparse.OptionParser(
+        prog="python -m gluster.bench",
+        description="Benchmark gluster.gfapi against a Gluster volume or, "
+        "by default, a local directory.")
+    add = parser.add_option
+    add("--host", help="Gluster server; without it, LocalApi is used")
+    add("--volume", default="test", help="volume name [%default]")
+    add("--root", help="local directory to serve with LocalApi "
+        "[a temporary directory]")
+    add("--only", help="comma separated benchmarks to run, out of: " +
+        ", ".join(name for name, bench in BENCHMARKS))
+    add("--size", default=16 << 20, type="string", action="callback",
+        callback=_parse_size_option,
+        help="size of the sequential and random I/O file [16M]")
+    add("--block-sizes", default=[4096, 65536, 1 << 20], type="string",
+        action="callback", callback=_parse_sizes,
+        help="comma separated I/O block sizes [4K,64K,1M]")
+    add("--ops", type="int", default=1000,
+        help="random I/O and xattr operations per run [%default]")
+    add("--files", type="int", default=1000,
+        help="number of small files [%default]")
+    add("--small-file-size", type="int", default=1024,
+        help="size of the small files [%default]")
+    add("--entries", type="int", default=10000,
+        help="number of entries of the listed directory [%default]")
+    add("--xattr-size", type="int", default=64,
+        help="size of the xattr values [%default]")
+    add("--xattr-keys", type="int", default=16,
+        help="number of distinct xattr keys [%default]")
+    add("--seed", type="int", default=0, help="random seed [%default]")
+    add("--format", choices=["json", "text"], default="json",
+        help="output format [%default]")
+    add("--output", help="write the results to this file [stdout]")
+    return parser
+
+
+def report(results, opts, backend):
+    """
+    Return the machine readable report of a run
+    """
+    return {
+        "version": gluster.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": backend,
+        "timestamp": time.time(),
+        "options": dict((k, v) for k, v in vars(opts).items()
+                        if k not in ("output", "format")),
+        "results": results,
+    }
+
+
+def format_text(doc):
+    lines = ["%-14s %10s %8s %12s %10s" % ("benchmark", "block", "ops",
+                                            "ops/s", "MiB/s")]
+    for r in doc["results"]:
+        lines.append("%-14s %10s %8d %12.1f %10s" % (
+            r["name"], r.get("block_size", "-"), r["ops"],
+            r["ops_per_sec"] or 0,
+            "%.1f" % r["mib_per_sec"] if r.get("mib_per_sec") else "-"))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = make_parser()
+    opts, args = parser.parse_args(argv)
+    if args:
+        parser.error("unexpected arguments: %s" % " ".join(args))
+    names = None
+    if opts.only:
+        names = set(opts.only.split(","))
+        unknown = names - set(name for name, bench in BENCHMARKS)
+        if unknown:
+            parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    if opts.host:
+        vol = gfapi.Volume(opts.host, opts.volume)
+        vol.set_logging("/dev/null", 7)
+        if vol.mount() < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        results = run(vol, opts, names)
+        backend = "gluster"
+    else:
+        root = opts.root or tempfile.mkdtemp(prefix="gfapi-bench-")
+        try:
+            with local_api(root):
+                vol = gfapi.Volume("localhost", "local")
+                vol.mount()
+                results = run(vol, opts, names)
+        finally:
+            if not opts.root:
+                shutil.rmtree(root, ignore_errors=True)
+        backend = "local"
+
+    doc = report(results, opts, backend)
+    if opts.format == "json":
+        text = json.dumps(doc, indent=2, sort_keys=True) + "\n"
+    else:
+        text = format_text(doc)
+    if opts.output:
+        with open(opts.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
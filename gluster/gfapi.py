@@ -13,20 +13,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import ctypes
 from ctypes.util import find_library
+import errno
+import functools
+import io
+import itertools
+import json
+import logging
+import mmap
 import os
 import stat
+import struct
+import sys
+import threading
+import time
 
 from contextlib import contextmanager
 
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 # Disclaimer: many of the helper functions (e.g., exists, isdir) where copied
 # from the python source code
 
-# Looks like ctypes is having trouble with dependencies, so just force them to
-# load with RTLD_GLOBAL until I figure that out.
-api = ctypes.CDLL(find_library("gfapi"), ctypes.RTLD_GLOBAL, use_errno=True)
-
 # Wow, the Linux kernel folks really play nasty games with this structure.  If
 # you look at the man page for stat(2) and then at this definition you'll note
 # two discrepancies.  First, we seem to have st_nlink and st_mode reversed.  In
@@ -61,112 +82,2077 @@ class Stat (ctypes.Structure):
     ]
 
 
-class Dirent (ctypes.Structure):
-    _fields_ = [
-        ("d_ino", ctypes.c_ulong),
-        ("d_off", ctypes.c_ulong),
-        ("d_reclen", ctypes.c_ushort),
-        ("d_type", ctypes.c_char),
-        ("d_name", ctypes.c_char * 256),
-    ]
+_stat_struct = struct.Struct("@" + "".join(
+    {ctypes.c_uint: "I", ctypes.c_ulong: "L"}[t] for n, t in Stat._fields_))
+
+
+class StatResult(collections.namedtuple("StatResult", [
+        "st_mode", "st_ino", "st_dev", "st_nlink", "st_uid", "st_gid",
+        "st_size", "st_atime", "st_mtime", "st_ctime"])):
+    """
+    Immutable result of Volume.stat() and Volume.lstat(), laid out like
+    os.stat_result: a 10-tuple with the timestamps in whole seconds, whose
+    st_atime, st_mtime and st_ctime attributes are floats, and which also
+    has the st_atime_ns, st_mtime_ns and st_ctime_ns (integer nanoseconds),
+    st_blksize, st_blocks and st_rdev attributes.
+    """
+
+    def __setattr__(self, name, value=None):
+        raise AttributeError("readonly attribute")
+
+    __delattr__ = __setattr__
+
+    def __getstate__(self):
+        return dict(self.__dict__)
+
+    # Kept together in one tuple, '_extra', which is much cheaper than an
+    # attribute each.
+    st_atime_ns = property(lambda self: self._extra[0])
+    st_mtime_ns = property(lambda self: self._extra[1])
+    st_ctime_ns = property(lambda self: self._extra[2])
+    st_blksize = property(lambda self: self._extra[3])
+    st_blocks = property(lambda self: self._extra[4])
+    st_rdev = property(lambda self: self._extra[5])
+
+    @property
+    def st_atime(self):
+        return self.st_atime_ns / 1e9
+
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns / 1e9
+
+    @property
+    def st_ctime(self):
+        return self.st_ctime_ns / 1e9
+
+    @classmethod
+    def from_stat(cls, s):
+        """
+        Convert a Stat structure, reading its memory in one pass instead of
+        field by field.
+        """
+        (dev, ino, nlink, mode, uid, gid, rdev, size, blksize, blocks,
+         atime, atimensec, mtime, mtimensec, ctime,
+         ctimensec) = _stat_struct.unpack_from(s)
+        st = tuple.__new__(cls, (mode, ino, dev, nlink, uid, gid, size,
+                                 atime, mtime, ctime))
+        st.__dict__["_extra"] = (atime * 1000000000 + atimensec,
+                                 mtime * 1000000000 + mtimensec,
+                                 ctime * 1000000000 + ctimensec,
+                                 blksize, blocks, rdev)
+        return st
+
+
+class Dirent (ctypes.Structure):
+    _fields_ = [
+        ("d_ino", ctypes.c_ulong),
+        ("d_off", ctypes.c_ulong),
+        ("d_reclen", ctypes.c_ushort),
+        ("d_type", ctypes.c_char),
+        ("d_name", ctypes.c_char * 256),
+    ]
+
+# Values of Dirent.d_type
+DT_UNKNOWN = 0
+DT_DIR = 4
+DT_REG = 8
+DT_LNK = 10
+
+
+class Iovec (ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+# Completion callback of the glfs_*_async calls, invoked from a libgfapi
+# thread: void (*glfs_io_cbk)(glfs_fd_t *fd, ssize_t ret, void *data)
+glfs_io_cbk = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_ssize_t,
+                               ctypes.c_void_p, use_errno=True)
+
+# The same since GlusterFS 6, which put struct glfs_stat pointers before
+# 'data': void (*glfs_io_cbk)(glfs_fd_t *fd, ssize_t ret,
+#     struct glfs_stat *prestat, struct glfs_stat *poststat, void *data)
+glfs_io_cbk6 = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_ssize_t,
+                                ctypes.c_void_p, ctypes.c_void_p,
+                                ctypes.c_void_p, use_errno=True)
+
+
+# Calls raising IOError rather than OSError on failure.
+_IOERROR_CALLS = frozenset(["glfs_fgetxattr", "glfs_flistxattr",
+                            "glfs_fremovexattr", "glfs_fsetxattr",
+                            "glfs_getxattr", "glfs_listxattr",
+                            "glfs_removexattr", "glfs_setxattr"])
+
+
+def _errcheck(result, func, args):
+    """
+    Raise the error of a libgfapi call returning -1, or NULL for those
+    returning a handle
+    """
+    if result is None or result < 0:
+        err = ctypes.get_errno()
+        if func.__name__ in _IOERROR_CALLS:
+            raise IOError(err, os.strerror(err))
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+_fs = ctypes.c_void_p
+_fd = ctypes.c_void_p
+_off_t = ctypes.c_longlong
+_mode_t = ctypes.c_uint
+_dirent_p = ctypes.POINTER(Dirent)
+_iovec_p = ctypes.POINTER(Iovec)
+_stat_p = ctypes.POINTER(Stat)
+_char_p = ctypes.c_char_p
+_void_p = ctypes.c_void_p
+_int = ctypes.c_int
+_size_t = ctypes.c_size_t
+_ssize_t = ctypes.c_ssize_t
+
+# Prototypes of the libgfapi functions used, applied when the library is
+# loaded: (name, restype, argtypes, errcheck).  The calls without errcheck
+# are those whose result the callers interpret themselves.  The methods
+# still check the results of the others too, so that they behave the same
+# with the stand-ins for the library used in tests and benchmarks.
+_PROTOTYPES = [
+    ("glfs_new", _fs, [_char_p], None),
+    ("glfs_set_volfile_server", _int, [_fs, _char_p, _char_p, _int], None),
+    ("glfs_set_logging", _int, [_fs, _char_p, _int], None),
+    ("glfs_init", _int, [_fs], None),
+    ("glfs_fini", _int, [_fs], None),
+
+    ("glfs_creat", _fd, [_fs, _char_p, _int, _mode_t], _errcheck),
+    ("glfs_open", _fd, [_fs, _char_p, _int], _errcheck),
+    ("glfs_lstat", _int, [_fs, _char_p, _stat_p], _errcheck),
+    ("glfs_stat", _int, [_fs, _char_p, _stat_p], _errcheck),
+    ("glfs_mkdir", _int, [_fs, _char_p, _mode_t], _errcheck),
+    ("glfs_rmdir", _int, [_fs, _char_p], _errcheck),
+    ("glfs_unlink", _int, [_fs, _char_p], _errcheck),
+    ("glfs_rename", _int, [_fs, _char_p, _char_p], _errcheck),
+    ("glfs_symlink", _int, [_fs, _char_p, _char_p], _errcheck),
+    ("glfs_getxattr", _ssize_t, [_fs, _char_p, _char_p, _void_p, _size_t],
+     _errcheck),
+    ("glfs_setxattr", _int, [_fs, _char_p, _char_p, _void_p, _size_t, _int],
+     _errcheck),
+    ("glfs_listxattr", _ssize_t, [_fs, _char_p, _void_p, _size_t],
+     _errcheck),
+    ("glfs_removexattr", _int, [_fs, _char_p, _char_p], _errcheck),
+
+    ("glfs_opendir", _fd, [_fs, _char_p], _errcheck),
+    ("glfs_closedir", _int, [_fd], None),
+    ("glfs_readdir_r", _int, [_fd, _dirent_p, ctypes.POINTER(_dirent_p)],
+     None),
+    ("glfs_readdirplus_r", _int,
+     [_fd, _stat_p, _dirent_p, ctypes.POINTER(_dirent_p)], _errcheck),
+
+    ("glfs_close", _int, [_fd], _errcheck),
+    ("glfs_read", _ssize_t, [_fd, _void_p, _size_t, _int], _errcheck),
+    ("glfs_write", _ssize_t, [_fd, _void_p, _size_t, _int], _errcheck),
+    ("glfs_pread", _ssize_t, [_fd, _void_p, _size_t, _off_t, _int],
+     _errcheck),
+    ("glfs_pwrite", _ssize_t, [_fd, _void_p, _size_t, _off_t, _int],
+     _errcheck),
+    ("glfs_readv", _ssize_t, [_fd, _iovec_p, _int, _int], _errcheck),
+    ("glfs_writev", _ssize_t, [_fd, _iovec_p, _int, _int], _errcheck),
+    ("glfs_preadv", _ssize_t, [_fd, _iovec_p, _int, _off_t, _int],
+     _errcheck),
+    ("glfs_pwritev", _ssize_t, [_fd, _iovec_p, _int, _off_t, _int],
+     _errcheck),
+    ("glfs_lseek", _off_t, [_fd, _off_t, _int], _errcheck),
+    ("glfs_fsync", _int, [_fd], _errcheck),
+    ("glfs_ftruncate", _int, [_fd, _off_t], _errcheck),
+    ("glfs_discard", _int, [_fd, _off_t, _size_t], _errcheck),
+    ("glfs_fallocate", _int, [_fd, _int, _off_t, _size_t], _errcheck),
+    ("glfs_fgetxattr", _ssize_t, [_fd, _char_p, _void_p, _size_t],
+     _errcheck),
+    ("glfs_fsetxattr", _int, [_fd, _char_p, _void_p, _size_t, _int],
+     _errcheck),
+    ("glfs_flistxattr", _ssize_t, [_fd, _void_p, _size_t], _errcheck),
+    ("glfs_fremovexattr", _int, [_fd, _char_p], _errcheck),
+    # GlusterFS 6 and later.
+    ("glfs_copy_file_range", _ssize_t,
+     [_fd, ctypes.POINTER(_off_t), _fd, ctypes.POINTER(_off_t), _size_t,
+      ctypes.c_uint], _errcheck),
+
+    ("glfs_read_async", _int,
+     [_fd, _void_p, _size_t, _int, glfs_io_cbk, _void_p], _errcheck),
+    ("glfs_write_async", _int,
+     [_fd, _void_p, _size_t, _int, glfs_io_cbk, _void_p], _errcheck),
+    ("glfs_pread_async", _int,
+     [_fd, _void_p, _size_t, _off_t, _int, glfs_io_cbk, _void_p], _errcheck),
+    ("glfs_pwrite_async", _int,
+     [_fd, _void_p, _size_t, _off_t, _int, glfs_io_cbk, _void_p], _errcheck),
+    ("glfs_fsync_async", _int, [_fd, glfs_io_cbk, _void_p], _errcheck),
+]
+
+# The prototypes above are those of libgfapi before GlusterFS 6, which is
+# also what the functions of api take.  GlusterFS 6 appended struct
+# glfs_stat pointers, by number below, to these calls; they are always
+# passed as NULL, the stats never being asked for.
+_STAT_ARGS6 = {
+    "glfs_pread": 1,
+    "glfs_pwrite": 2,
+    "glfs_fsync": 2,
+    "glfs_ftruncate": 2,
+    "glfs_copy_file_range": 3,
+}
+
+# A symbol only GlusterFS 6 and later have, telling which prototypes apply.
+_GFAPI6_PROBE = "glfs_copy_file_range"
+
+
+def _with_stat_args(func, count):
+    """
+    Wrap the GlusterFS 6 'func' to be called like its earlier version, with
+    'count' NULL struct glfs_stat pointers added to the arguments.
+    """
+    stats = (None,) * count
+
+    def call(*args):
+        return func(*(args + stats))
+    call.__name__ = func.__name__
+    call.func = func
+    return call
+
+
+def _with_io_cbk6(func):
+    """
+    Wrap the GlusterFS 6 glfs_*_async 'func' to be called like its earlier
+    version, with _aio_callback, the one callback passed, replaced by its
+    glfs_io_cbk6 twin.
+    """
+    def call(*args):
+        return func(*(args[:-2] + (_aio_callback6, args[-1])))
+    call.__name__ = func.__name__
+    call.func = func
+    return call
+
+
+class _Library(object):
+    """
+    The libgfapi handle, loaded (and its functions given their prototypes)
+    on first use rather than on import, so that importing gluster.gfapi is
+    cheap and possible without libgfapi installed.  Functions are looked up
+    once and then cached as attributes, which is also where tests patch
+    them.  Against GlusterFS 6 and later ('gfapi6' true once loaded), the
+    calls whose arguments changed are wrapped to keep the earlier ones.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._lib = None
+        self._calls = {}
+        self.gfapi6 = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._lib is None:
+                path = find_library(self._name)
+                if path is None:
+                    raise OSError(errno.ENOENT,
+                                  "lib%s not found" % self._name)
+                # Looks like ctypes is having trouble with dependencies, so
+                # just force them to load with RTLD_GLOBAL until I figure
+                # that out.
+                lib = ctypes.CDLL(path, ctypes.RTLD_GLOBAL, use_errno=True)
+                self._apply_prototypes(lib, hasattr(lib, _GFAPI6_PROBE))
+                self._lib = lib
+        return self._lib
+
+    def _apply_prototypes(self, lib, gfapi6):
+        self.gfapi6 = gfapi6
+        for name, restype, argtypes, errcheck in _PROTOTYPES:
+            try:
+                func = getattr(lib, name)
+            except AttributeError:
+                # Not in this version of libgfapi.
+                continue
+            func.restype = restype
+            if gfapi6 and name in _STAT_ARGS6:
+                count = _STAT_ARGS6[name]
+                func.argtypes = argtypes + [_void_p] * count
+                self._calls[name] = _with_stat_args(func, count)
+            elif gfapi6 and glfs_io_cbk in argtypes:
+                func.argtypes = [glfs_io_cbk6 if t is glfs_io_cbk else t
+                                 for t in argtypes]
+                self._calls[name] = _with_io_cbk6(func)
+            else:
+                func.argtypes = argtypes
+            if errcheck is not None:
+                func.errcheck = errcheck
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        lib = self._lib or self._load()
+        func = self._calls.get(name)
+        if func is None:
+            func = getattr(lib, name)
+        setattr(self, name, func)
+        return func
+
+
+api = _Library("gfapi")
+
+
+def _buffer_len(obj):
+    """
+    Return the size in bytes of an object supporting the buffer protocol
+    """
+    try:
+        view = memoryview(obj)
+    except (NameError, TypeError):
+        # Python 2 objects (e.g. array.array) that only implement the old
+        # buffer protocol.
+        return len(buffer(obj))
+    try:
+        return view.nbytes
+    except AttributeError:
+        return len(view) * view.itemsize
+
+
+def _byte_view(obj):
+    """
+    Return a view of the buffer object 'obj' whose items are its bytes, so
+    that its length and slices count bytes whatever the item type of 'obj'
+    """
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        # Python 2 objects that only implement the old buffer protocol.
+        return buffer(obj)
+    try:
+        return view.cast("B")
+    except AttributeError:
+        # No cast() before Python 3.3.
+        if view.itemsize == 1 and view.ndim == 1:
+            return view
+    except TypeError:
+        # Not contiguous.
+        pass
+    return memoryview(view.tobytes())
+
+
+def _writable_buffer(obj, offset=0, size=None):
+    """
+    Return a ctypes char array sharing memory with the writable buffer
+    object 'obj', or with 'size' bytes of it from 'offset', so that
+    libgfapi can fill it in place.
+    """
+    if size is None:
+        size = _buffer_len(obj) - offset
+    return (ctypes.c_char * size).from_buffer(obj, offset)
+
+
+def _slice(obj, offset, size):
+    """
+    Return a view of 'size' bytes of the buffer object 'obj' from 'offset',
+    sharing its memory
+    """
+    try:
+        return memoryview(obj)[offset:offset + size]
+    except TypeError:
+        # Python 2 objects that only implement the old buffer protocol.
+        return buffer(obj, offset, size)
+
+
+class _Py_buffer(ctypes.Structure):
+    # The leading fields of Py_buffer, common to Python 2 and 3, and room
+    # for the rest.
+    _fields_ = [
+        ("buf", ctypes.c_void_p),
+        ("obj", ctypes.c_void_p),
+        ("len", ctypes.c_ssize_t),
+        ("itemsize", ctypes.c_ssize_t),
+        ("readonly", ctypes.c_int),
+        ("ndim", ctypes.c_int),
+        ("format", ctypes.c_char_p),
+        ("shape", ctypes.c_void_p),
+        ("strides", ctypes.c_void_p),
+        ("suboffsets", ctypes.c_void_p),
+        ("reserved", ctypes.c_void_p * 3),
+    ]
+
+PyBUF_SIMPLE = 0
+
+_get_buffer = ctypes.PYFUNCTYPE(
+    ctypes.c_int, ctypes.py_object, ctypes.POINTER(_Py_buffer),
+    ctypes.c_int)(("PyObject_GetBuffer", ctypes.pythonapi))
+_release_buffer = ctypes.PYFUNCTYPE(
+    None, ctypes.POINTER(_Py_buffer))(("PyBuffer_Release", ctypes.pythonapi))
+try:
+    _as_read_buffer = ctypes.PYFUNCTYPE(
+        ctypes.c_int, ctypes.py_object, ctypes.POINTER(ctypes.c_void_p),
+        ctypes.POINTER(ctypes.c_ssize_t))(("PyObject_AsReadBuffer",
+                                            ctypes.pythonapi))
+except AttributeError:
+    # Gone in Python 3.10, which has no use for it.
+    _as_read_buffer = None
+
+
+class _BufferView(object):
+    """
+    The memory of 'obj', any C-contiguous object supporting the buffer
+    protocol, read-only or not, held in place for as long as the view
+    lives.  It is passed to ctypes as a pointer to that memory.
+    """
+
+    def __init__(self, obj):
+        self._obj = obj
+        self._view = None
+        view = _Py_buffer()
+        try:
+            _get_buffer(obj, ctypes.byref(view), PyBUF_SIMPLE)
+        except TypeError:
+            if _as_read_buffer is None:
+                raise
+            # Python 2 objects (e.g. array.array, mmap) that only implement
+            # the old buffer protocol.
+            address = ctypes.c_void_p()
+            size = ctypes.c_ssize_t()
+            _as_read_buffer(obj, ctypes.byref(address), ctypes.byref(size))
+            self.address = address.value or 0
+            self.len = size.value
+        else:
+            self._view = view
+            self.address = view.buf or 0
+            self.len = view.len
+        self._as_parameter_ = ctypes.c_void_p(self.address)
+
+    def __del__(self):
+        if self._view is not None:
+            _release_buffer(ctypes.byref(self._view))
+            self._view = None
+
+
+def _readable_buffer(data):
+    """
+    Return an object that can be handed to libgfapi as the source of a
+    write, pointing straight at the memory of 'data', any object
+    supporting the buffer protocol, along with its length in bytes.
+    """
+    if isinstance(data, bytes):
+        # ctypes passes the memory of the string itself.
+        return data, len(data)
+    view = _BufferView(data)
+    return view, view.len
+
+
+def _address(buf):
+    """
+    Return the address of the memory of a buffer from _readable_buffer()
+    """
+    if isinstance(buf, bytes):
+        return ctypes.cast(ctypes.c_char_p(buf), ctypes.c_void_p).value
+    return buf.address
+
+
+def _at(buf, offset):
+    """
+    Return a pointer to byte 'offset' of a buffer from _readable_buffer(),
+    to resume a short write.  'buf' must be kept alive meanwhile.
+    """
+    return ctypes.c_void_p(_address(buf) + offset)
+
+
+def _iovec(buffers, writable=False):
+    """
+    Build an array of struct iovec pointing straight at the memory of each
+    object in 'buffers', so scatter/gather I/O needs no concatenation.
+    Returns the array, the list of objects that must be kept alive until
+    libgfapi is done with it and the total length of the buffers.
+    """
+    iov = (Iovec * len(buffers))()
+    refs = []
+    total = 0
+    for i, data in enumerate(buffers):
+        if writable:
+            buf = _writable_buffer(data)
+            buflen = len(buf)
+            address = ctypes.addressof(buf)
+        else:
+            buf, buflen = _readable_buffer(data)
+            address = _address(buf)
+        refs.append(buf)
+        iov[i].iov_base = address
+        iov[i].iov_len = buflen
+        total += buflen
+    return iov, refs, total
+
+
+def _iovec_skip(iov, count):
+    """
+    Return an array of struct iovec for what follows the first 'count'
+    bytes of 'iov', to resume a short write.
+    """
+    i = 0
+    while count >= iov[i].iov_len:
+        count -= iov[i].iov_len
+        i += 1
+    rest = (Iovec * (len(iov) - i))(*iov[i:])
+    rest[0].iov_base += count
+    rest[0].iov_len -= count
+    return rest
+
+
+# Size of the buffer first tried for extended attribute values and name
+# lists; larger ones cost an extra call to learn their exact size.
+XATTR_SIZE_HINT = 4096
+
+
+def _xattr_call(func, args, size=None):
+    """
+    Call one of the glfs_*getxattr/glfs_*listxattr functions, 'args' being
+    the arguments before the value buffer, and return the bytes it filled
+    in.  Unless 'size' is given, a XATTR_SIZE_HINT buffer is tried first; if
+    that is too small (ERANGE), the exact size is asked for with a zero
+    sized call and the call is repeated with a buffer of that size.
+    """
+    exact = size is not None
+    if not exact:
+        size = XATTR_SIZE_HINT
+    while True:
+        buf = ctypes.create_string_buffer(size)
+        try:
+            rc = func(*(args + (buf, size)))
+        except IOError as e:
+            if e.errno != errno.ERANGE or exact:
+                raise
+        else:
+            if rc >= 0:
+                return buf.raw[:rc]
+            err = ctypes.get_errno()
+            if err != errno.ERANGE or exact:
+                raise IOError(err, os.strerror(err))
+        size = func(*(args + (None, 0)))
+        if size < 0:
+            err = ctypes.get_errno()
+            raise IOError(err, os.strerror(err))
+
+
+def _xattr_names(data):
+    """
+    Split the NUL separated list returned by listxattr into sorted names
+    """
+    names = data.split(b"\0")
+    names.pop()
+    names.sort()
+    return names
+
+
+# Asynchronous requests in flight, keyed by the integer handed to libgfapi
+# as the opaque callback data.  Each entry holds the event loop and future
+# to complete, a function turning the return value into the result, the
+# I/O buffer, which must stay alive until libgfapi is done with it, and the
+# function reporting the completion to the Volume's hooks, if it has any.
+_aio_pending = {}
+_aio_ids = itertools.count(1)
+
+
+def _aio_set_result(future, result, exc):
+    if future.cancelled():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+def _aio_complete(fd, ret, data):
+    loop, future, done, buf, hooked = _aio_pending.pop(data)
+    err = None
+    if ret < 0:
+        err = ctypes.get_errno()
+        result, exc = None, OSError(err, os.strerror(err))
+    else:
+        result, exc = done(ret), None
+    loop.call_soon_threadsafe(_aio_set_result, future, result, exc)
+    if hooked is not None:
+        hooked(ret, err)
+
+_aio_callback = glfs_io_cbk(_aio_complete)
+
+
+def _aio_complete6(fd, ret, prestat, poststat, data):
+    _aio_complete(fd, ret, data)
+
+_aio_callback6 = glfs_io_cbk6(_aio_complete6)
+
+
+def _aio_future(loop):
+    try:
+        return loop.create_future()
+    except AttributeError:
+        return asyncio.Future(loop=loop)
+
+
+def _aio_submit(func, args, done, buf):
+    """
+    Issue the glfs_*_async call 'func' and return an asyncio future that
+    the completion callback resolves with done(ret) on the current event
+    loop.
+    """
+    if asyncio is None:
+        raise RuntimeError("asynchronous I/O requires asyncio")
+    loop = asyncio.get_event_loop()
+    future = _aio_future(loop)
+    op = next(_aio_ids)
+    _aio_pending[op] = (loop, future, done, buf, None)
+    try:
+        ret = func(*(args + (_aio_callback, op)))
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+    except Exception:
+        del _aio_pending[op]
+        raise
+    return future
+
+
+def _aio_count(ret):
+    return ret
+
+
+# mode flag of fallocate(): allocate the space without changing the size.
+FALLOC_FL_KEEP_SIZE = 0x01
+
+# Size of the ranges Volume.copyfile() splits the files to copy in.
+COPY_CHUNK = 4 * 1024 * 1024
+
+# lseek() whence values finding the next data and hole of a sparse file,
+# missing from the os module of Python 2.
+SEEK_DATA = getattr(os, "SEEK_DATA", 3)
+SEEK_HOLE = getattr(os, "SEEK_HOLE", 4)
+
+# Errors from copy_file_range() meaning that the copy cannot be done server
+# side, but can be done by reading and writing the data.
+_NO_COPY_OFFLOAD = frozenset([errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP,
+                              errno.EXDEV])
+
+
+def _preallocate(fileobj, size):
+    """
+    Allocate 'size' bytes of space to the File 'fileobj' up front, where
+    the volume supports it, without changing its size.
+    """
+    try:
+        fileobj.fallocate(FALLOC_FL_KEEP_SIZE, 0, size)
+    except OSError as e:
+        # Preallocation is only an optimization.
+        if e.errno not in (errno.ENOSYS, errno.EOPNOTSUPP):
+            raise
+
+
+def _extents(lseek, offset, size):
+    """
+    Generate the (offset, length) of the ranges holding data between
+    'offset' and 'size' in a file, found with its lseek(pos, how) function
+    and SEEK_DATA and SEEK_HOLE.  Where those are not supported the whole
+    range is data.
+    """
+    while offset < size:
+        try:
+            start = lseek(offset, SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Nothing but a hole up to the end.
+                return
+            if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            yield offset, size - offset
+            return
+        if start >= size:
+            return
+        end = lseek(start, SEEK_HOLE)
+        if not start < end <= size:
+            end = size
+        yield start, end - start
+        offset = end
+
+
+def _chunks(extents, chunk):
+    """
+    Return the list of the (offset, length) ranges of 'extents' cut at
+    every multiple of 'chunk'
+    """
+    ranges = []
+    for offset, length in extents:
+        end = offset + length
+        while offset < end:
+            stop = min(end, (offset // chunk + 1) * chunk)
+            ranges.append((offset, stop - offset))
+            offset = stop
+    return ranges
+
+
+def _copy_range(fin, fout, offset, length, offload):
+    """
+    Copy 'length' bytes at 'offset' from File 'fin' to the same offset of
+    File 'fout', server side as long as offload[0] is true: it is cleared
+    when copy_file_range() turns out not to be supported.  Returns the
+    number of bytes copied, fewer than 'length' if 'fin' ends first.
+    """
+    pos = offset
+    end = offset + length
+    while offload[0] and pos < end:
+        try:
+            ret = fin.copy_file_range(fout, end - pos, pos, pos)
+        except OSError as e:
+            if e.errno not in _NO_COPY_OFFLOAD:
+                raise
+            offload[0] = False
+            break
+        if not ret:
+            return pos - offset
+        pos += ret
+    while pos < end:
+        data = fin.pread(end - pos, pos)
+        n = fout.pwrite(data, pos) if data else 0
+        if not n:
+            break
+        pos += n
+    return pos - offset
+
+
+def _close_mmap(mm):
+    try:
+        mm.close()
+    except BufferError:
+        # Still exported to a ctypes array held by the traceback of an
+        # error; unmapped when that goes away.
+        pass
+
+
+class _TransferLog(object):
+    """
+    Log of the ranges of a file transfer completed so far, kept in the
+    local file 'path' + ".transfer": a line identifying the transfer by
+    the size and modification time of its source, its range size and its
+    'remote' end (volume server, volume name and path), followed by the
+    offset of each range completed.
+    """
+
+    def __init__(self, path, size, mtime, chunk, remote):
+        suffix = b".transfer" if isinstance(path, bytes) else ".transfer"
+        self.path = path + suffix
+        self.key = {"size": size, "mtime": mtime, "chunk": chunk,
+                    "remote": [s.decode("latin-1") if isinstance(s, bytes)
+                               else s for s in remote]}
+        self._fd = None
+
+    def completed(self):
+        """
+        Return the offsets of the ranges logged by an earlier attempt at
+        the same transfer.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                lines = f.read().split(b"\n")
+            if json.loads(lines[0].decode("ascii")) != self.key:
+                return set()
+            # The last line is empty, or cut short by the interruption.
+            return set(int(line) for line in lines[1:-1])
+        except (EnvironmentError, ValueError):
+            return set()
+
+    def open(self, resume=False):
+        if resume:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        else:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT |
+                               os.O_TRUNC | os.O_APPEND, 0o644)
+            os.write(self._fd, json.dumps(self.key).encode("ascii") + b"\n")
+
+    def record(self, offset):
+        os.write(self._fd, ("%d\n" % offset).encode("ascii"))
+
+    def close(self, finished=False):
+        os.close(self._fd)
+        self._fd = None
+        if finished:
+            os.unlink(self.path)
+
+
+class File(object):
+
+    def __init__(self, fd, path=None, stat_cache=None, lib=None):
+        # The libgfapi handle to call through: that of the Volume the file
+        # was opened from, which counts the calls when it collects stats.
+        self._api = lib if lib is not None else api
+        self.fd = fd
+        self.path = path
+        # Cache of the Volume the file was opened from, to drop the file's
+        # cached stat whenever it is modified through this File.
+        self._stat_cache = stat_cache
+
+    def _invalidate(self, ret=None):
+        if self._stat_cache is not None:
+            self._stat_cache.invalidate(self.path)
+        return ret
+
+    # File operations, in alphabetical order.
+
+    def afsync(self):
+        """
+        Asynchronous fsync(); returns a future resolved on the current
+        asyncio event loop.
+        """
+        return _aio_submit(self._api.glfs_fsync_async, (self.fd,),
+                           _aio_count, None)
+
+    def apread(self, buflen, offset, flags=0):
+        """
+        Asynchronous pread(); returns a future resolved with the data read.
+        """
+        rbuf = ctypes.create_string_buffer(buflen)
+        return _aio_submit(self._api.glfs_pread_async,
+                           (self.fd, rbuf, buflen, offset, flags),
+                           lambda ret: rbuf.raw[:ret], rbuf)
+
+    def apwrite(self, data, offset, flags=0):
+        """
+        Asynchronous pwrite(); returns a future resolved with the number of
+        bytes written.
+        """
+        buf, buflen = _readable_buffer(data)
+        self._invalidate()
+        return _aio_submit(self._api.glfs_pwrite_async,
+                           (self.fd, buf, buflen, offset, flags),
+                           self._invalidate, buf)
+
+    def aread(self, buflen, flags=0):
+        """
+        Asynchronous read(); returns a future resolved on the current asyncio
+        event loop with the data read, so that many reads can be in flight
+        without a thread each:
+
+            data = await f.aread(65536)
+        """
+        rbuf = ctypes.create_string_buffer(buflen)
+        return _aio_submit(self._api.glfs_read_async,
+                           (self.fd, rbuf, buflen, flags),
+                           lambda ret: rbuf.raw[:ret], rbuf)
+
+    def areadinto(self, buf, flags=0):
+        """
+        Asynchronous readinto(); returns a future resolved with the number
+        of bytes read.  'buf' must not be touched until it completes.
+        """
+        rbuf = _writable_buffer(buf)
+        return _aio_submit(self._api.glfs_read_async,
+                           (self.fd, rbuf, len(rbuf), flags),
+                           _aio_count, rbuf)
+
+    def awrite(self, data, flags=0):
+        """
+        Asynchronous write(); returns a future resolved with the number of
+        bytes written.
+        """
+        buf, buflen = _readable_buffer(data)
+        self._invalidate()
+        return _aio_submit(self._api.glfs_write_async,
+                           (self.fd, buf, buflen, flags),
+                           self._invalidate, buf)
+
+    def close(self):
+        ret = self._api.glfs_close(self.fd)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def copy_file_range(self, dst, length, offset=None, dst_offset=None,
+                        flags=0):
+        """
+        Copy up to 'length' bytes from this file to the File 'dst' of the
+        same volume, server side: the data does not travel to the client
+        and back.  'offset' and 'dst_offset' default to the file offsets,
+        which are then advanced.  Returns the number of bytes copied, 0 at
+        end of file.  Raises OSError(ENOSYS) if libgfapi is too old to copy
+        server side.
+        """
+        try:
+            func = self._api.glfs_copy_file_range
+        except AttributeError:
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+        off_in = off_out = None
+        if offset is not None:
+            off_in = ctypes.byref(_off_t(offset))
+        if dst_offset is not None:
+            off_out = ctypes.byref(_off_t(dst_offset))
+        ret = func(self.fd, off_in, dst.fd, off_out, length, flags)
+        dst._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def discard(self, offset, len):
+        ret = self._api.glfs_discard(self.fd, offset, len)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def fallocate(self, mode, offset, len):
+        ret = self._api.glfs_fallocate(self.fd, mode, offset, len)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def fgetxattr(self, key, maxlen=None):
+        """
+        Return the value of extended attribute 'key' of the open file.  The
+        value buffer is sized automatically unless 'maxlen' is given.
+        """
+        return _xattr_call(self._api.glfs_fgetxattr, (self.fd, key), maxlen)
+
+    def flistxattr(self):
+        return _xattr_names(_xattr_call(self._api.glfs_flistxattr,
+                                        (self.fd,)))
+
+    def fremovexattr(self, key):
+        ret = self._api.glfs_fremovexattr(self.fd, key)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise IOError(err, os.strerror(err))
+        return ret
+
+    def fsetxattr(self, key, value, vlen=None, flags=0):
+        if vlen is None:
+            vlen = len(value)
+        ret = self._api.glfs_fsetxattr(self.fd, key, value, vlen, flags)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise IOError(err, os.strerror(err))
+        return ret
+
+    def extents(self, offset=0, size=None):
+        """
+        Iterate over the (offset, length) of the ranges of the file holding
+        data, from 'offset' to 'size' (default: the end of the file),
+        skipping its holes.  The whole range is data if the volume cannot
+        tell holes apart.  Moves the file offset.
+        """
+        if size is None:
+            size = self.lseek(0, os.SEEK_END)
+        return _extents(self.lseek, offset, size)
+
+    def fsync(self):
+        ret = self._api.glfs_fsync(self.fd)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def ftruncate(self, length):
+        """
+        Truncate or extend the file to 'length' bytes; extending it adds a
+        hole.
+        """
+        ret = self._api.glfs_ftruncate(self.fd, length)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def lseek(self, pos, how):
+        """
+        Set the file offset, interpreting 'pos' according to 'how'
+        (os.SEEK_SET, os.SEEK_CUR or os.SEEK_END), and return the new offset
+        """
+        ret = self._api.glfs_lseek(self.fd, pos, how)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def pread(self, buflen, offset, flags=0):
+        """
+        Read at most 'buflen' bytes starting at 'offset', without using or
+        moving the file offset.  Several threads may safely pread() from
+        the same File concurrently.
+        """
+        rbuf = ctypes.create_string_buffer(buflen)
+        ret = self._api.glfs_pread(self.fd, rbuf, buflen, offset, flags)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return rbuf.raw[:ret]
+
+    def preadinto(self, buf, offset, flags=0):
+        """
+        Like readinto(), but starting at 'offset' and without using or
+        moving the file offset.
+        """
+        rbuf = _writable_buffer(buf)
+        ret = self._api.glfs_pread(self.fd, rbuf, len(rbuf), offset, flags)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def preadv(self, buffers, offset, flags=0):
+        """
+        Like readv(), but starting at 'offset' and without using or moving
+        the file offset.
+        """
+        iov, refs, total = _iovec(buffers, writable=True)
+        ret = self._api.glfs_preadv(self.fd, iov, len(iov), offset, flags)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def pwrite(self, data, offset, flags=0):
+        """
+        Like write(), but starting at 'offset' and without using or moving
+        the file offset.
+        """
+        buf, buflen = _readable_buffer(data)
+        ret = self._api.glfs_pwrite(self.fd, buf, buflen, offset, flags)
+        written = 0
+        while 0 < ret < buflen - written:
+            written += ret
+            ret = self._api.glfs_pwrite(self.fd, _at(buf, written),
+                                        buflen - written, offset + written,
+                                        flags)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return written + ret
+
+    def pwritev(self, buffers, offset, flags=0):
+        """
+        Like writev(), but starting at 'offset' and without using or moving
+        the file offset.
+        """
+        iov, refs, total = _iovec(buffers)
+        ret = self._api.glfs_pwritev(self.fd, iov, len(iov), offset, flags)
+        written = 0
+        while 0 < ret < total - written:
+            written += ret
+            iov = _iovec_skip(iov, ret)
+            ret = self._api.glfs_pwritev(self.fd, iov, len(iov),
+                                         offset + written, flags)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return written + ret
+
+    def read(self, buflen, flags=0):
+        """
+        Read at most 'buflen' bytes and return them as a string, which is
+        empty at end of file.
+        """
+        rbuf = ctypes.create_string_buffer(buflen)
+        ret = self._api.glfs_read(self.fd, rbuf, buflen, flags)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return rbuf.raw[:ret]
+
+    def readinto(self, buf, flags=0):
+        """
+        Read directly into 'buf', any writable object supporting the buffer
+        protocol (bytearray, mmap, array...), without an intermediate copy.
+        Returns the number of bytes read, 0 at end of file.
+        """
+        rbuf = _writable_buffer(buf)
+        ret = self._api.glfs_read(self.fd, rbuf, len(rbuf), flags)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def readv(self, buffers, flags=0):
+        """
+        Scatter read: fill each writable buffer in 'buffers' in turn with a
+        single call.  Returns the total number of bytes read.
+        """
+        iov, refs, total = _iovec(buffers, writable=True)
+        ret = self._api.glfs_readv(self.fd, iov, len(iov), flags)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
+
+    def tell(self):
+        """
+        Return the current file offset
+        """
+        return self.lseek(0, os.SEEK_CUR)
+
+    def write(self, data, flags=0):
+        """
+        Write 'data', any C-contiguous object supporting the buffer
+        protocol (bytes, bytearray, memoryview, array, mmap...), straight
+        from its memory.  Short writes are resumed until all of it is
+        written; returns the number of bytes written.
+        """
+        buf, buflen = _readable_buffer(data)
+        ret = self._api.glfs_write(self.fd, buf, buflen, flags)
+        written = 0
+        while 0 < ret < buflen - written:
+            written += ret
+            ret = self._api.glfs_write(self.fd, _at(buf, written),
+                                       buflen - written, flags)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return written + ret
+
+    def writev(self, buffers, flags=0):
+        """
+        Gather write: write the contents of every buffer in 'buffers', in
+        order, with a single call (more after short writes).  Returns the
+        total number of bytes written.
+        """
+        iov, refs, total = _iovec(buffers)
+        ret = self._api.glfs_writev(self.fd, iov, len(iov), flags)
+        written = 0
+        while 0 < ret < total - written:
+            written += ret
+            iov = _iovec_skip(iov, ret)
+            ret = self._api.glfs_writev(self.fd, iov, len(iov), flags)
+        self._invalidate()
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return written + ret
+
+
+class _Prefetch(object):
+    """
+    Background pread() of 'size' bytes at 'offset'
+    """
+
+    def __init__(self, fileobj, offset, size):
+        self.offset = offset
+        self.data = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(fileobj, size))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, fileobj, size):
+        try:
+            self.data = fileobj.pread(size, self.offset)
+        except OSError as e:
+            self.error = e
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def wait(self):
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.data
+
+
+class GlusterRawIO(io.RawIOBase):
+    """
+    Unbuffered io stream on top of a File, so that it can be wrapped by
+    io.BufferedReader, io.BufferedWriter or io.TextIOWrapper.
+
+    All I/O is positional, the stream keeps its own offset.  When
+    'readahead' is non zero, reads are served from a window of that many
+    bytes, and the following window is fetched by a background thread
+    while the current one is being consumed.
+    """
+
+    def __init__(self, fileobj, mode="r", readahead=0, closefd=True):
+        io.RawIOBase.__init__(self)
+        self._file = fileobj
+        self._readable = "r" in mode or "+" in mode
+        self._writable = "r" not in mode or "+" in mode
+        self._closefd = closefd
+        self._pos = 0
+        self.readahead = readahead
+        self._window_offset = 0
+        self._window = b""
+        self._prefetch = None
+        # Prefetches given up on (after a write or a seek) that may still
+        # be in flight.
+        self._dropped = []
+        if "a" in mode:
+            self._pos = fileobj.lseek(0, os.SEEK_END)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self._drop_window()
+                # Don't close the fd under a pread still in flight.
+                for prefetch in self._dropped:
+                    try:
+                        prefetch.wait()
+                    except OSError:
+                        pass
+                self._dropped = []
+                if self._closefd:
+                    self._file.close()
+            finally:
+                io.RawIOBase.close(self)
+
+    def readable(self):
+        return self._readable
+
+    def writable(self):
+        return self._writable
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = pos
+        elif whence == os.SEEK_CUR:
+            self._pos += pos
+        elif whence == os.SEEK_END:
+            self._pos = self._file.lseek(pos, os.SEEK_END)
+        else:
+            raise ValueError("invalid whence (%r)" % whence)
+        return self._pos
+
+    def _drop_prefetch(self):
+        if self._prefetch is not None:
+            self._dropped = [p for p in self._dropped if not p.done()]
+            self._dropped.append(self._prefetch)
+            self._prefetch = None
+
+    def _drop_window(self):
+        self._window = b""
+        self._drop_prefetch()
+
+    def _next_window(self):
+        """
+        Make the prefetched window current if it starts at the stream
+        offset, then start fetching the one after it.
+        """
+        prefetch = self._prefetch
+        if prefetch is None or prefetch.offset != self._pos:
+            self._drop_prefetch()
+            prefetch = _Prefetch(self._file, self._pos, self.readahead)
+        self._prefetch = None
+        self._window_offset = prefetch.offset
+        self._window = prefetch.wait()
+        if len(self._window) == self.readahead:
+            self._prefetch = _Prefetch(self._file,
+                                       self._window_offset + self.readahead,
+                                       self.readahead)
+
+    def readinto(self, b):
+        if not self._readable:
+            raise io.UnsupportedOperation("read")
+        if not self.readahead:
+            data = self._file.pread(len(b), self._pos)
+        else:
+            start = self._pos - self._window_offset
+            if not 0 <= start < len(self._window):
+                self._next_window()
+                start = 0
+            data = self._window[start:start + len(b)]
+        n = len(data)
+        b[:n] = data
+        self._pos += n
+        return n
+
+    def write(self, b):
+        if not self._writable:
+            raise io.UnsupportedOperation("write")
+        self._drop_window()
+        n = self._file.pwrite(b, self._pos)
+        self._pos += n
+        return n
+
+
+class WriteBehindFile(object):
+    """
+    Coalesce small writes to a File into chunks of 'chunk_size' bytes.
+
+    Data is handed to File.write() when a full chunk is buffered, when the
+    oldest buffered byte is older than 'max_age' seconds (if set), or on
+    flush() and close().  With 'background', chunks are written by a
+    separate thread and at most 'max_buffer' bytes (default: four chunks)
+    may be waiting to be written, besides the chunk being filled, however
+    many threads write; write() blocks beyond that.  An error from
+    a deferred write is raised by the next write(), flush() or close(), and
+    the data still queued at that time is discarded.
+    """
+
+    def __init__(self, fileobj, chunk_size=1024 * 1024, max_buffer=None,
+                 max_age=None, background=False, closefd=True):
+        self._file = fileobj
+        self.chunk_size = chunk_size
+        self.max_buffer = max(max_buffer or 4 * chunk_size, chunk_size)
+        self.max_age = max_age
+        self._closefd = closefd
+        self._buf = bytearray()
+        self._buf_time = None
+        self._queue = collections.deque()
+        self._queued = 0
+        self._error = None
+        self._closing = False
+        self.closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._flusher)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check_error(self):
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def _write_all(self, chunk):
+        while chunk:
+            n = self._file.write(chunk)
+            chunk = chunk[n:]
+
+    def _submit(self):
+        """
+        Pass the buffered data on to be written.  Called with the lock held.
+        """
+        if self._thread is not None:
+            # Wait with the data still in the buffer, where writers on
+            # other threads block rather than each setting a chunk aside.
+            while (self._queued and
+                   self._queued + len(self._buf) > self.max_buffer and
+                   self._error is None):
+                self._cond.wait()
+            self._check_error()
+            if not self._buf:
+                # Submitted by another thread in the meantime.
+                return
+        chunk = bytes(self._buf)
+        del self._buf[:]
+        self._buf_time = None
+        if self._thread is None:
+            self._write_all(chunk)
+            return
+        self._queue.append(chunk)
+        self._queued += len(chunk)
+        self._cond.notify_all()
+
+    def _flusher(self):
+        self._cond.acquire()
+        try:
+            while True:
+                if not self._queue:
+                    if self._closing:
+                        return
+                    timeout = None
+                    # Never submit while an error is pending: _submit()
+                    # would raise it here rather than to the caller.
+                    if (self.max_age is not None and self._buf and
+                            self._error is None):
+                        timeout = self._buf_time + self.max_age - time.time()
+                        if timeout <= 0:
+                            self._submit()
+                            continue
+                    self._cond.wait(timeout)
+                    continue
+                chunk = self._queue.popleft()
+                self._cond.release()
+                try:
+                    self._write_all(chunk)
+                    err = None
+                except OSError as e:
+                    err = e
+                finally:
+                    self._cond.acquire()
+                self._queued -= len(chunk)
+                if err is not None:
+                    self._error = err
+                    self._queue.clear()
+                    self._queued = 0
+                self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def write(self, data):
+        view = _byte_view(data)
+        nbytes = len(view)
+        with self._cond:
+            self._check_error()
+            pos = 0
+            while pos < nbytes:
+                room = self.chunk_size - len(self._buf)
+                self._buf += view[pos:pos + room]
+                pos += room
+                if self._buf_time is None:
+                    self._buf_time = time.time()
+                if len(self._buf) >= self.chunk_size:
+                    self._submit()
+            if (self._thread is None and self.max_age is not None and
+                    self._buf and
+                    time.time() - self._buf_time >= self.max_age):
+                self._submit()
+            else:
+                self._cond.notify_all()
+        return nbytes
+
+    def flush(self):
+        """
+        Write out all buffered data, and wait until it has been written
+        """
+        with self._cond:
+            self._check_error()
+            if self._buf:
+                self._submit()
+            while self._queued and self._error is None:
+                self._cond.wait()
+            self._check_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None:
+                with self._cond:
+                    self._closing = True
+                    self._cond.notify_all()
+                self._thread.join()
+                self._thread = None
+            if self._closefd:
+                self._file.close()
+
+
+class Dir(object):
+
+    def __init__(self, fd, lib=None):
+        # Add a reference so the module-level variable "api" doesn't
+        # get yanked out from under us (see comment above File def'n).
+        self._api = lib if lib is not None else api
+        self.fd = fd
+        self.cursor = ctypes.POINTER(Dirent)()
+
+    def __del__(self):
+        self._api.glfs_closedir(self.fd)
+        self._api = None
+
+    def next(self):
+        entry = Dirent()
+        entry.d_reclen = 256
+        rc = self._api.glfs_readdir_r(self.fd, ctypes.byref(entry),
+                                      ctypes.byref(self.cursor))
+
+        if (rc < 0) or (not self.cursor) or (not self.cursor.contents):
+            return rc
+
+        return entry
+
+
+class DirEntry(object):
+    """
+    Directory entry yielded by Volume.scandir(), in the manner of
+    os.DirEntry.  The file type comes from the d_type returned by readdir,
+    so is_dir(), is_file() and is_symlink() usually need no extra round
+    trip; stat() and lstat() results are fetched lazily and cached.
+    """
+
+    __slots__ = ("name", "path", "d_ino", "d_type", "_volume", "_stat",
+                 "_lstat")
+
+    def __init__(self, volume, path, name, d_ino, d_type):
+        self._volume = volume
+        self.path = path
+        self.name = name
+        self.d_ino = d_ino
+        self.d_type = d_type
+        self._stat = None
+        self._lstat = None
+
+    def __repr__(self):
+        return "<DirEntry %r>" % self.name
+
+    def inode(self):
+        return self.d_ino
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks and self.is_symlink():
+            if self._stat is None:
+                self._stat = self._volume.stat(self.path)
+            return self._stat
+        if self._lstat is None:
+            self._lstat = self._volume.lstat(self.path)
+        return self._lstat
+
+    def _test_mode(self, d_type, test, follow_symlinks):
+        if (self.d_type == DT_UNKNOWN or
+                (follow_symlinks and self.d_type == DT_LNK)):
+            try:
+                st = self.stat(follow_symlinks)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                return False
+            return test(st.st_mode)
+        return self.d_type == d_type
+
+    def is_dir(self, follow_symlinks=True):
+        return self._test_mode(DT_DIR, stat.S_ISDIR, follow_symlinks)
+
+    def is_file(self, follow_symlinks=True):
+        return self._test_mode(DT_REG, stat.S_ISREG, follow_symlinks)
+
+    def is_symlink(self):
+        return self._test_mode(DT_LNK, stat.S_ISLNK, False)
+
+
+def _cache_path(path):
+    """
+    Normalize 'path' into a cache key.  libgfapi resolves relative paths
+    from the volume root, so "x", "/x" and "//x" are the same file.
+    """
+    path = os.path.normpath(path)
+    if isinstance(path, bytes):
+        return path.lstrip(b"/") or b"."
+    return path.lstrip("/") or "."
+
+
+class StatCache(object):
+    """
+    Bounded LRU cache of stat() and lstat() results, each valid for 'ttl'
+    seconds, with hit and miss counters.
+
+    Modifying operations invalidate the entries of the paths they touch.
+    A lookup started before an invalidation never stores its (possibly
+    stale) result afterwards: every invalidation bumps 'generation', and
+    put() is ignored if it changed since the lookup missed.
+    """
+
+    def __init__(self, ttl=1.0, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, follow_symlinks=True):
+        key = (_cache_path(path), follow_symlinks)
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None and item[1] > time.time():
+                # Re-insert to mark the entry as most recently used.
+                self._entries[key] = item
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+            return None
+
+    def put(self, path, follow_symlinks, st, generation):
+        key = (_cache_path(path), follow_symlinks)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (st, time.time() + self.ttl)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path, parent=False, tree=False):
+        """
+        Drop the entries for 'path', and also those of its parent directory
+        if 'parent' is true, and of everything below it if 'tree' is true.
+        """
+        path = _cache_path(path)
+        paths = [path]
+        if parent:
+            paths.append(os.path.dirname(path) or
+                         (b"." if isinstance(path, bytes) else "."))
+        with self._lock:
+            self.generation += 1
+            for p in paths:
+                self._entries.pop((p, True), None)
+                self._entries.pop((p, False), None)
+            if tree:
+                sep = b"/" if isinstance(path, bytes) else "/"
+                prefix = path.rstrip(sep) + sep
+                for key in [k for k in self._entries
+                            if k[0].startswith(prefix)]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._entries), "maxsize": self.maxsize,
+                "ttl": self.ttl}
+
+
+class NegativeCache(object):
+    """
+    Bounded cache of the paths stat() or lstat() recently failed on with
+    ENOENT, each remembered for 'ttl' seconds.
+
+    Entries are indexed by parent directory, and those directories by their
+    ancestors, so that creating a path only drops its own entries, and
+    replacing a directory tree only visits the entries below it, never the
+    whole cache.  As for StatCache, a lookup started before an invalidation
+    never stores its result afterwards.
+    """
+
+    def __init__(self, ttl=0.5, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        # (parent, name, follow_symlinks) -> expiry time, in LRU order
+        self._entries = collections.OrderedDict()
+        # parent -> set of the keys of its entries
+        self._dirs = {}
+        # directory -> set of the parents in _dirs below it
+        self._below = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, path, follow_symlinks):
+        parent, name = os.path.split(_cache_path(path))
+        return (parent, name, follow_symlinks)
+
+    def _ancestors(self, path):
+        while True:
+            parent = os.path.dirname(path)
+            if not parent or parent == path:
+                return
+            yield parent
+            path = parent
+
+    def _add(self, key, expires):
+        self._entries[key] = expires
+        keys = self._dirs.get(key[0])
+        if keys is None:
+            keys = self._dirs[key[0]] = set()
+            for d in self._ancestors(key[0]):
+                self._below.setdefault(d, set()).add(key[0])
+        keys.add(key)
+
+    def _remove(self, key):
+        del self._entries[key]
+        parent = key[0]
+        keys = self._dirs[parent]
+        keys.discard(key)
+        if not keys:
+            del self._dirs[parent]
+            for d in self._ancestors(parent):
+                below = self._below[d]
+                below.discard(parent)
+                if not below:
+                    del self._below[d]
+
+    def get(self, path, follow_symlinks=True):
+        """
+        Return True if 'path' is known not to exist
+        """
+        key = self._key(path, follow_symlinks)
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is not None:
+                if expires > time.time():
+                    self.hits += 1
+                    return True
+                self._remove(key)
+            self.misses += 1
+            return False
+
+    def put(self, path, follow_symlinks, generation):
+        key = self._key(path, follow_symlinks)
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._add(key, time.time() + self.ttl)
+            if len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, path, tree=False):
+        """
+        Forget that 'path', and anything below it if 'tree' is true, does
+        not exist
+        """
+        path = _cache_path(path)
+        parent, name = os.path.split(path)
+        with self._lock:
+            self.generation += 1
+            for key in ((parent, name, True), (parent, name, False)):
+                if key in self._entries:
+                    self._remove(key)
+            if tree:
+                for d in [path] + list(self._below.get(path, ())):
+                    for key in list(self._dirs.get(d, ())):
+                        self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._dirs.clear()
+            self._below.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._entries), "maxsize": self.maxsize,
+                "ttl": self.ttl}
+
+
+# libgfapi calls that return a handle, NULL on failure, rather than an int.
+_HANDLE_CALLS = frozenset(["glfs_creat", "glfs_new", "glfs_open",
+                           "glfs_opendir"])
+# libgfapi calls that act on the volume as a whole rather than on a path or
+# an open file, and the position of the path argument of those acting on a
+# path; all other calls act on the file or directory handle they are given
+# first.
+_VOLUME_CALLS = frozenset(["glfs_fini", "glfs_init", "glfs_new",
+                           "glfs_set_logging", "glfs_set_volfile_server"])
+_PATH_ARG = {"glfs_creat": 1, "glfs_getxattr": 1, "glfs_listxattr": 1,
+             "glfs_lstat": 1, "glfs_mkdir": 1, "glfs_open": 1,
+             "glfs_opendir": 1, "glfs_removexattr": 1, "glfs_rename": 1,
+             "glfs_rmdir": 1, "glfs_setxattr": 1, "glfs_stat": 1,
+             "glfs_symlink": 2, "glfs_unlink": 1}
+# I/O calls, taking either a buffer and its size or an iovec array and its
+# length as second and third arguments.
+_BUFFER_CALLS = frozenset(["glfs_pread", "glfs_pread_async", "glfs_pwrite",
+                           "glfs_pwrite_async", "glfs_read", "glfs_read_async",
+                           "glfs_write", "glfs_write_async"])
+_IOVEC_CALLS = frozenset(["glfs_preadv", "glfs_pwritev", "glfs_readv",
+                          "glfs_writev"])
+# Calls completing later, through a glfs_io_cbk callback.
+_ASYNC_CALLS = frozenset(["glfs_fsync_async", "glfs_pread_async",
+                          "glfs_pwrite_async", "glfs_read_async",
+                          "glfs_write_async"])
+# Operations whose return value is the number of bytes transferred.
+_IO_OPS = frozenset(["copy_file_range", "pread", "pread_async", "preadv",
+                     "pwrite", "pwrite_async", "pwritev", "read",
+                     "read_async", "readv", "write", "write_async",
+                     "writev"])
+
+_clock = getattr(time, "perf_counter", time.time)
+
+
+class CallHook(object):
+    """
+    Base class of the hooks installed with Volume.add_hook(), which are
+    called around every libgfapi call made through the Volume with the
+    operation name (the call without its "glfs_" prefix), its 'target'
+    (the path, the file or directory handle, or None for calls on the
+    volume as a whole) and 'size' (bytes requested by I/O calls, None for
+    the others).  Hooks run on the calling thread; an exception raised by
+    a hook propagates to the caller.  The glfs_*_async calls are reported
+    to after_call() once they complete, from the libgfapi thread running
+    the completion callback, unless their submission fails.
+    """
+
+    def before_call(self, op, target, size):
+        pass
+
+    def after_call(self, op, target, size, duration, ret, err):
+        """
+        Called with the 'duration' of the call in seconds, its return value
+        'ret' and, if it failed, its errno 'err' (None otherwise); for the
+        asynchronous calls, those of their completion, 'duration' running
+        from submission to completion
+        """
+        pass
+
+
+class _OpCounter(object):
+
+    __slots__ = ("calls", "errors", "bytes", "total", "max", "buckets")
 
-api.glfs_creat.restype = ctypes.c_void_p
-api.glfs_open.restype = ctypes.c_void_p
-api.glfs_lstat.restype = ctypes.c_int
-api.glfs_lstat.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
-                           ctypes.POINTER(Stat)]
-api.glfs_opendir.restype = ctypes.c_void_p
-api.glfs_readdir_r.restype = ctypes.c_int
-api.glfs_readdir_r.argtypes = [ctypes.c_void_p, ctypes.POINTER(Dirent),
-                               ctypes.POINTER(ctypes.POINTER(Dirent))]
-api.glfs_stat.restype = ctypes.c_int
-api.glfs_stat.argtypes = [ctypes.c_void_p, ctypes.c_char_p,
-                          ctypes.POINTER(Stat)]
+    def __init__(self, nbuckets):
+        self.calls = 0
+        self.errors = {}
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * nbuckets
 
+    def copy(self):
+        counter = _OpCounter(0)
+        counter.calls = self.calls
+        counter.errors = dict(self.errors)
+        counter.bytes = self.bytes
+        counter.total = self.total
+        counter.max = self.max
+        counter.buckets = list(self.buckets)
+        return counter
 
-class File(object):
+    def percentile(self, q):
+        """
+        Upper bound, in seconds, of the latency of the fraction 'q' of the
+        fastest calls
+        """
+        rank = q * self.calls
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1000000.0, self.max)
+        return self.max
 
-    def __init__(self, fd):
-        self.fd = fd
+    def summary(self):
+        return {"calls": self.calls, "errors": self.errors,
+                "bytes": self.bytes, "total": self.total,
+                "mean": self.total / self.calls, "max": self.max,
+                "buckets": self.buckets, "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9), "p99": self.percentile(0.99)}
 
-    # File operations, in alphabetical order.
 
-    def close(self):
-        ret = api.glfs_close(self.fd)
-        if ret < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
-        return ret
+class OpStats(CallHook):
+    """
+    Hook collecting per-operation statistics of libgfapi calls: number of
+    calls, failures by errno, bytes transferred and a latency histogram.
+    The histogram has power-of-two buckets in microseconds: bucket 0 counts
+    the calls that took less than 1us, bucket i those that took
+    [2**(i-1), 2**i) us, and the last one everything slower.  Asynchronous
+    I/O is recorded under its own operations ("read_async" and the like)
+    when it completes, with the bytes it transferred and its latency from
+    submission to completion.
+    """
 
-    def discard(self, offset, len):
-        ret = api.glfs_discard(self.fd, offset, len)
-        if ret < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
-        return ret
+    NBUCKETS = 32
 
-    def fallocate(self, mode, offset, len):
-        ret = api.glfs_fallocate(self.fd, mode, offset, len)
-        if ret < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
-        return ret
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
 
-    def fsync(self):
-        ret = api.glfs_fsync(self.fd)
-        if ret < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
-        return ret
+    def record(self, op, elapsed, err=None, nbytes=0):
+        bucket = min(int(elapsed * 1000000).bit_length(), self.NBUCKETS - 1)
+        with self._lock:
+            counter = self._ops.get(op)
+            if counter is None:
+                counter = self._ops[op] = _OpCounter(self.NBUCKETS)
+            counter.calls += 1
+            counter.total += elapsed
+            if elapsed > counter.max:
+                counter.max = elapsed
+            counter.buckets[bucket] += 1
+            if err is not None:
+                counter.errors[err] = counter.errors.get(err, 0) + 1
+            else:
+                counter.bytes += nbytes
 
-    def read(self, buflen, flags=0):
-        rbuf = ctypes.create_string_buffer(buflen)
-        ret = api.glfs_read(self.fd, rbuf, buflen, flags)
-        if ret > 0:
-            return rbuf
-        elif ret < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
+    def after_call(self, op, target, size, duration, ret, err):
+        if err is None and op in _IO_OPS:
+            self.record(op, duration, nbytes=ret)
         else:
-            return ret
+            self.record(op, duration, err)
 
-    def write(self, data):
-        # creating a ctypes.c_ubyte buffer to handle converting bytearray
-        # to the required C data type
-        if type(data) is bytearray:
-            buf = (ctypes.c_ubyte * len(data)).from_buffer(data)
-        else:
-            buf = data
-        ret = api.glfs_write(self.fd, buf, len(buf))
-        if ret < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
-        return ret
+    def reset(self):
+        with self._lock:
+            self._ops = {}
 
+    def snapshot(self, reset=False):
+        """
+        Return a dict mapping each operation name (the libgfapi call
+        without its "glfs_" prefix) to a dict with its "calls", "errors"
+        ({errno: count}), "bytes", "total", "mean" and "max" latency in
+        seconds, histogram "buckets" and estimated "p50", "p90" and "p99"
+        latencies.  With 'reset', the counters start over from zero.
+        """
+        with self._lock:
+            ops = self._ops
+            if reset:
+                self._ops = {}
+            else:
+                ops = dict((op, counter.copy())
+                           for op, counter in ops.items())
+        return dict((op, counter.summary()) for op, counter in ops.items())
 
-class Dir(object):
 
-    def __init__(self, fd):
-        # Add a reference so the module-level variable "api" doesn't
-        # get yanked out from under us (see comment above File def'n).
-        self._api = api
-        self.fd = fd
-        self.cursor = ctypes.POINTER(Dirent)()
+class SlowCallLogger(CallHook):
+    """
+    Hook logging a warning, with the Python call site that led to it, for
+    every libgfapi call taking 'threshold' seconds or longer.  The most
+    recent 'keep' of them are also kept in 'calls' as (op, target, size,
+    duration, err, site) tuples, 'site' being a (filename, lineno,
+    function) tuple.
+    """
 
-    def __del__(self):
-        self._api.glfs_closedir(self.fd)
-        self._api = None
+    def __init__(self, threshold, logger=None, keep=100):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger(__name__)
+        self.calls = collections.deque(maxlen=keep)
 
-    def next(self):
-        entry = Dirent()
-        entry.d_reclen = 256
-        rc = api.glfs_readdir_r(self.fd, ctypes.byref(entry),
-                                ctypes.byref(self.cursor))
+    def after_call(self, op, target, size, duration, ret, err):
+        if duration < self.threshold:
+            return
+        site = _call_site()
+        self.calls.append((op, target, size, duration, err, site))
+        self.logger.warning("slow libgfapi call: %s(%r) size=%s took %.3fs "
+                            "(errno %s) at %s:%d in %s()", op, target, size,
+                            duration, err, *site)
 
-        if (rc < 0) or (not self.cursor) or (not self.cursor.contents):
-            return rc
 
-        return entry
+# Modules whose frames stand between the code making a libgfapi call and
+# the call: this one, contextlib for the 'with' blocks of Volume.open() and
+# the like, and the thread pools.
+_PLUMBING = frozenset(
+    os.path.splitext(sys.modules[name].__file__)[0]
+    for name in (__name__, "contextlib", "threading",
+                 "concurrent.futures._base", "concurrent.futures.thread")
+    if name in sys.modules)
+
+# Call site, set by _with_call_site(), of the work a pool thread is doing.
+_pool_call_site = threading.local()
+
+
+def _call_site():
+    """
+    Return (filename, lineno, function) of the innermost frame of the
+    calling thread that is outside this module and the _PLUMBING, or, on a
+    pool thread, of the code that handed the work to the pool
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        if os.path.splitext(code.co_filename)[0] not in _PLUMBING:
+            return (code.co_filename, frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return getattr(_pool_call_site, "site", None) or ("?", 0, "?")
+
+
+def _with_call_site(func):
+    """
+    Wrap 'func', to be run on a pool thread, so that the calls it makes are
+    reported by _call_site() at the current call site.
+    """
+    site = _call_site()
+
+    def call(*args):
+        _pool_call_site.site = site
+        try:
+            return func(*args)
+        finally:
+            _pool_call_site.site = None
+    return call
+
+
+def _aio_hooked(hooks, op, target, size, start, site):
+    """
+    Return the function reporting the completion of the asynchronous call
+    'op', submitted at 'start' from 'site', to 'hooks'
+    """
+    def completed(ret, err):
+        duration = _clock() - start
+        _pool_call_site.site = site
+        try:
+            for hook in hooks:
+                hook.after_call(op, target, size, duration, ret, err)
+        finally:
+            _pool_call_site.site = None
+    return completed
+
+
+class _HookedApi(object):
+    """
+    Stand-in for the libgfapi handle that runs 'hooks' around every glfs_*
+    call made through it.
+    """
+
+    def __init__(self, lib):
+        self._lib = lib
+        self.hooks = ()
+
+    def __getattr__(self, name):
+        lib = self._lib
+        op = name[5:] if name.startswith("glfs_") else name
+        handle = name in _HANDLE_CALLS
+        volume = name in _VOLUME_CALLS
+        path_arg = _PATH_ARG.get(name)
+        buffer_call = name in _BUFFER_CALLS
+        iovec_call = name in _IOVEC_CALLS
+        async_call = name in _ASYNC_CALLS
+        # Functions missing from the library are missing from here too.
+        getattr(lib, name)
+
+        def call(*args):
+            hooks = self.hooks
+            if path_arg is not None:
+                target = args[path_arg]
+            elif volume:
+                target = None
+            else:
+                target = args[0]
+            size = None
+            if buffer_call:
+                size = args[2]
+            elif iovec_call:
+                size = sum(v.iov_len for v in args[1][:args[2]])
+            for hook in hooks:
+                hook.before_call(op, target, size)
+            # Looked up on every call, so that patching the handle works.
+            func = getattr(lib, name)
+            start = _clock()
+            pending = _aio_pending.get(args[-1]) if async_call else None
+            if pending is not None:
+                # Reported by _aio_complete() rather than here, as libgfapi
+                # may call back before func() returns.
+                _aio_pending[args[-1]] = pending[:4] + (_aio_hooked(
+                    hooks, op, target, size, start, _call_site()),)
+            try:
+                ret = func(*args)
+            except EnvironmentError as e:
+                # Raised by the errcheck of the call's prototype.
+                duration = _clock() - start
+                ret = None if handle else -1
+                for hook in hooks:
+                    hook.after_call(op, target, size, duration, ret, e.errno)
+                raise
+            duration = _clock() - start
+            err = None
+            if (not ret) if handle else (ret < 0):
+                err = ctypes.get_errno()
+            elif pending is not None:
+                return ret
+            for hook in hooks:
+                hook.after_call(op, target, size, duration, ret, err)
+            return ret
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
 
 
 class Volume(object):
@@ -177,35 +2163,335 @@ class Volume(object):
         # Add a reference so the module-level variable "api" doesn't
         # get yanked out from under us (see comment above File def'n).
         self._api = api
-        self.fs = api.glfs_new(volid)
-        api.glfs_set_volfile_server(self.fs, proto, host, port)
+        self.fs = self._api.glfs_new(volid)
+        self.stat_cache = None
+        self.negative_cache = None
+        self.op_stats = None
+        self.host = host
+        self.volid = volid
+        self._hooked_api = _HookedApi(api)
+        self._api.glfs_set_volfile_server(self.fs, proto, host, port)
 
     def __del__(self):
-        self._api.glfs_fini(self.fs)
+        # fs is not set if glfs_new() could not be called.
+        if getattr(self, "fs", None):
+            self._api.glfs_fini(self.fs)
         self._api = None
 
     def set_logging(self, path, level):
-        api.glfs_set_logging(self.fs, path, level)
+        self._api.glfs_set_logging(self.fs, path, level)
+
+    def set_stat_cache(self, ttl, maxsize=10000):
+        """
+        Cache stat() and lstat() results for 'ttl' seconds, keeping at most
+        'maxsize' of them.  A 'ttl' of 0 or None disables the cache.
+        """
+        if ttl:
+            self.stat_cache = StatCache(ttl, maxsize)
+        else:
+            self.stat_cache = None
+        return self.stat_cache
+
+    def set_negative_cache(self, ttl, maxsize=10000):
+        """
+        Remember for 'ttl' seconds the paths that stat() and lstat() found
+        missing (ENOENT), keeping at most 'maxsize' of them, so that probing
+        for them again costs no round trip.  Paths are forgotten when they
+        are created through this Volume; changes made by other clients go
+        unnoticed until the entry expires, so keep 'ttl' short.  A 'ttl' of
+        0 or None disables the cache.
+        """
+        if ttl:
+            self.negative_cache = NegativeCache(ttl, maxsize)
+        else:
+            self.negative_cache = None
+        return self.negative_cache
+
+    def add_hook(self, hook):
+        """
+        Call the CallHook 'hook' around every libgfapi call made through
+        this Volume and through the files and directories opened from it
+        from now on.  Without any hook installed, the calls go straight to
+        libgfapi.
+        """
+        hooked = self._hooked_api
+        hooked.hooks = hooked.hooks + (hook,)
+        self._api = hooked
+        return hook
+
+    def remove_hook(self, hook):
+        hooked = self._hooked_api
+        hooked.hooks = tuple(h for h in hooked.hooks if h is not hook)
+        if not hooked.hooks:
+            self._api = hooked._lib
+
+    def enable_stats(self, enabled=True):
+        """
+        Start (or, if 'enabled' is false, stop) counting the libgfapi calls
+        made through this Volume and through the files and directories
+        opened from it afterwards.  Returns the OpStats collector, or None.
+        """
+        if enabled:
+            if self.op_stats is None:
+                self.op_stats = self.add_hook(OpStats())
+        elif self.op_stats is not None:
+            self.remove_hook(self.op_stats)
+            self.op_stats = None
+        return self.op_stats
+
+    def stats(self, reset=False):
+        """
+        Return a snapshot of the per-operation statistics collected since
+        enable_stats() (see OpStats.snapshot()), empty if they are not
+        being collected.  With 'reset', the counters start over from zero.
+        """
+        if self.op_stats is None:
+            return {}
+        return self.op_stats.snapshot(reset)
+
+    def _invalidate(self, path, parent=True, tree=False, created=False):
+        if self.stat_cache is not None:
+            self.stat_cache.invalidate(path, parent, tree)
+        if created and self.negative_cache is not None:
+            self.negative_cache.invalidate(path, tree)
 
     def mount(self):
-        return api.glfs_init(self.fs)
+        return self._api.glfs_init(self.fs)
+
+    def umount(self):
+        """
+        Tear down the connection to the volume.  The Volume cannot be used
+        afterwards.
+        """
+        fs, self.fs = self.fs, None
+        if not fs:
+            return 0
+        ret = self._api.glfs_fini(fs)
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return ret
 
     # File operations, in alphabetical order.
 
+    def _map(self, func, items, workers):
+        """
+        Return [func(item) for item in items], running up to 'workers'
+        calls at a time on a thread pool.
+        """
+        if workers > 1 and ThreadPoolExecutor is not None:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                return list(executor.map(_with_call_site(func), items))
+            finally:
+                executor.shutdown(wait=True)
+        return [func(item) for item in items]
+
+    def _map_ranges(self, func, handles, ranges, workers):
+        """
+        Call func(h, offset, length) for each (offset, length) of 'ranges'
+        and return the sum of the results.  Up to 'workers' threads share
+        the ranges, each calling with the handles 'h' of its own entered
+        from the context manager handles().  The first error stops them
+        all and is raised.
+        """
+        todo = iter(ranges)
+        lock = threading.Lock()
+        failed = []
+
+        def _worker(worker):
+            total = 0
+            try:
+                with handles() as h:
+                    while not failed:
+                        with lock:
+                            item = next(todo, None)
+                        if item is None:
+                            break
+                        total += func(h, item[0], item[1])
+            except Exception:
+                # Stop the other workers.
+                failed.append(worker)
+                raise
+            return total
+
+        nworkers = min(workers, len(ranges))
+        return sum(self._map(_worker, range(nworkers), nworkers))
+
+    def _transfer(self, handles, move, ranges, workers, log, progress,
+                  done):
+        """
+        Run move(f, offset, length) on every (offset, length) of 'ranges'
+        but those at the offsets in 'done', completed earlier, and record
+        those completed in the _TransferLog 'log', if any.  Returns the
+        number of bytes moved.
+        """
+        total = sum(length for offset, length in ranges)
+        moved = [sum(length for offset, length in ranges if offset in done)]
+        lock = threading.Lock()
+
+        def _range(f, offset, length):
+            n = move(f, offset, length)
+            if n == length:
+                with lock:
+                    if log is not None:
+                        log.record(offset)
+                    moved[0] += n
+                    if progress is not None:
+                        progress(moved[0], total)
+            return n
+
+        finished = False
+        if log is not None:
+            log.open(resume=bool(done))
+        try:
+            count = self._map_ranges(
+                _range, handles,
+                [item for item in ranges if item[0] not in done], workers)
+            if moved[0] != total:
+                raise OSError(errno.EIO, "transferred %d of %d bytes" %
+                              (moved[0], total))
+            finished = True
+        finally:
+            if log is not None:
+                log.close(finished)
+        return count
+
+    def classify_many(self, paths, workers=8):
+        """
+        Return, in the order of 'paths', the type of each path: "dir",
+        "file", "link", "other" or "missing" (including a missing parent
+        directory), according to lstat().  For any other failure the OSError
+        is returned in place of the type.  Up to 'workers' paths are looked
+        up concurrently.
+        """
+        def _classify(path):
+            try:
+                mode = self.lstat(path).st_mode
+            except OSError as e:
+                if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                    return "missing"
+                return e
+            if stat.S_ISDIR(mode):
+                return "dir"
+            if stat.S_ISREG(mode):
+                return "file"
+            if stat.S_ISLNK(mode):
+                return "link"
+            return "other"
+        return self._map(_classify, paths, workers)
+
+    def copyfile(self, src, dst, workers=4, chunk=COPY_CHUNK,
+                 dst_volume=None):
+        """
+        Copy the contents and permission bits of file 'src' to 'dst', on
+        'dst_volume' if given or else on this volume, and return the number
+        of bytes copied.  The data of the file is copied in ranges of
+        'chunk' bytes by up to 'workers' threads, each with file descriptors
+        of its own, so that several bricks and connections are busy at
+        once; holes are skipped, and left as holes in the target, which is
+        preallocated if there are none.  Within a volume the data is copied
+        server side when libgfapi and the bricks support it.  Raises
+        OSError(EIO) if the target does not end up as long as the source.
+        """
+        if dst_volume is None:
+            dst_volume = self
+        st = self.stat(src)
+        with self.open(src, os.O_RDONLY) as fin:
+            # The size as seen by lseek(), as the extents are, so that the
+            # end of a file that shrank since stat() is not taken for a hole.
+            size = fin.lseek(0, os.SEEK_END)
+            ranges = _chunks(fin.extents(0, size), chunk)
+        data = sum(length for offset, length in ranges)
+        with dst_volume.creat(dst, os.O_WRONLY | os.O_TRUNC,
+                              stat.S_IMODE(st.st_mode)) as f:
+            if data == size and size:
+                _preallocate(f, size)
+            if data != size:
+                f.ftruncate(size)
+
+        offload = [dst_volume is self]
+
+        @contextmanager
+        def _files():
+            with self.open(src, os.O_RDONLY) as fin:
+                with dst_volume.open(dst, os.O_WRONLY) as fout:
+                    yield fin, fout
+
+        def _copy(files, offset, length):
+            return _copy_range(files[0], files[1], offset, length, offload)
+
+        copied = self._map_ranges(_copy, _files, ranges, workers)
+        if copied != data or dst_volume.getsize(dst) != size:
+            raise OSError(errno.EIO, "copied %d of the %d bytes of %r" %
+                          (copied, data, src))
+        return copied
+
     @contextmanager
     def creat(self, path, flags, mode):
-        fd = api.glfs_creat(self.fs, path, flags, mode)
+        fd = self._api.glfs_creat(self.fs, path, flags, mode)
+        self._invalidate(path, created=True)
         if not fd:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
 
         fileobj = None
         try:
-            fileobj = File(fd)
+            fileobj = File(fd, path, self.stat_cache, self._api)
             yield fileobj
         finally:
             fileobj.close()
 
+    def download(self, remote_path, local_path, workers=4, chunk=COPY_CHUNK,
+                 progress=None, resume=False):
+        """
+        Copy the file 'remote_path' of the volume to the local file
+        'local_path' and return the number of bytes received.  The local
+        file is mapped in memory, and up to 'workers' threads read ranges of
+        'chunk' bytes of the remote file straight into the mapping.  The
+        holes of the remote file are skipped and left as holes in the local
+        file.  See upload() for 'progress' and 'resume'.
+        """
+        st = self.stat(remote_path)
+        with self.open(remote_path, os.O_RDONLY) as f:
+            size = f.lseek(0, os.SEEK_END)
+            ranges = _chunks(f.extents(0, size), chunk)
+        log = None
+        done = set()
+        if resume:
+            log = _TransferLog(local_path, size, st.st_mtime, chunk,
+                               (self.host, self.volid, remote_path))
+            if os.path.exists(local_path):
+                done = log.completed()
+        fd = os.open(local_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if not done:
+                os.ftruncate(fd, 0)
+            os.ftruncate(fd, size)
+            if not size:
+                return 0
+            mm = mmap.mmap(fd, size)
+
+            def _read(f, offset, length):
+                n = 0
+                while n < length:
+                    ret = f.preadinto(_writable_buffer(mm, offset + n,
+                                                       length - n),
+                                      offset + n)
+                    if not ret:
+                        break
+                    n += ret
+                return n
+
+            try:
+                return self._transfer(
+                    lambda: self.open(remote_path, os.O_RDONLY), _read,
+                    ranges, workers, log, progress, done)
+            finally:
+                _close_mmap(mm)
+        finally:
+            os.close(fd)
+
     def exists(self, path):
         """
         Test whether a path exists.
@@ -217,19 +2503,86 @@ class Volume(object):
             return False
         return True
 
+    def fopen(self, path, mode="r", buffering=-1, readahead=0):
+        """
+        Open a file the way the builtin open() does and return an io stream
+        (buffered, and decoded unless 'mode' contains "b") built on top of
+        GlusterRawIO.  'readahead' is the size of the background read-ahead
+        window, 0 to disable it.  The caller must close the stream.
+        """
+        if "+" in mode:
+            flags = os.O_RDWR
+        elif "r" in mode:
+            flags = os.O_RDONLY
+        else:
+            flags = os.O_WRONLY
+        if "w" in mode:
+            flags |= os.O_CREAT | os.O_TRUNC
+        elif "a" in mode:
+            flags |= os.O_CREAT | os.O_APPEND
+        elif "x" in mode:
+            flags |= os.O_CREAT | os.O_EXCL
+
+        if flags & os.O_CREAT:
+            fd = self._api.glfs_creat(self.fs, path, flags, 0o666)
+            self._invalidate(path, created=True)
+        else:
+            fd = self._api.glfs_open(self.fs, path, flags)
+        if not fd:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        fileobj = File(fd, path, self.stat_cache, self._api)
+        try:
+            raw = GlusterRawIO(fileobj, mode, readahead)
+        except Exception:
+            fileobj.close()
+            raise
+        if buffering == 0:
+            if "b" not in mode:
+                raise ValueError("can't have unbuffered text I/O")
+            return raw
+        if buffering < 0:
+            buffering = io.DEFAULT_BUFFER_SIZE
+        if "+" in mode:
+            stream = io.BufferedRandom(raw, buffering)
+        elif raw.readable():
+            stream = io.BufferedReader(raw, buffering)
+        else:
+            stream = io.BufferedWriter(raw, buffering)
+        if "b" in mode:
+            return stream
+        return io.TextIOWrapper(stream)
+
     def getsize(self, filename):
         """
         Return the size of a file, reported by stat()
         """
         return self.stat(filename).st_size
 
-    def getxattr(self, path, key, maxlen):
-        buf = ctypes.create_string_buffer(maxlen)
-        rc = api.glfs_getxattr(self.fs, path, key, buf, maxlen)
-        if rc < 0:
-            err = ctypes.get_errno()
-            raise IOError(err, os.strerror(err))
-        return buf.value[:rc]
+    def getxattr(self, path, key, maxlen=None):
+        """
+        Return the value of extended attribute 'key' of 'path'.  The value
+        buffer is sized automatically unless 'maxlen' is given.
+        """
+        return _xattr_call(self._api.glfs_getxattr, (self.fs, path, key),
+                           maxlen)
+
+    def getxattrs(self, path, keys=None):
+        """
+        Return a dict of the extended attributes of 'path': all of them, or
+        those of 'keys' that are set.
+        """
+        if keys is None:
+            keys = self.listxattr(path)
+        xattrs = {}
+        for key in keys:
+            try:
+                xattrs[key] = self.getxattr(path, key)
+            except IOError as e:
+                if e.errno != errno.ENODATA:
+                    raise
+        return xattrs
 
     def isdir(self, path):
         """
@@ -261,40 +2614,30 @@ class Volume(object):
             return False
         return stat.S_ISLNK(s.st_mode)
 
+    def listdir_stat(self, path):
+        """
+        Return a list of (name, stat) pairs for the entries of directory
+        'path', other than "." and "..", as returned by lstat().  The stats
+        come with the listing (readdirplus), not from one lstat per entry.
+        """
+        return [(e.name, e.stat(follow_symlinks=False))
+                for e in self.scandir(path, readdirplus=True)]
+
     def listxattr(self, path):
-        buf = ctypes.create_string_buffer(512)
-        rc = api.glfs_listxattr(self.fs, path, buf, 512)
-        if rc < 0:
-            err = ctypes.get_errno()
-            raise IOError(err, os.strerror(err))
-        xattrs = []
-        # Parsing character by character is ugly, but it seems like the
-        # easiest way to deal with the "strings separated by NUL in one
-        # buffer" format.
-        i = 0
-        while i < rc:
-            new_xa = buf.raw[i]
-            i += 1
-            while i < rc:
-                next_char = buf.raw[i]
-                i += 1
-                if next_char == '\0':
-                    xattrs.append(new_xa)
-                    break
-                new_xa += next_char
-        xattrs.sort()
-        return xattrs
+        return _xattr_names(_xattr_call(self._api.glfs_listxattr,
+                                        (self.fs, path)))
 
-    def lstat(self, path):
-        s = Stat()
-        rc = api.glfs_lstat(self.fs, path, ctypes.byref(s))
-        if rc < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
-        return s
+    def lstat(self, path, raw=False):
+        """
+        Return the status of 'path', without following symbolic links, as a
+        StatResult, or as the raw Stat structure if 'raw' is true (which
+        bypasses the caches).
+        """
+        return self._stat(self._api.glfs_lstat, path, False, raw)
 
     def mkdir(self, path, mode):
-        ret = api.glfs_mkdir(self.fs, path, mode)
+        ret = self._api.glfs_mkdir(self.fs, path, mode)
+        self._invalidate(path, created=True)
         if ret < 0:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
@@ -302,74 +2645,551 @@ class Volume(object):
 
     @contextmanager
     def open(self, path, flags):
-        fd = api.glfs_open(self.fs, path, flags)
+        fd = self._api.glfs_open(self.fs, path, flags)
+        if flags & os.O_TRUNC:
+            self._invalidate(path, parent=False)
         if not fd:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
 
         fileobj = None
         try:
-            fileobj = File(fd)
+            fileobj = File(fd, path, self.stat_cache, self._api)
             yield fileobj
         finally:
             fileobj.close()
 
     def opendir(self, path):
-        fd = api.glfs_opendir(self.fs, path)
+        fd = self._api.glfs_opendir(self.fs, path)
         if not fd:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
-        return Dir(fd)
+        return Dir(fd, self._api)
 
     def removexattr(self, path, key):
-        ret = api.glfs_removexattr(self.fs, path, key)
+        ret = self._api.glfs_removexattr(self.fs, path, key)
+        self._invalidate(path, parent=False)
         if ret < 0:
             err = ctypes.get_errno()
             raise IOError(err, os.strerror(err))
         return ret
 
     def rename(self, opath, npath):
-        ret = api.glfs_rename(self.fs, opath, npath)
+        ret = self._api.glfs_rename(self.fs, opath, npath)
+        self._invalidate(opath, tree=True)
+        self._invalidate(npath, tree=True, created=True)
         if ret < 0:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
         return ret
 
     def rmdir(self, path):
-        ret = api.glfs_rmdir(self.fs, path)
+        ret = self._api.glfs_rmdir(self.fs, path)
+        self._invalidate(path, tree=True)
         if ret < 0:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
         return ret
 
+    def scandir(self, path, readdirplus=False):
+        """
+        Iterate over the entries of directory 'path', other than "." and
+        "..", yielding DirEntry objects.  A single Dirent (and Stat) buffer
+        is reused for the whole listing.  With 'readdirplus', each entry's
+        lstat() is returned by the same readdir call and cached on the
+        DirEntry.
+        """
+        d = self.opendir(path)
+        entry = Dirent()
+        cursor = ctypes.POINTER(Dirent)()
+        s = Stat()
+        while True:
+            if readdirplus:
+                s.st_mode = 0
+                rc = self._api.glfs_readdirplus_r(d.fd, ctypes.byref(s),
+                                                  ctypes.byref(entry),
+                                                  ctypes.byref(cursor))
+            else:
+                rc = self._api.glfs_readdir_r(d.fd, ctypes.byref(entry),
+                                              ctypes.byref(cursor))
+            if rc < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            if not cursor:
+                return
+            name = entry.d_name
+            if name in (b".", b".."):
+                continue
+            dirent = DirEntry(self, os.path.join(path, name), name,
+                              entry.d_ino, ord(entry.d_type))
+            # Entries the server sent no attributes for come back zeroed.
+            if readdirplus and s.st_mode:
+                dirent._lstat = StatResult.from_stat(s)
+            yield dirent
+
     def setxattr(self, path, key, value, vlen):
-        ret = api.glfs_setxattr(self.fs, path, key, value, vlen, 0)
+        ret = self._api.glfs_setxattr(self.fs, path, key, value, vlen, 0)
+        self._invalidate(path, parent=False)
         if ret < 0:
             err = ctypes.get_errno()
             raise IOError(err, os.strerror(err))
         return ret
 
-    def stat(self, path):
+    def _stat(self, func, path, follow_symlinks, raw):
+        negative = None if raw else self.negative_cache
+        if negative is not None:
+            if negative.get(path, follow_symlinks):
+                raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+            negative_generation = negative.generation
+        cache = None if raw else self.stat_cache
+        if cache is not None:
+            s = cache.get(path, follow_symlinks)
+            if s is not None:
+                return s
+            generation = cache.generation
         s = Stat()
-        rc = api.glfs_stat(self.fs, path, ctypes.byref(s))
-        if rc < 0:
-            err = ctypes.get_errno()
-            raise OSError(err, os.strerror(err))
+        try:
+            rc = func(self.fs, path, ctypes.byref(s))
+            if rc < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+        except OSError as e:
+            if e.errno == errno.ENOENT and negative is not None:
+                negative.put(path, follow_symlinks, negative_generation)
+            raise
+        if raw:
+            return s
+        s = StatResult.from_stat(s)
+        if cache is not None:
+            cache.put(path, follow_symlinks, s, generation)
         return s
 
+    def stat(self, path, raw=False):
+        """
+        Return the status of 'path' as a StatResult, or as the raw Stat
+        structure if 'raw' is true (which bypasses the caches).
+        """
+        return self._stat(self._api.glfs_stat, path, True, raw)
+
+    def stat_many(self, paths, follow_symlinks=True, workers=8):
+        """
+        Return, in the order of 'paths', the stat() (or lstat(), if
+        'follow_symlinks' is false) of each path, or the OSError it failed
+        with.  Up to 'workers' paths are looked up concurrently, so the
+        whole batch costs about one round trip per 'workers' paths.
+        """
+        func = self.stat if follow_symlinks else self.lstat
+
+        def _stat(path):
+            try:
+                return func(path)
+            except OSError as e:
+                return e
+        return self._map(_stat, paths, workers)
+
     def symlink(self, source, link_name):
         """
         Create a symbolic link 'link_name' which points to 'source'
         """
-        ret = api.glfs_symlink(self.fs, source, link_name)
+        ret = self._api.glfs_symlink(self.fs, source, link_name)
+        self._invalidate(link_name, tree=True, created=True)
         if ret < 0:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
         return ret
 
     def unlink(self, path):
-        ret = api.glfs_unlink(self.fs, path)
+        ret = self._api.glfs_unlink(self.fs, path)
+        self._invalidate(path)
         if ret < 0:
             err = ctypes.get_errno()
             raise OSError(err, os.strerror(err))
         return ret
+
+    def upload(self, local_path, remote_path, workers=4, chunk=COPY_CHUNK,
+               progress=None, resume=False):
+        """
+        Copy the local file 'local_path' to 'remote_path' on the volume and
+        return the number of bytes sent.  The local file is mapped in
+        memory, and up to 'workers' threads write ranges of 'chunk' bytes
+        of the mapping straight to the remote file.  The holes of the local
+        file are skipped and left as holes in the remote file.
+
+        'progress', if given, is called as progress(done, total), in bytes
+        of data (holes excluded), after every range.  With 'resume', the
+        ranges completed are logged in the file local_path + ".transfer"
+        until the transfer succeeds, and those logged by an interrupted
+        transfer between the same files, the source having kept its size
+        and modification time, are not transferred again.
+        """
+        with open(local_path, "rb") as local:
+            st = os.fstat(local.fileno())
+            size = st.st_size
+            ranges = _chunks(_extents(functools.partial(os.lseek,
+                                                        local.fileno()),
+                                      0, size), chunk)
+            data = sum(length for offset, length in ranges)
+            log = None
+            done = set()
+            if resume:
+                log = _TransferLog(local_path, size, st.st_mtime, chunk,
+                                   (self.host, self.volid, remote_path))
+                if self.exists(remote_path):
+                    done = log.completed()
+            flags = os.O_WRONLY if done else os.O_WRONLY | os.O_TRUNC
+            with self.creat(remote_path, flags,
+                            stat.S_IMODE(st.st_mode)) as f:
+                if data == size and size and not done:
+                    _preallocate(f, size)
+                if data != size:
+                    f.ftruncate(size)
+            if not size:
+                return 0
+            mm = mmap.mmap(local.fileno(), size, access=mmap.ACCESS_READ)
+
+            def _write(f, offset, length):
+                return f.pwrite(_slice(mm, offset, length), offset)
+
+            try:
+                sent = self._transfer(
+                    lambda: self.open(remote_path, os.O_WRONLY), _write,
+                    ranges, workers, log, progress, done)
+            finally:
+                _close_mmap(mm)
+        if self.getsize(remote_path) != size:
+            raise OSError(errno.EIO, "%r is not %d bytes long" %
+                          (remote_path, size))
+        return sent
+
+    def _walk_listdir(self, path, followlinks, sort):
+        """
+        List 'path' for walk(): returns the names of its subdirectories, of
+        its other entries, and the subset of subdirectories that are
+        symbolic links and must not be descended into.
+        """
+        dirs, nondirs, links = [], [], set()
+        for entry in self.scandir(path):
+            if entry.is_dir():
+                dirs.append(entry.name)
+                if not followlinks and entry.is_symlink():
+                    links.add(entry.name)
+            else:
+                nondirs.append(entry.name)
+        if sort:
+            dirs.sort()
+            nondirs.sort()
+        return dirs, nondirs, links
+
+    def walk(self, top, topdown=True, onerror=None, followlinks=False,
+             workers=1, max_pending=None, sort=False):
+        """
+        Directory tree generator with the semantics of os.walk(): yields
+        (dirpath, dirnames, filenames) for 'top' and each directory below
+        it, and 'dirnames' may be pruned in place when 'topdown' is true.
+
+        With 'workers' greater than one, the directories coming next in the
+        walk are listed ahead of time on a thread pool, at most
+        'max_pending' (default: four per worker) at a time.  The order of
+        the results is the same as with a single worker; 'sort' makes it
+        independent of the order in which the server returns entries.
+        """
+        executor = None
+        if workers > 1 and ThreadPoolExecutor is not None:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            listdir = _with_call_site(self._walk_listdir)
+        max_pending = max_pending or 4 * workers
+        args = (followlinks, sort)
+
+        # Items are either [path, future-or-None] directories to list, or
+        # (dirpath, dirnames, filenames) tuples waiting to be yielded
+        # after their subdirectories when walking bottom up.
+        stack = [[top, None]]
+        pending = 0
+        try:
+            while stack:
+                item = stack.pop()
+                if isinstance(item, tuple):
+                    yield item
+                    continue
+                path, future = item
+                try:
+                    if future is not None:
+                        pending -= 1
+                        dirs, nondirs, links = future.result()
+                    else:
+                        dirs, nondirs, links = self._walk_listdir(path, *args)
+                except OSError as err:
+                    if onerror is not None:
+                        onerror(err)
+                    continue
+
+                if topdown:
+                    yield path, dirs, nondirs
+                else:
+                    stack.append((path, dirs, nondirs))
+                for name in reversed(dirs):
+                    if name not in links:
+                        stack.append([os.path.join(path, name), None])
+
+                if executor is None:
+                    continue
+                # Start listing the directories that are next in line.
+                for item in reversed(stack):
+                    if pending >= max_pending:
+                        break
+                    if isinstance(item, list) and item[1] is None:
+                        item[1] = executor.submit(listdir, item[0], *args)
+                        pending += 1
+        finally:
+            if executor is not None:
+                for item in stack:
+                    if isinstance(item, list) and item[1] is not None:
+                        item[1].cancel()
+                executor.shutdown(wait=True)
+
+
+def _pool_method(name):
+    def method(self, *args, **kwargs):
+        with self.volume() as vol:
+            return getattr(vol, name)(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = "Volume.%s() on the next volume of the pool" % name
+    return method
+
+
+class VolumePool(object):
+    """
+    A set of 'size' independent connections (glfs_t instances) to the same
+    volume, so that concurrent threads are not all funneled through a single
+    client graph.  Each operation is dispatched to one of the volumes, either
+    in turn ("round-robin") or to the one with the fewest calls in progress
+    ("least-busy").
+    """
+
+    policies = ("round-robin", "least-busy")
+
+    def __init__(self, host, volid, size=4, proto="tcp", port=24007,
+                 policy="round-robin"):
+        if policy not in self.policies:
+            raise ValueError("unknown dispatch policy: %s" % policy)
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.policy = policy
+        self.volumes = [Volume(host, volid, proto, port)
+                        for i in range(size)]
+        self._busy = [0] * size
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def set_logging(self, path, level):
+        for vol in self.volumes:
+            vol.set_logging(path, level)
+
+    def mount(self):
+        """
+        Mount every volume of the pool, in parallel, so that the pool is
+        fully warmed up when this returns.  Raises OSError if any of them
+        fails.
+        """
+        errors = []
+
+        def _mount(vol):
+            if vol.mount() < 0:
+                errors.append(ctypes.get_errno())
+
+        threads = [threading.Thread(target=_mount, args=(vol,))
+                   for vol in self.volumes]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise OSError(errors[0], os.strerror(errors[0]))
+        return 0
+
+    def umount(self):
+        for vol in self.volumes:
+            vol.umount()
+        return 0
+
+    def _acquire(self):
+        with self._lock:
+            if self.policy == "least-busy":
+                i = self._busy.index(min(self._busy))
+            else:
+                i = next(self._next) % len(self.volumes)
+            self._busy[i] += 1
+        return i
+
+    def _release(self, i):
+        with self._lock:
+            self._busy[i] -= 1
+
+    @contextmanager
+    def volume(self):
+        """
+        Pick a volume according to the dispatch policy and hold it for the
+        duration of the with block.
+        """
+        i = self._acquire()
+        try:
+            yield self.volumes[i]
+        finally:
+            self._release(i)
+
+    # Volume operations, in alphabetical order.
+
+    @contextmanager
+    def creat(self, path, flags, mode):
+        with self.volume() as vol:
+            with vol.creat(path, flags, mode) as fileobj:
+                yield fileobj
+
+    exists = _pool_method("exists")
+    getsize = _pool_method("getsize")
+    getxattr = _pool_method("getxattr")
+    isdir = _pool_method("isdir")
+    isfile = _pool_method("isfile")
+    islink = _pool_method("islink")
+    listxattr = _pool_method("listxattr")
+    lstat = _pool_method("lstat")
+    mkdir = _pool_method("mkdir")
+
+    @contextmanager
+    def open(self, path, flags):
+        with self.volume() as vol:
+            with vol.open(path, flags) as fileobj:
+                yield fileobj
+
+    opendir = _pool_method("opendir")
+    removexattr = _pool_method("removexattr")
+    rename = _pool_method("rename")
+    rmdir = _pool_method("rmdir")
+    setxattr = _pool_method("setxattr")
+    stat = _pool_method("stat")
+    symlink = _pool_method("symlink")
+    unlink = _pool_method("unlink")
+
+
+def _async_method(name):
+    def method(self, *args):
+        return self.submit(getattr(self.volume, name), *args)
+    method.__name__ = name
+    method.__doc__ = "Awaitable Volume.%s()" % name
+    return method
+
+
+class AsyncVolume(object):
+    """
+    Awaitable front-end to the metadata operations of a Volume, e.g.:
+
+        st = await avol.stat(path)
+
+    Calls run on a pool of 'workers' threads; ctypes drops the GIL while
+    libgfapi waits on the network, so they really overlap.  At most
+    'max_pending' calls (default: 'workers') are handed to the pool at a
+    time, and at most 'max_queued' others (default: 64 times 'max_pending')
+    wait for their turn in FIFO order; they are dropped if cancelled before
+    they start.  Calls beyond that raise asyncio.QueueFull, so producers
+    should wait for room with admit(), e.g.:
+
+        for path in paths:
+            await avol.admit()
+            futures.append(avol.stat(path))
+
+    An AsyncVolume must only be used from one event loop.
+    """
+
+    def __init__(self, volume, workers=8, max_pending=None, max_queued=None):
+        if asyncio is None or ThreadPoolExecutor is None:
+            raise RuntimeError("AsyncVolume requires asyncio and "
+                               "concurrent.futures")
+        self.volume = volume
+        self.max_pending = max_pending or workers
+        self.max_queued = max_queued or 64 * self.max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._running = 0
+        self._waiting = collections.deque()
+        # admit() futures waiting for room, and the number of places they
+        # were given in the queue that have not been submitted to yet.
+        self._admitting = collections.deque()
+        self._reserved = 0
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def admit(self):
+        """
+        Return an asyncio future resolved once there is room in the queue
+        for one more call, which is then kept for the next submit().
+        """
+        future = _aio_future(asyncio.get_event_loop())
+        self._admitting.append(future)
+        self._admit()
+        return future
+
+    def _admit(self):
+        while (self._admitting and
+               len(self._waiting) + self._reserved < self.max_queued):
+            future = self._admitting.popleft()
+            if not future.cancelled():
+                self._reserved += 1
+                future.set_result(None)
+
+    def submit(self, func, *args):
+        """
+        Schedule func(*args) on the worker pool and return an asyncio future
+        for its result.  Raises asyncio.QueueFull if 'max_queued' calls are
+        already waiting and no room was kept with admit().
+        """
+        if self._reserved:
+            self._reserved -= 1
+        elif len(self._waiting) >= self.max_queued:
+            raise asyncio.QueueFull()
+        loop = asyncio.get_event_loop()
+        future = _aio_future(loop)
+        self._waiting.append((loop, future, _with_call_site(func), args))
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+        while self._waiting and self._running < self.max_pending:
+            loop, future, func, args = self._waiting.popleft()
+            if future.cancelled():
+                continue
+            self._running += 1
+            inner = loop.run_in_executor(self._executor, func, *args)
+            inner.add_done_callback(functools.partial(self._done, future))
+        self._admit()
+
+    def _done(self, future, inner):
+        self._running -= 1
+        if inner.cancelled():
+            future.cancel()
+        elif not future.cancelled():
+            exc = inner.exception()
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(inner.result())
+        self._dispatch()
+
+    # Volume operations, in alphabetical order.
+
+    exists = _async_method("exists")
+    getsize = _async_method("getsize")
+    getxattr = _async_method("getxattr")
+    isdir = _async_method("isdir")
+    isfile = _async_method("isfile")
+    islink = _async_method("islink")
+    listxattr = _async_method("listxattr")
+    lstat = _async_method("lstat")
+    mkdir = _async_method("mkdir")
+    opendir = _async_method("opendir")
+    removexattr = _async_method("removexattr")
+    rename = _async_method("rename")
+    rmdir = _async_method("rmdir")
+    setxattr = _async_method("setxattr")
+    stat = _async_method("stat")
+    symlink = _async_method("symlink")
+    unlink = _async_method("unlink")
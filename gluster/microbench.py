@@ -0,0 +1,358 @@
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmarks of the Python side cost of the gluster.gfapi methods.
+
+    python -m gluster.microbench --baseline tools/microbench_baseline.json
+    python -m gluster.microbench --save tools/microbench_baseline.json
+
+The libgfapi handle is replaced by NullApi, whose calls return at once, so
+what is measured is the argument conversion, buffer and structure
+allocation and error checking done by each Volume and File method.  Costs
+are reported relative to a reference piece of Python code, which makes them
+comparable between machines, and the run fails when a method is more than
+--tolerance slower than in the baseline recorded for the running Python.
+"""
+
+import ctypes
+import json
+import optparse
+import os
+import platform
+import sys
+import timeit
+
+from contextlib import contextmanager
+
+from gluster import gfapi
+
+
+def _zero(*args):
+    return 0
+
+
+class NullApi(object):
+    """
+    Stand-in for the libgfapi handle, gfapi.api, whose calls all succeed
+    without doing anything: handles are 1, I/O calls transfer everything
+    they are asked to, and the other calls return 0.  Directories list
+    'entries' names (not counting "." and "..").
+    """
+
+    def __init__(self, entries=0):
+        self.entries = entries
+        self._left = 0
+        self._names = [b".", b".."] + [("e%06d" % i).encode()
+                                       for i in range(entries)]
+
+    def __getattr__(self, name):
+        if not name.startswith("glfs_"):
+            raise AttributeError(name)
+        return _zero
+
+    def glfs_new(self, volid):
+        return 1
+
+    def glfs_creat(self, fs, path, flags, mode):
+        return 1
+
+    def glfs_open(self, fs, path, flags):
+        return 1
+
+    def glfs_opendir(self, fs, path):
+        self._left = len(self._names)
+        return 1
+
+    def glfs_read(self, fd, buf, size, flags=0):
+        return size
+
+    def glfs_write(self, fd, buf, size, flags=0):
+        return size
+
+    def glfs_pread(self, fd, buf, size, offset, flags):
+        return size
+
+    def glfs_pwrite(self, fd, buf, size, offset, flags):
+        return size
+
+    def glfs_readv(self, fd, iov, iovcnt, flags):
+        return sum(v.iov_len for v in iov[:iovcnt])
+
+    glfs_writev = glfs_readv
+
+    def glfs_preadv(self, fd, iov, iovcnt, offset, flags):
+        return sum(v.iov_len for v in iov[:iovcnt])
+
+    glfs_pwritev = glfs_preadv
+
+    def glfs_lseek(self, fd, offset, whence):
+        return offset
+
+    def glfs_readdir_r(self, fd, entry, result):
+        cursor = result._obj
+        if not self._left:
+            ctypes.memset(ctypes.addressof(cursor), 0, ctypes.sizeof(cursor))
+            return 0
+        entry = entry._obj
+        entry.d_name = self._names[-self._left]
+        self._left -= 1
+        cursor.contents = entry
+        return 0
+
+    def glfs_readdirplus_r(self, fd, buf, entry, result):
+        return self.glfs_readdir_r(fd, entry, result)
+
+
+@contextmanager
+def null_api(entries=0):
+    """
+    Make the Volumes created within the block use a NullApi instead of
+    libgfapi.
+    """
+    saved = gfapi.api
+    gfapi.api = NullApi(entries)
+    try:
+        yield gfapi.api
+    finally:
+        gfapi.api = saved
+
+
+# Public Volume and File methods that are not timed: configuration, the
+# asynchronous methods, which need an event loop, and whole-file transfers
+# between the volume and local files, which gluster.bench measures.
+UNTIMED = frozenset([
+    "Volume.add_hook", "Volume.enable_stats", "Volume.mount",
+    "Volume.remove_hook", "Volume.set_logging", "Volume.set_negative_cache",
+    "Volume.set_stat_cache", "Volume.stats", "Volume.umount",
+    "Volume.copyfile", "Volume.download", "Volume.upload",
+    "File.afsync", "File.apread", "File.apwrite", "File.aread",
+    "File.areadinto", "File.awrite",
+])
+
+
+def _cases(vol, f):
+    """
+    Return the (name, callable) pairs to time, one call of each being one
+    call of the method named
+    """
+    buf = bytearray(4096)
+    block = b"x" * 4096
+    bufs = [bytearray(1024) for _ in range(4)]
+    blocks = [b"x" * 1024 for _ in range(4)]
+
+    def open_close():
+        with vol.open(b"file", os.O_RDONLY):
+            pass
+
+    def creat_close():
+        with vol.creat(b"file", os.O_WRONLY, 0o644):
+            pass
+
+    return [
+        ("Volume.stat", lambda: vol.stat(b"file")),
+        ("Volume.lstat", lambda: vol.lstat(b"file")),
+        ("Volume.exists", lambda: vol.exists(b"file")),
+        ("Volume.isdir", lambda: vol.isdir(b"file")),
+        ("Volume.isfile", lambda: vol.isfile(b"file")),
+        ("Volume.islink", lambda: vol.islink(b"file")),
+        ("Volume.getsize", lambda: vol.getsize(b"file")),
+        ("Volume.stat_many", lambda: vol.stat_many([b"file"], workers=1)),
+        ("Volume.classify_many",
+         lambda: vol.classify_many([b"file"], workers=1)),
+        ("Volume.getxattr", lambda: vol.getxattr(b"file", b"user.key")),
+        ("Volume.getxattrs",
+         lambda: vol.getxattrs(b"file", [b"user.key"])),
+        ("Volume.listxattr", lambda: vol.listxattr(b"file")),
+        ("Volume.setxattr",
+         lambda: vol.setxattr(b"file", b"user.key", b"value", 5)),
+        ("Volume.removexattr",
+         lambda: vol.removexattr(b"file", b"user.key")),
+        ("Volume.mkdir", lambda: vol.mkdir(b"dir", 0o755)),
+        ("Volume.rmdir", lambda: vol.rmdir(b"dir")),
+        ("Volume.unlink", lambda: vol.unlink(b"file")),
+        ("Volume.rename", lambda: vol.rename(b"file", b"other")),
+        ("Volume.symlink", lambda: vol.symlink(b"file", b"link")),
+        ("Volume.open", open_close),
+        ("Volume.creat", creat_close),
+        ("Volume.fopen", lambda: vol.fopen(b"file", "rb").close()),
+        ("Volume.opendir", lambda: vol.opendir(b"dir")),
+        ("Volume.scandir", lambda: list(vol.scandir(b"dir"))),
+        ("Volume.listdir_stat", lambda: vol.listdir_stat(b"dir")),
+        ("Volume.walk", lambda: list(vol.walk(b"dir"))),
+        ("File.close", lambda: gfapi.File(1).close()),
+        ("File.read", lambda: f.read(4096)),
+        ("File.readinto", lambda: f.readinto(buf)),
+        ("File.pread", lambda: f.pread(4096, 0)),
+        ("File.preadinto", lambda: f.preadinto(buf, 0)),
+        ("File.write", lambda: f.write(block)),
+        ("File.pwrite", lambda: f.pwrite(block, 0)),
+        ("File.readv", lambda: f.readv(bufs)),
+        ("File.preadv", lambda: f.preadv(bufs, 0)),
+        ("File.writev", lambda: f.writev(blocks)),
+        ("File.pwritev", lambda: f.pwritev(blocks, 0)),
+        ("File.lseek", lambda: f.lseek(0, os.SEEK_SET)),
+        ("File.tell", f.tell),
+        ("File.extents", lambda: list(f.extents(0, 4096))),
+        ("File.fsync", f.fsync),
+        ("File.ftruncate", lambda: f.ftruncate(4096)),
+        ("File.fallocate", lambda: f.fallocate(0, 0, 4096)),
+        ("File.discard", lambda: f.discard(0, 4096)),
+        ("File.copy_file_range", lambda: f.copy_file_range(f, 4096, 0, 0)),
+        ("File.fgetxattr", lambda: f.fgetxattr(b"user.key")),
+        ("File.flistxattr", f.flistxattr),
+        ("File.fsetxattr", lambda: f.fsetxattr(b"user.key", b"value")),
+        ("File.fremovexattr", lambda: f.fremovexattr(b"user.key")),
+    ]
+
+
+def _reference():
+    """
+    The unit costs are measured in: allocating a small ctypes buffer and
+    making a function call, the typical minimum of work around a libgfapi
+    call, which tracks the speed of the machine more steadily than a bare
+    function call does.
+    """
+    ctypes.create_string_buffer(64)
+    return _zero(1, 2, 3)
+
+
+def _ratio(func, number, repeat):
+    """
+    Time 'func' and _reference() alternately 'repeat' times and return the
+    median of the ratios, which is robust to the machine speeding up or
+    slowing down during the run
+    """
+    ratios = sorted(timeit.Timer(func).timeit(number) /
+                    timeit.Timer(_reference).timeit(number)
+                    for _ in range(repeat))
+    return ratios[len(ratios) // 2]
+
+
+def measure(number=5000, repeat=5, names=None):
+    """
+    Return a dict mapping each method benchmarked (out of 'names', default
+    all of them) to its cost per call in units of _reference(), and the
+    cost of _reference() in seconds
+    """
+    with null_api(entries=1):
+        vol = gfapi.Volume("localhost", "null")
+        f = gfapi.File(1, b"file")
+        ratios = {}
+        for name, func in _cases(vol, f):
+            if names is None or name in names:
+                ratios[name] = _ratio(func, number, repeat)
+    ref = min(timeit.Timer(_reference).repeat(repeat, number)) / number
+    return ratios, ref
+
+
+def baseline_key():
+    """
+    Key of the running Python in the baseline file: costs differ too much
+    between implementations and versions to be compared across them.
+    """
+    return "%s-%s" % (platform.python_implementation().lower(),
+                      ".".join(platform.python_version_tuple()[:2]))
+
+
+def compare(ratios, baseline, tolerance):
+    """
+    Return the (name, ratio, baseline ratio) of the methods more than
+    'tolerance' (a fraction) slower than in 'baseline'
+    """
+    regressions = []
+    for name in sorted(ratios):
+        base = baseline.get(name)
+        if base is not None and ratios[name] > base * (1 + tolerance):
+            regressions.append((name, ratios[name], base))
+    return regressions
+
+
+def make_parser():
+    parser = optparse.OptionParser(
+        prog="python -m gluster.microbench",
+        description="Measure the Python side cost of the gluster.gfapi "
+        "methods and check it against a baseline.")
+    add = parser.add_option
+    add("--baseline", help="fail if a method is slower than recorded in "
+        "this file")
+    add("--save", help="record the results as the baseline in this file")
+    add("--tolerance", type="float", default=0.25,
+        help="slowdown allowed before failing, as a fraction [%default]")
+    add("--number", type="int", default=5000,
+        help="calls per timing [%default]")
+    add("--repeat", type="int", default=5,
+        help="timings per method, the median is kept [%default]")
+    add("--only", help="comma separated methods to measure")
+    return parser
+
+
+def _load(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = make_parser()
+    opts, args = parser.parse_args(argv)
+    if args:
+        parser.error("unexpected arguments: %s" % " ".join(args))
+    names = set(opts.only.split(",")) if opts.only else None
+
+    ratios, ref = measure(opts.number, opts.repeat, names)
+    key = baseline_key()
+    baseline = _load(opts.baseline).get(key, {})
+
+    sys.stdout.write("reference: %.3fus (%s)\n" % (ref * 1e6, key))
+    sys.stdout.write("%-20s %10s %10s\n" % ("method", "cost", "baseline"))
+    for name in sorted(ratios):
+        base = baseline.get(name)
+        sys.stdout.write("%-20s %10.1f %10s\n" % (
+            name, ratios[name], "%.1f" % base if base is not None else "-"))
+
+    if opts.save:
+        doc = _load(opts.save)
+        doc.setdefault(key, {}).update(
+            (name, round(ratio, 2)) for name, ratio in ratios.items())
+        with open(opts.save, "w") as f:
+            json.dump(doc, f, indent=2, separators=(",", ": "),
+                      sort_keys=True)
+            f.write("\n")
+
+    if opts.baseline:
+        if not baseline:
+            sys.stdout.write("no baseline for %s in %s\n" %
+                             (key, opts.baseline))
+        regressions = compare(ratios, baseline, opts.tolerance)
+        if regressions:
+            # Timings are noisy: measure the suspects again, longer, and
+            # only fail those that are still too slow.
+            suspects = set(name for name, ratio, base in regressions)
+            again = measure(opts.number, 2 * opts.repeat, suspects)[0]
+            for name in suspects:
+                ratios[name] = min(ratios[name], again[name])
+            regressions = compare(ratios, baseline, opts.tolerance)
+        for name, ratio, base in regressions:
+            sys.stdout.write("REGRESSION %s: %.1f, baseline %.1f (+%d%%)\n" %
+                             (name, ratio, base, (ratio / base - 1) * 100))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
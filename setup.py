@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+
 from setuptools import setup, find_packages
 
 from gluster import __canonical_version__ as version
@@ -21,6 +23,12 @@ from gluster import __canonical_version__ as version
 
 name = 'gfapi'
 
+# Backports of the thread pools behind the parallel Volume methods and of
+# asyncio, which AsyncVolume and the File.a*() methods need.
+install_requires = []
+if sys.version_info < (3,):
+    install_requires += ['futures', 'trollius']
+
 
 setup(
     name=name,
@@ -41,10 +49,9 @@ setup(
         'Operating System :: POSIX :: Linux'
         'Programming Language :: Python'
         'Programming Language :: Python :: 2'
-        'Programming Language :: Python :: 2.6'
         'Programming Language :: Python :: 2.7'
     ],
-    install_requires=[],
+    install_requires=install_requires,
     scripts=[],
     entry_points={},
 )
@@ -15,6 +15,7 @@
 
 import unittest
 import os
+import tempfile
 import types
 import loremipsum
 
@@ -83,7 +84,33 @@ class FileOpsTest(unittest.TestCase):
             self.assertTrue(isinstance(fd, gfapi.File))
             buf = fd.read(len(self.data))
             self.assertFalse(isinstance(buf, types.IntType))
-            self.assertEqual(buf.value, self.data)
+            self.assertEqual(buf, self.data)
+
+    def test_open_and_readinto(self):
+        with self.vol.open(self.path, os.O_RDONLY) as fd:
+            buf = bytearray(len(self.data) + 10)
+            ret = fd.readinto(buf)
+            self.assertEqual(ret, len(self.data))
+            self.assertEqual(buf[:ret], self.data)
+            self.assertEqual(fd.readinto(buf), 0)
+
+    def test_pread_pwrite(self):
+        with self.vol.open(self.path, os.O_RDWR) as fd:
+            ret = fd.pwrite("XY", 2)
+            self.assertEqual(ret, 2)
+            self.assertEqual(fd.tell(), 0)
+            buf = fd.pread(4, 0)
+            self.assertEqual(buf, self.data[:2] + "XY")
+            self.assertEqual(fd.lseek(0, os.SEEK_END), len(self.data))
+
+    def test_readv_writev(self):
+        with self.vol.open(self.path, os.O_RDWR) as fd:
+            ret = fd.pwritev(["ab", bytearray("cd")], 0)
+            self.assertEqual(ret, 4)
+            bufs = [bytearray(1), bytearray(3)]
+            ret = fd.readv(bufs)
+            self.assertEqual(ret, 4)
+            self.assertEqual(bufs, ["a", "bcd"])
 
     def test_exists(self):
         e = self.vol.exists(self.path)
@@ -159,6 +186,43 @@ class FileOpsTest(unittest.TestCase):
         self.assertFalse(isinstance(xattrs, types.IntType))
         self.assertEqual(xattrs, ["trusted.key2"])
 
+        self.assertEqual(self.vol.getxattrs(self.path, ["trusted.key2"]),
+                         {"trusted.key2": "world"})
+
+    def test_fxattr(self):
+        with self.vol.open(self.path, os.O_RDWR) as fd:
+            ret = fd.fsetxattr("trusted.key1", "hello")
+            self.assertEqual(ret, 0)
+            self.assertTrue("trusted.key1" in fd.flistxattr())
+            self.assertEqual(fd.fgetxattr("trusted.key1"), "hello")
+            ret = fd.fremovexattr("trusted.key1")
+            self.assertEqual(ret, 0)
+            self.assertFalse("trusted.key1" in fd.flistxattr())
+
+    def test_copyfile(self):
+        copy = self.path + ".copy"
+        size = self.vol.copyfile(self.path, copy, workers=2, chunk=16)
+        self.assertEqual(size, len(self.data))
+        with self.vol.open(copy, os.O_RDONLY) as fd:
+            self.assertEqual(fd.read(size + 1), self.data)
+        self.vol.unlink(copy)
+
+    def test_upload_download(self):
+        local = tempfile.mktemp()
+        try:
+            size = self.vol.download(self.path, local, workers=2, chunk=16)
+            self.assertEqual(size, len(self.data))
+            with open(local) as f:
+                self.assertEqual(f.read(), self.data)
+            copy = self.path + ".copy"
+            size = self.vol.upload(local, copy, workers=2, chunk=16)
+            self.assertEqual(size, len(self.data))
+            with self.vol.open(copy, os.O_RDONLY) as fd:
+                self.assertEqual(fd.read(size + 1), self.data)
+            self.vol.unlink(copy)
+        finally:
+            os.unlink(local)
+
 
 class DirOpsTest(unittest.TestCase):
 
@@ -214,6 +278,18 @@ class DirOpsTest(unittest.TestCase):
             files.append(name)
         self.assertEqual(files, [".", "..", self.testfile])
 
+    def test_scandir(self):
+        entries = list(self.vol.scandir(self.dir_path))
+        self.assertEqual([e.name for e in entries], [self.testfile])
+        self.assertTrue(entries[0].is_file())
+        self.assertFalse(entries[0].is_dir())
+        self.assertEqual(entries[0].stat().st_size, len(self.data))
+
+    def test_listdir_stat(self):
+        entries = self.vol.listdir_stat(self.dir_path)
+        self.assertEqual([name for name, st in entries], [self.testfile])
+        self.assertEqual(entries[0][1].st_size, len(self.data))
+
     def test_delete_file_and_dir(self):
         ret = self.vol.unlink(self.file_path)
         self.assertEqual(ret, 0)
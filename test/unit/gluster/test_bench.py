@@ -0,0 +1,397 @@
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import ctypes
+import errno
+import json
+import os
+import shutil
+import tempfile
+
+from gluster import bench
+from gluster import gfapi
+from nose import SkipTest
+
+
+class TestLocalApi(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tmp = tempfile.mkdtemp()
+        self._local = bench.local_api(self.root)
+        self._local.__enter__()
+        self.vol = gfapi.Volume("localhost", "local")
+        self.vol.mount()
+
+    def tearDown(self):
+        self.vol = None
+        self._local.__exit__(None, None, None)
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.tmp)
+
+    def test_installed(self):
+        self.assertTrue(isinstance(self.vol._api, bench.LocalApi))
+        self.assertEqual(self.vol._api.root, self.root.encode())
+
+    def test_disable_stats(self):
+        local = self.vol._api
+        self.vol.enable_stats()
+        self.assertFalse(self.vol._api is local)
+        self.vol.enable_stats(False)
+        self.assertTrue(self.vol._api is local)
+
+    def test_file_io(self):
+        with self.vol.creat(b"file.txt", os.O_RDWR, 0o644) as f:
+            self.assertEqual(f.write(b"hello world"), 11)
+            self.assertEqual(f.pwrite(b"W", 6), 1)
+            self.assertEqual(f.pread(5, 6), b"World")
+            self.assertEqual(f.lseek(0, os.SEEK_SET), 0)
+            self.assertEqual(f.read(5), b"hello")
+            bufs = [bytearray(1), bytearray(5)]
+            self.assertEqual(f.readv(bufs), 6)
+            self.assertEqual(bufs, [b" ", b"World"])
+        with open(os.path.join(self.root, "file.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"hello World")
+
+    def test_stat(self):
+        with self.vol.creat(b"file.txt", os.O_WRONLY, 0o644) as f:
+            f.write(b"data")
+        st = self.vol.stat(b"file.txt")
+        local = os.stat(os.path.join(self.root, "file.txt"))
+        self.assertEqual(st.st_size, 4)
+        self.assertEqual(st.st_ino, local.st_ino)
+        self.assertEqual(st.st_mode, local.st_mode)
+        self.assertEqual(int(st.st_mtime), int(local.st_mtime))
+        self.assertTrue(self.vol.isfile(b"file.txt"))
+
+    def test_errors(self):
+        try:
+            self.vol.stat(b"missing")
+        except OSError as e:
+            self.assertEqual(e.errno, errno.ENOENT)
+        else:
+            self.fail("stat() of a missing file succeeded")
+        self.assertRaises(OSError, self.vol.open(b"missing",
+                                                 os.O_RDONLY).__enter__)
+        self.vol.mkdir(b"dir", 0o755)
+        self.assertRaises(OSError, self.vol.mkdir, b"dir", 0o755)
+
+    def test_scandir(self):
+        self.vol.mkdir(b"dir", 0o755)
+        with self.vol.creat(b"dir/file.txt", os.O_WRONLY, 0o644):
+            pass
+        self.vol.symlink(b"file.txt", b"dir/link")
+        self.vol.mkdir(b"dir/sub", 0o755)
+        entries = sorted(self.vol.scandir(b"dir", readdirplus=True),
+                         key=lambda e: e.name)
+        self.assertEqual([e.name for e in entries],
+                         [b"file.txt", b"link", b"sub"])
+        self.assertTrue(entries[0].is_file())
+        self.assertTrue(entries[1].is_symlink())
+        self.assertTrue(entries[2].is_dir())
+        self.assertTrue(entries[2]._lstat is not None)
+
+    def test_xattr(self):
+        with self.vol.creat(b"file.txt", os.O_WRONLY, 0o644):
+            pass
+        try:
+            self.vol.setxattr(b"file.txt", b"user.key", b"value", 5)
+        except IOError as e:
+            if e.errno in (errno.ENOTSUP, errno.EOPNOTSUPP, errno.EPERM):
+                raise SkipTest("no user xattrs in %s" % self.root)
+            raise
+        self.assertEqual(self.vol.getxattr(b"file.txt", b"user.key"),
+                         b"value")
+        self.assertTrue(b"user.key" in self.vol.listxattr(b"file.txt"))
+
+    def _make_file(self, name, size, mode=0o640):
+        data = os.urandom(size)
+        with self.vol.creat(name, os.O_WRONLY, mode) as f:
+            f.write(data)
+        os.chmod(os.path.join(self.root, name.decode()), mode)
+        return data
+
+    def _read_file(self, root, name):
+        with open(os.path.join(root, name), "rb") as f:
+            return f.read()
+
+    def test_copyfile(self):
+        data = self._make_file(b"src", 10000)
+        self.assertEqual(self.vol.copyfile(b"src", b"dst", workers=3,
+                                           chunk=1024), 10000)
+        self.assertEqual(self._read_file(self.root, "dst"), data)
+        self.assertEqual(self.vol.stat(b"dst").st_mode & 0o777, 0o640)
+        # Replaces the target, and copes with empty files.
+        self._make_file(b"empty", 0)
+        self.assertEqual(self.vol.copyfile(b"empty", b"dst"), 0)
+        self.assertEqual(self._read_file(self.root, "dst"), b"")
+
+    def test_copyfile_server_side(self):
+        calls = []
+
+        def copy_file_range(fd_in, off_in, fd_out, off_out, length, flags,
+                            *stats):
+            calls.append(length)
+            buf = ctypes.create_string_buffer(length)
+            n = bench._libc.pread(fd_in, buf, length,
+                                  bench._deref(off_in).value)
+            return bench._libc.pwrite(fd_out, buf, n,
+                                      bench._deref(off_out).value)
+
+        data = self._make_file(b"src", 5000)
+        self.vol._api.glfs_copy_file_range = copy_file_range
+        self.assertEqual(self.vol.copyfile(b"src", b"dst", chunk=2048),
+                         5000)
+        self.assertEqual(sorted(calls), [904, 2048, 2048])
+        self.assertEqual(self._read_file(self.root, "dst"), data)
+
+    def test_copyfile_not_server_side(self):
+        def copy_file_range(*args):
+            ctypes.set_errno(errno.EOPNOTSUPP)
+            return -1
+
+        data = self._make_file(b"src", 5000)
+        self.vol._api.glfs_copy_file_range = copy_file_range
+        self.assertEqual(self.vol.copyfile(b"src", b"dst", chunk=2048),
+                         5000)
+        self.assertEqual(self._read_file(self.root, "dst"), data)
+
+    def test_copyfile_cross_volume(self):
+        other = tempfile.mkdtemp()
+        try:
+            with bench.local_api(other):
+                dst_vol = gfapi.Volume("localhost", "other")
+            data = self._make_file(b"src", 5000)
+            self.assertEqual(self.vol.copyfile(b"src", b"dst", chunk=2048,
+                                               dst_volume=dst_vol), 5000)
+            self.assertEqual(self._read_file(other, "dst"), data)
+            self.assertFalse(os.path.exists(os.path.join(self.root, "dst")))
+        finally:
+            shutil.rmtree(other)
+
+    def test_copyfile_short(self):
+        def pread(fd, buf, size, offset, flags):
+            # As if the file shrank while being copied.
+            return 0 if offset >= 4096 else saved(fd, buf, size, offset,
+                                                  flags)
+
+        self._make_file(b"src", 5000)
+        saved = self.vol._api.glfs_pread
+        self.vol._api.glfs_pread = pread
+        try:
+            self.vol.copyfile(b"src", b"dst", chunk=2048)
+        except OSError as e:
+            self.assertEqual(e.errno, errno.EIO)
+        else:
+            self.fail("copyfile() of a short file succeeded")
+
+    def _failing(self, name, offset):
+        """
+        Make the glfs_* call 'name' fail with EIO at 'offset'
+        """
+        saved = getattr(self.vol._api, name)
+
+        def call(fd, buf, size, pos, flags):
+            if pos == offset:
+                ctypes.set_errno(errno.EIO)
+                return -1
+            return saved(fd, buf, size, pos, flags)
+        setattr(self.vol._api, name, call)
+        return saved
+
+    def test_upload(self):
+        data = os.urandom(10000)
+        local = os.path.join(self.tmp, "local")
+        with open(local, "wb") as f:
+            f.write(data)
+        os.chmod(local, 0o600)
+        progress = []
+        self.assertEqual(self.vol.upload(local, b"remote", workers=3,
+                                         chunk=1024,
+                                         progress=lambda *p:
+                                         progress.append(p)), 10000)
+        self.assertEqual(self._read_file(self.root, "remote"), data)
+        self.assertEqual(self.vol.stat(b"remote").st_mode & 0o777, 0o600)
+        self.assertEqual(progress[-1], (10000, 10000))
+        self.assertEqual(len(progress), 10)
+        self.assertEqual(progress, sorted(progress))
+        self.assertFalse(os.path.exists(local + ".transfer"))
+
+    def test_download(self):
+        data = self._make_file(b"remote", 10000)
+        local = os.path.join(self.tmp, "local")
+        with open(local, "wb") as f:
+            f.write(b"x" * 20000)
+        self.assertEqual(self.vol.download(b"remote", local, workers=3,
+                                           chunk=1024), 10000)
+        self.assertEqual(self._read_file(self.tmp, "local"), data)
+        self._make_file(b"empty", 0)
+        self.assertEqual(self.vol.download(b"empty", local), 0)
+        self.assertEqual(self._read_file(self.tmp, "local"), b"")
+
+    def test_upload_resume(self):
+        data = os.urandom(10000)
+        local = os.path.join(self.tmp, "local")
+        with open(local, "wb") as f:
+            f.write(data)
+        saved = self._failing("glfs_pwrite", 4096)
+        self.assertRaises(OSError, self.vol.upload, local, b"remote",
+                          workers=1, chunk=2048)
+        # Nothing is logged unless asked for.
+        self.assertFalse(os.path.exists(local + ".transfer"))
+        self.assertRaises(OSError, self.vol.upload, local, b"remote",
+                          workers=1, chunk=2048, resume=True)
+        self.assertTrue(os.path.exists(local + ".transfer"))
+        self.vol._api.glfs_pwrite = saved
+        self.assertEqual(self.vol.upload(local, b"remote", chunk=2048,
+                                         resume=True), 10000 - 4096)
+        self.assertEqual(self._read_file(self.root, "remote"), data)
+        self.assertFalse(os.path.exists(local + ".transfer"))
+
+    def test_upload_resume_other_target(self):
+        data = os.urandom(10000)
+        local = os.path.join(self.tmp, "local")
+        with open(local, "wb") as f:
+            f.write(data)
+        self._make_file(b"other", 10000)
+        saved = self._failing("glfs_pwrite", 4096)
+        self.assertRaises(OSError, self.vol.upload, local, b"remote",
+                          workers=1, chunk=2048, resume=True)
+        self.vol._api.glfs_pwrite = saved
+        # The ranges logged were sent to b"remote", not to b"other".
+        self.assertEqual(self.vol.upload(local, b"other", chunk=2048,
+                                         resume=True), 10000)
+        self.assertEqual(self._read_file(self.root, "other"), data)
+
+    def test_download_resume(self):
+        data = self._make_file(b"remote", 10000)
+        local = os.path.join(self.tmp, "local")
+        saved = self._failing("glfs_pread", 4096)
+        self.assertRaises(OSError, self.vol.download, b"remote", local,
+                          workers=1, chunk=2048, resume=True)
+        self.vol._api.glfs_pread = saved
+        # A source changed since is transferred again in full.
+        st = os.stat(os.path.join(self.root, "remote"))
+        os.utime(os.path.join(self.root, "remote"),
+                 (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(self.vol.download(b"remote", local, chunk=2048,
+                                           resume=True), 10000)
+        self.assertEqual(self._read_file(self.tmp, "local"), data)
+
+        saved = self._failing("glfs_pread", 4096)
+        self.assertRaises(OSError, self.vol.download, b"remote", local,
+                          workers=1, chunk=2048, resume=True)
+        self.vol._api.glfs_pread = saved
+        progress = []
+        self.assertEqual(self.vol.download(b"remote", local, chunk=2048,
+                                           resume=True,
+                                           progress=lambda *p:
+                                           progress.append(p)),
+                         10000 - 4096)
+        self.assertEqual(progress[0], (6144, 10000))
+        self.assertEqual(self._read_file(self.tmp, "local"), data)
+
+    def _make_sparse(self, path):
+        """
+        Write a 2 MiB file at 'path' holding 8 KiB of data at 0 and 4 KiB
+        at 1 MiB, the rest being holes if the file system supports them,
+        and return its contents
+        """
+        with open(path, "wb") as f:
+            f.write(b"a" * 8192)
+            f.seek(1 << 20)
+            f.write(b"b" * 4096)
+            f.truncate(2 << 20)
+        if os.stat(path).st_blocks * 512 >= 1 << 20:
+            raise SkipTest("no sparse files in %s" % os.path.dirname(path))
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _assert_sparse(self, path, data):
+        self.assertEqual(self._read_file(os.path.dirname(path),
+                                         os.path.basename(path)), data)
+        self.assertTrue(os.stat(path).st_blocks * 512 < 1 << 20)
+
+    def test_extents(self):
+        self._make_sparse(os.path.join(self.root, "sparse"))
+        with self.vol.open(b"sparse", os.O_RDONLY) as f:
+            self.assertEqual(list(f.extents()),
+                             [(0, 8192), (1 << 20, 4096)])
+            self.assertEqual(list(f.extents(4096, 1 << 20)), [(4096, 4096)])
+        with self.vol.creat(b"empty", os.O_RDWR, 0o644) as f:
+            self.assertEqual(list(f.extents()), [])
+            f.ftruncate(4096)
+            self.assertEqual(list(f.extents()), [])
+            self.assertEqual(self.vol.getsize(b"empty"), 4096)
+
+    def test_copyfile_sparse(self):
+        data = self._make_sparse(os.path.join(self.root, "src"))
+        self.assertEqual(self.vol.copyfile(b"src", b"dst", chunk=4096),
+                         12288)
+        self._assert_sparse(os.path.join(self.root, "dst"), data)
+
+    def test_upload_download_sparse(self):
+        local = os.path.join(self.tmp, "local")
+        data = self._make_sparse(local)
+        progress = []
+        self.assertEqual(self.vol.upload(local, b"remote", chunk=4096,
+                                         progress=lambda *p:
+                                         progress.append(p)), 12288)
+        self.assertEqual(progress[-1], (12288, 12288))
+        self._assert_sparse(os.path.join(self.root, "remote"), data)
+        self.assertEqual(self.vol.download(b"remote", local + ".copy",
+                                           chunk=4096), 12288)
+        self._assert_sparse(local + ".copy", data)
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_parse_size(self):
+        self.assertEqual(bench._parse_size("4k"), 4096)
+        self.assertEqual(bench._parse_size("1M"), 1 << 20)
+        self.assertEqual(bench._parse_size("100"), 100)
+
+    def test_main_json(self):
+        output = os.path.join(self.tmp, "out.json")
+        root = os.path.join(self.tmp, "root")
+        os.mkdir(root)
+        ret = bench.main(["--root", root, "--output", output,
+                          "--only", "seq_write,seq_read,rand_read,"
+                          "small_files,readdir",
+                          "--size", "64k", "--block-sizes", "4k,16k",
+                          "--ops", "10", "--files", "5", "--entries", "5"])
+        self.assertEqual(ret, 0)
+        self.assertEqual(os.listdir(root), [])
+        with open(output) as f:
+            doc = json.load(f)
+        self.assertEqual(doc["backend"], "local")
+        names = [(r["name"], r.get("block_size")) for r in doc["results"]]
+        self.assertEqual(names, [
+            ("seq_write", 4096), ("seq_write", 16384),
+            ("seq_read", 4096), ("seq_read", 16384),
+            ("rand_read", 4096), ("rand_read", 16384),
+            ("create", None), ("stat", None), ("lstat", None),
+            ("unlink", None), ("scandir", None), ("listdir_stat", None)])
+        seq_read = doc["results"][2]
+        self.assertEqual(seq_read["bytes"], 65536)
+        self.assertEqual(seq_read["ops"], 16)
+        self.assertEqual(doc["results"][-1]["ops"], 5)
@@ -14,11 +14,22 @@
 # limitations under the License.
 
 import unittest
+import array
+import ctypes
+import errno
 import gluster
+import io
+import mmap
 import os
+import pickle
 import stat
+import subprocess
+import sys
+import threading
+import time
 
 from gluster import gfapi
+from contextlib import nested
 from nose import SkipTest
 from mock import Mock, patch
 
@@ -71,7 +82,17 @@ class TestFile(unittest.TestCase):
         with patch("gluster.gfapi.api.glfs_read", _mock_glfs_read):
             fd = gfapi.File(2)
             b = fd.read(5)
-            self.assertEqual(b.value, "hello")
+            self.assertEqual(b, "hello")
+
+    def test_read_short(self):
+        def _mock_glfs_read(fd, rbuf, buflen, flags):
+            rbuf.value = "hi"
+            return 2
+
+        with patch("gluster.gfapi.api.glfs_read", _mock_glfs_read):
+            fd = gfapi.File(2)
+            b = fd.read(5)
+            self.assertEqual(b, "hi")
 
     def test_read_fail_exception(self):
         mock_glfs_read = Mock()
@@ -88,7 +109,37 @@ class TestFile(unittest.TestCase):
         with patch("gluster.gfapi.api.glfs_read", mock_glfs_read):
             fd = gfapi.File(2)
             b = fd.read(5)
-            self.assertEqual(b, 0)
+            self.assertEqual(b, "")
+
+    def test_readinto_success(self):
+        def _mock_glfs_read(fd, rbuf, buflen, flags):
+            self.assertEqual(buflen, 8)
+            rbuf[:5] = "hello"
+            return 5
+
+        with patch("gluster.gfapi.api.glfs_read", _mock_glfs_read):
+            fd = gfapi.File(2)
+            buf = bytearray(8)
+            ret = fd.readinto(buf)
+            self.assertEqual(ret, 5)
+            self.assertEqual(buf[:5], "hello")
+
+    def test_readinto_eof(self):
+        mock_glfs_read = Mock()
+        mock_glfs_read.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_read", mock_glfs_read):
+            fd = gfapi.File(2)
+            ret = fd.readinto(bytearray(8))
+            self.assertEqual(ret, 0)
+
+    def test_readinto_fail_exception(self):
+        mock_glfs_read = Mock()
+        mock_glfs_read.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_read", mock_glfs_read):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.readinto, bytearray(8))
 
     def test_write_success(self):
         mock_glfs_write = Mock()
@@ -109,6 +160,48 @@ class TestFile(unittest.TestCase):
             ret = fd.write(b)
             self.assertEqual(ret, 3)
 
+    def test_write_buffers(self):
+        written = []
+
+        def _mock_glfs_write(fd, buf, buflen, flags):
+            written.append(ctypes.string_at(buf, buflen))
+            return buflen
+
+        data = array.array("b", [104, 101, 108, 108, 111])
+        mm = mmap.mmap(-1, 5)
+        mm.write(b"world")
+        with patch("gluster.gfapi.api.glfs_write", _mock_glfs_write):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.write(b"bytes"), 5)
+            self.assertEqual(fd.write(bytearray(b"array")), 5)
+            self.assertEqual(fd.write(memoryview(b"a view")[2:]), 4)
+            self.assertEqual(fd.write(data), 5)
+            self.assertEqual(fd.write(mm), 5)
+        self.assertEqual(written, [b"bytes", b"array", b"view", b"hello",
+                                   b"world"])
+        mm.close()
+
+    def test_write_not_contiguous(self):
+        if sys.version_info < (3,):
+            raise SkipTest("no strided memoryviews in Python 2")
+        with patch("gluster.gfapi.api.glfs_write", Mock()):
+            fd = gfapi.File(2)
+            self.assertRaises(BufferError, fd.write,
+                              memoryview(b"abcdef")[::2])
+
+    def test_write_short(self):
+        written = []
+
+        def _mock_glfs_write(fd, buf, buflen, flags):
+            written.append(ctypes.string_at(buf, min(buflen, 2)))
+            return min(buflen, 2)
+
+        with patch("gluster.gfapi.api.glfs_write", _mock_glfs_write):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.write(b"hello"), 5)
+            self.assertEqual(fd.write(bytearray(b"world")), 5)
+        self.assertEqual(written, [b"he", b"ll", b"o", b"wo", b"rl", b"d"])
+
     def test_write_fail_exception(self):
         mock_glfs_write = Mock()
         mock_glfs_write.return_value = -1
@@ -117,6 +210,368 @@ class TestFile(unittest.TestCase):
             fd = gfapi.File(2)
             self.assertRaises(OSError, fd.write, "hello")
 
+    def test_lseek_success(self):
+        mock_glfs_lseek = Mock()
+        mock_glfs_lseek.return_value = 20
+
+        with patch("gluster.gfapi.api.glfs_lseek", mock_glfs_lseek):
+            fd = gfapi.File(2)
+            ret = fd.lseek(20, os.SEEK_SET)
+            self.assertEqual(ret, 20)
+            mock_glfs_lseek.assert_called_once_with(2, 20, os.SEEK_SET)
+
+    def test_lseek_fail_exception(self):
+        mock_glfs_lseek = Mock()
+        mock_glfs_lseek.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_lseek", mock_glfs_lseek):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.lseek, 0, os.SEEK_END)
+
+    def test_tell_success(self):
+        mock_glfs_lseek = Mock()
+        mock_glfs_lseek.return_value = 12
+
+        with patch("gluster.gfapi.api.glfs_lseek", mock_glfs_lseek):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.tell(), 12)
+            mock_glfs_lseek.assert_called_once_with(2, 0, os.SEEK_CUR)
+
+    def test_pread_success(self):
+        def _mock_glfs_pread(fd, rbuf, buflen, offset, flags):
+            self.assertEqual(offset, 100)
+            rbuf.value = "hello"
+            return 5
+
+        with patch("gluster.gfapi.api.glfs_pread", _mock_glfs_pread):
+            fd = gfapi.File(2)
+            b = fd.pread(10, 100)
+            self.assertEqual(b, "hello")
+
+    def test_pread_fail_exception(self):
+        mock_glfs_pread = Mock()
+        mock_glfs_pread.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_pread", mock_glfs_pread):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.pread, 5, 0)
+
+    def test_preadinto_success(self):
+        def _mock_glfs_pread(fd, buf, buflen, offset, flags):
+            self.assertEqual((fd, buflen, offset, flags), (2, 4, 4096, 0))
+            buf[:3] = b"abc"
+            return 3
+
+        with patch("gluster.gfapi.api.glfs_pread", _mock_glfs_pread):
+            fd = gfapi.File(2)
+            buf = bytearray(b"....")
+            ret = fd.preadinto(buf, 4096)
+            self.assertEqual(ret, 3)
+            self.assertEqual(buf, bytearray(b"abc."))
+
+    def test_preadinto_fail_exception(self):
+        mock_glfs_pread = Mock()
+        mock_glfs_pread.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_pread", mock_glfs_pread):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.preadinto, bytearray(4), 0)
+
+    def test_pwrite_success(self):
+        mock_glfs_pwrite = Mock()
+        mock_glfs_pwrite.return_value = 5
+
+        with patch("gluster.gfapi.api.glfs_pwrite", mock_glfs_pwrite):
+            fd = gfapi.File(2)
+            ret = fd.pwrite("hello", 4096)
+            self.assertEqual(ret, 5)
+            mock_glfs_pwrite.assert_called_once_with(2, "hello", 5, 4096, 0)
+
+    def test_pwrite_binary_success(self):
+        mock_glfs_pwrite = Mock()
+        mock_glfs_pwrite.return_value = 3
+
+        with patch("gluster.gfapi.api.glfs_pwrite", mock_glfs_pwrite):
+            fd = gfapi.File(2)
+            ret = fd.pwrite(bytearray(3), 0)
+            self.assertEqual(ret, 3)
+
+    def test_pwrite_short(self):
+        written = []
+
+        def _mock_glfs_pwrite(fd, buf, buflen, offset, flags):
+            written.append((ctypes.string_at(buf, min(buflen, 3)), offset))
+            return min(buflen, 3)
+
+        with patch("gluster.gfapi.api.glfs_pwrite", _mock_glfs_pwrite):
+            fd = gfapi.File(2)
+            ret = fd.pwrite(memoryview(b"hello"), 10)
+            self.assertEqual(ret, 5)
+        self.assertEqual(written, [(b"hel", 10), (b"lo", 13)])
+
+    def test_pwrite_fail_exception(self):
+        mock_glfs_pwrite = Mock()
+        mock_glfs_pwrite.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_pwrite", mock_glfs_pwrite):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.pwrite, "hello", 0)
+
+    def test_readv_success(self):
+        def _mock_glfs_readv(fd, iov, iovcnt, flags):
+            self.assertEqual(iovcnt, 2)
+            self.assertEqual(iov[0].iov_len, 3)
+            self.assertEqual(iov[1].iov_len, 4)
+            ctypes.memmove(iov[0].iov_base, "hel", 3)
+            ctypes.memmove(iov[1].iov_base, "lo", 2)
+            return 5
+
+        with patch("gluster.gfapi.api.glfs_readv", _mock_glfs_readv):
+            fd = gfapi.File(2)
+            bufs = [bytearray(3), bytearray(4)]
+            ret = fd.readv(bufs)
+            self.assertEqual(ret, 5)
+            self.assertEqual(bufs[0], "hel")
+            self.assertEqual(bufs[1][:2], "lo")
+
+    def test_readv_fail_exception(self):
+        mock_glfs_readv = Mock()
+        mock_glfs_readv.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_readv", mock_glfs_readv):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.readv, [bytearray(3)])
+
+    def test_preadv_success(self):
+        def _mock_glfs_preadv(fd, iov, iovcnt, offset, flags):
+            self.assertEqual(offset, 512)
+            ctypes.memmove(iov[0].iov_base, "abc", 3)
+            return 3
+
+        with patch("gluster.gfapi.api.glfs_preadv", _mock_glfs_preadv):
+            fd = gfapi.File(2)
+            buf = bytearray(3)
+            ret = fd.preadv([buf], 512)
+            self.assertEqual(ret, 3)
+            self.assertEqual(buf, "abc")
+
+    def test_preadv_fail_exception(self):
+        mock_glfs_preadv = Mock()
+        mock_glfs_preadv.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_preadv", mock_glfs_preadv):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.preadv, [bytearray(3)], 0)
+
+    def test_writev_success(self):
+        def _mock_glfs_writev(fd, iov, iovcnt, flags):
+            data = "".join(ctypes.string_at(iov[i].iov_base, iov[i].iov_len)
+                           for i in range(iovcnt))
+            self.assertEqual(data, "headerbodytrailer")
+            return len(data)
+
+        with patch("gluster.gfapi.api.glfs_writev", _mock_glfs_writev):
+            fd = gfapi.File(2)
+            ret = fd.writev(["header", bytearray("body"), "trailer"])
+            self.assertEqual(ret, 17)
+
+    def test_writev_short(self):
+        written = []
+
+        def _mock_glfs_writev(fd, iov, iovcnt, flags):
+            data = b"".join(ctypes.string_at(iov[i].iov_base, iov[i].iov_len)
+                            for i in range(iovcnt))
+            written.append(data[:4])
+            return len(data[:4])
+
+        with patch("gluster.gfapi.api.glfs_writev", _mock_glfs_writev):
+            fd = gfapi.File(2)
+            ret = fd.writev([b"header", b"", memoryview(b"body"),
+                             bytearray(b"trailer")])
+            self.assertEqual(ret, 17)
+        self.assertEqual(written, [b"head", b"erbo", b"dytr", b"aile",
+                                   b"r"])
+
+    def test_writev_fail_exception(self):
+        mock_glfs_writev = Mock()
+        mock_glfs_writev.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_writev", mock_glfs_writev):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.writev, ["hello"])
+
+    def test_pwritev_success(self):
+        def _mock_glfs_pwritev(fd, iov, iovcnt, offset, flags):
+            self.assertEqual(offset, 10)
+            self.assertEqual(iovcnt, 2)
+            return 4
+
+        with patch("gluster.gfapi.api.glfs_pwritev", _mock_glfs_pwritev):
+            fd = gfapi.File(2)
+            ret = fd.pwritev(["ab", "cd"], 10)
+            self.assertEqual(ret, 4)
+
+    def test_pwritev_fail_exception(self):
+        mock_glfs_pwritev = Mock()
+        mock_glfs_pwritev.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_pwritev", mock_glfs_pwritev):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.pwritev, ["hello"], 0)
+
+    def test_fgetxattr_success(self):
+        def mock_glfs_fgetxattr(fd, key, buf, maxlen):
+            buf.value = "fake_xattr"
+            return 10
+
+        with patch("gluster.gfapi.api.glfs_fgetxattr", mock_glfs_fgetxattr):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.fgetxattr("key1"), "fake_xattr")
+
+    def test_fgetxattr_fail_exception(self):
+        mock_glfs_fgetxattr = Mock()
+        mock_glfs_fgetxattr.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_fgetxattr", mock_glfs_fgetxattr):
+            fd = gfapi.File(2)
+            self.assertRaises(IOError, fd.fgetxattr, "key1", 32)
+
+    def test_flistxattr_success(self):
+        def mock_glfs_flistxattr(fd, buf, buflen):
+            buf.raw = "key2\0key1\0"
+            return 10
+
+        with patch("gluster.gfapi.api.glfs_flistxattr",
+                   mock_glfs_flistxattr):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.flistxattr(), ["key1", "key2"])
+
+    def test_fsetxattr_success(self):
+        mock_glfs_fsetxattr = Mock()
+        mock_glfs_fsetxattr.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_fsetxattr", mock_glfs_fsetxattr):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.fsetxattr("key1", "hello"), 0)
+            mock_glfs_fsetxattr.assert_called_once_with(2, "key1", "hello",
+                                                        5, 0)
+
+    def test_fsetxattr_fail_exception(self):
+        mock_glfs_fsetxattr = Mock()
+        mock_glfs_fsetxattr.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_fsetxattr", mock_glfs_fsetxattr):
+            fd = gfapi.File(2)
+            self.assertRaises(IOError, fd.fsetxattr, "key1", "hello")
+
+    def test_fremovexattr_success(self):
+        mock_glfs_fremovexattr = Mock()
+        mock_glfs_fremovexattr.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_fremovexattr",
+                   mock_glfs_fremovexattr):
+            fd = gfapi.File(2)
+            self.assertEqual(fd.fremovexattr("key1"), 0)
+
+    def test_fremovexattr_fail_exception(self):
+        mock_glfs_fremovexattr = Mock()
+        mock_glfs_fremovexattr.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_fremovexattr",
+                   mock_glfs_fremovexattr):
+            fd = gfapi.File(2)
+            self.assertRaises(IOError, fd.fremovexattr, "key1")
+
+    def test_copy_file_range_success(self):
+        def _mock_glfs_copy_file_range(fd_in, off_in, fd_out, off_out,
+                                       length, flags):
+            self.assertEqual((fd_in, fd_out, length, flags), (2, 3, 10, 0))
+            self.assertEqual(off_in._obj.value, 4096)
+            self.assertEqual(off_out._obj.value, 0)
+            return 10
+
+        # Missing from libgfapi before GlusterFS 6.
+        with patch("gluster.gfapi.api.glfs_copy_file_range",
+                   _mock_glfs_copy_file_range, create=True):
+            fd = gfapi.File(2)
+            ret = fd.copy_file_range(gfapi.File(3), 10, 4096, 0)
+            self.assertEqual(ret, 10)
+
+    def test_copy_file_range_fail_exception(self):
+        mock_glfs_copy_file_range = Mock()
+        mock_glfs_copy_file_range.return_value = -1
+
+        # Missing from libgfapi before GlusterFS 6.
+        with patch("gluster.gfapi.api.glfs_copy_file_range",
+                   mock_glfs_copy_file_range, create=True):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.copy_file_range, gfapi.File(3), 10)
+            args = mock_glfs_copy_file_range.call_args[0]
+            self.assertEqual(args[1], None)
+            self.assertEqual(args[3], None)
+
+    def test_copy_file_range_missing(self):
+        class OldApi(object):
+            pass
+
+        fd = gfapi.File(2, lib=OldApi())
+        try:
+            fd.copy_file_range(gfapi.File(3), 10)
+        except OSError as e:
+            self.assertEqual(e.errno, errno.ENOSYS)
+        else:
+            self.fail("copy_file_range() without libgfapi support succeeded")
+
+    def test_extents(self):
+        # Data at [0, 100) and [300, 350), holes elsewhere up to 400.
+        def _mock_glfs_lseek(fd, offset, whence):
+            if whence == os.SEEK_END:
+                return 400 + offset
+            if whence == gfapi.SEEK_DATA:
+                if offset < 100:
+                    return offset
+                if offset < 350:
+                    return max(offset, 300)
+                ctypes.set_errno(errno.ENXIO)
+                return -1
+            self.assertEqual(whence, gfapi.SEEK_HOLE)
+            return 100 if offset < 100 else max(offset, 350)
+
+        with patch("gluster.gfapi.api.glfs_lseek", _mock_glfs_lseek):
+            fd = gfapi.File(2)
+            self.assertEqual(list(fd.extents()), [(0, 100), (300, 50)])
+            self.assertEqual(list(fd.extents(50, 320)),
+                             [(50, 50), (300, 20)])
+
+    def test_extents_not_supported(self):
+        def _mock_glfs_lseek(fd, offset, whence):
+            if whence == gfapi.SEEK_DATA:
+                ctypes.set_errno(errno.EINVAL)
+                return -1
+            return 400
+
+        with patch("gluster.gfapi.api.glfs_lseek", _mock_glfs_lseek):
+            fd = gfapi.File(2)
+            self.assertEqual(list(fd.extents()), [(0, 400)])
+
+    def test_ftruncate_success(self):
+        mock_glfs_ftruncate = Mock()
+        mock_glfs_ftruncate.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_ftruncate", mock_glfs_ftruncate):
+            fd = gfapi.File(2)
+            ret = fd.ftruncate(4096)
+            self.assertEqual(ret, 0)
+            mock_glfs_ftruncate.assert_called_once_with(2, 4096)
+
+    def test_ftruncate_fail_exception(self):
+        mock_glfs_ftruncate = Mock()
+        mock_glfs_ftruncate.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_ftruncate", mock_glfs_ftruncate):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.ftruncate, 4096)
+
     def test_fallocate_success(self):
         raise SkipTest("need to solve issue with dependency on libgfapi.so")
         mock_glfs_fallocate = Mock()
@@ -156,6 +611,514 @@ class TestFile(unittest.TestCase):
             self.assertRaises(OSError, fd.discard, 1024, 1024)
 
 
+class TestFileAsync(unittest.TestCase):
+
+    def setUp(self):
+        if gfapi.asyncio is None:
+            raise SkipTest("asyncio is not available")
+        self.loop = gfapi.asyncio.new_event_loop()
+        gfapi.asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        gfapi.asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_aread_success(self):
+        def _mock_glfs_read_async(fd, rbuf, buflen, flags, cbk, data):
+            rbuf.value = "hello"
+            cbk(fd, 5, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_read_async",
+                   _mock_glfs_read_async):
+            fd = gfapi.File(2)
+            ret = self.loop.run_until_complete(fd.aread(10))
+            self.assertEqual(ret, "hello")
+            self.assertEqual(gfapi._aio_pending, {})
+
+    def test_aread_gfapi6_callback(self):
+        def _mock_glfs_read_async(fd, rbuf, buflen, flags, cbk, data):
+            self.assertTrue(cbk is gfapi._aio_callback6)
+            rbuf.value = "hello"
+            cbk(fd, 5, None, None, data)
+            return 0
+        _mock_glfs_read_async.__name__ = "glfs_read_async"
+
+        with patch("gluster.gfapi.api.glfs_read_async",
+                   gfapi._with_io_cbk6(_mock_glfs_read_async)):
+            fd = gfapi.File(2)
+            ret = self.loop.run_until_complete(fd.aread(10))
+            self.assertEqual(ret, "hello")
+            self.assertEqual(gfapi._aio_pending, {})
+
+    def test_aread_fail_callback(self):
+        def _mock_glfs_read_async(fd, rbuf, buflen, flags, cbk, data):
+            cbk(fd, -1, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_read_async",
+                   _mock_glfs_read_async):
+            fd = gfapi.File(2)
+            future = fd.aread(10)
+            self.assertRaises(OSError, self.loop.run_until_complete, future)
+
+    def test_aread_fail_exception(self):
+        mock_glfs_read_async = Mock()
+        mock_glfs_read_async.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_read_async",
+                   mock_glfs_read_async):
+            fd = gfapi.File(2)
+            self.assertRaises(OSError, fd.aread, 10)
+            self.assertEqual(gfapi._aio_pending, {})
+
+    def test_stats_at_completion(self):
+        submitted = []
+
+        def _mock_glfs_read_async(fd, rbuf, buflen, flags, cbk, data):
+            submitted.append((fd, cbk, data))
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_read_async",
+                   _mock_glfs_read_async):
+            vol = gfapi.Volume("localhost", "test")
+            vol.enable_stats()
+            fd = gfapi.File(2, lib=vol._api)
+            ok = fd.aread(10)
+            failed = fd.aread(10)
+            self.assertEqual(vol.stats(), {})
+
+            fd2, cbk, data = submitted[0]
+            cbk(fd2, 5, data)
+            ctypes.set_errno(errno.EIO)
+            fd2, cbk, data = submitted[1]
+            cbk(fd2, -1, data)
+            self.loop.run_until_complete(ok)
+            self.assertRaises(OSError, self.loop.run_until_complete, failed)
+            snap = vol.stats()["read_async"]
+            self.assertEqual(snap["calls"], 2)
+            self.assertEqual(snap["bytes"], 5)
+            self.assertEqual(snap["errors"], {errno.EIO: 1})
+            self.assertEqual(gfapi._aio_pending, {})
+
+    def test_areadinto_success(self):
+        def _mock_glfs_read_async(fd, rbuf, buflen, flags, cbk, data):
+            rbuf[:3] = "abc"
+            cbk(fd, 3, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_read_async",
+                   _mock_glfs_read_async):
+            fd = gfapi.File(2)
+            buf = bytearray(8)
+            ret = self.loop.run_until_complete(fd.areadinto(buf))
+            self.assertEqual(ret, 3)
+            self.assertEqual(buf[:3], "abc")
+
+    def test_apread_success(self):
+        def _mock_glfs_pread_async(fd, rbuf, buflen, offset, flags, cbk,
+                                   data):
+            self.assertEqual(offset, 4096)
+            rbuf.value = "hi"
+            cbk(fd, 2, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_pread_async",
+                   _mock_glfs_pread_async):
+            fd = gfapi.File(2)
+            ret = self.loop.run_until_complete(fd.apread(10, 4096))
+            self.assertEqual(ret, "hi")
+
+    def test_awrite_success(self):
+        def _mock_glfs_write_async(fd, buf, buflen, flags, cbk, data):
+            cbk(fd, buflen, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_write_async",
+                   _mock_glfs_write_async):
+            fd = gfapi.File(2)
+            ret = self.loop.run_until_complete(fd.awrite("hello"))
+            self.assertEqual(ret, 5)
+
+    def test_apwrite_success(self):
+        def _mock_glfs_pwrite_async(fd, buf, buflen, offset, flags, cbk,
+                                    data):
+            self.assertEqual(offset, 7)
+            cbk(fd, buflen, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_pwrite_async",
+                   _mock_glfs_pwrite_async):
+            fd = gfapi.File(2)
+            ret = self.loop.run_until_complete(fd.apwrite(bytearray(3), 7))
+            self.assertEqual(ret, 3)
+
+    def test_afsync_success(self):
+        def _mock_glfs_fsync_async(fd, cbk, data):
+            cbk(fd, 0, data)
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_fsync_async",
+                   _mock_glfs_fsync_async):
+            fd = gfapi.File(2)
+            ret = self.loop.run_until_complete(fd.afsync())
+            self.assertEqual(ret, 0)
+
+
+class _FakeFile(object):
+    """
+    In-memory stand-in for gfapi.File's positional I/O
+    """
+
+    def __init__(self, data=""):
+        self.data = bytearray(data)
+        self.preads = []
+        self.closed = False
+
+    def pread(self, buflen, offset, flags=0):
+        self.preads.append((offset, buflen))
+        return str(self.data[offset:offset + buflen])
+
+    def pwrite(self, data, offset, flags=0):
+        self.data[offset:offset + len(data)] = data
+        return len(data)
+
+    def lseek(self, pos, how):
+        return len(self.data) + pos
+
+    def close(self):
+        self.closed = True
+        return 0
+
+
+class TestGlusterRawIO(unittest.TestCase):
+
+    def test_readline(self):
+        f = _FakeFile("line1\nline2\nline3\n")
+        reader = io.BufferedReader(gfapi.GlusterRawIO(f), 4)
+        self.assertEqual(list(reader), ["line1\n", "line2\n", "line3\n"])
+        reader.close()
+        self.assertTrue(f.closed)
+
+    def test_readahead(self):
+        f = _FakeFile("0123456789" * 10)
+        raw = gfapi.GlusterRawIO(f, readahead=32)
+        self.assertEqual(raw.read(10), "0123456789")
+        # Reads are short at the end of the read-ahead window.
+        self.assertEqual(raw.read(30), "0123456789" * 2 + "01")
+        data = "0123456789" * 2 + "01"
+        while True:
+            buf = raw.read(7)
+            if not buf:
+                break
+            data += buf
+        raw.close()
+        self.assertEqual(data, "0123456789" * 9)
+        offsets = sorted(set(offset for offset, buflen in f.preads))
+        # The window at 96 is short, so nothing is prefetched after it and
+        # end of file is confirmed by a last read.
+        self.assertEqual(offsets, [0, 32, 64, 96, 100])
+        for offset, buflen in f.preads:
+            self.assertEqual(buflen, 32)
+
+    def test_readahead_seek(self):
+        f = _FakeFile("abcdefghij")
+        raw = gfapi.GlusterRawIO(f, readahead=4)
+        self.assertEqual(raw.read(2), "ab")
+        self.assertEqual(raw.seek(7), 7)
+        self.assertEqual(raw.read(2), "hi")
+        self.assertEqual(raw.seek(-2, os.SEEK_END), 8)
+        self.assertEqual(raw.read(), "ij")
+        raw.close()
+
+    def test_write(self):
+        f = _FakeFile()
+        writer = io.BufferedWriter(gfapi.GlusterRawIO(f, "w"), 8)
+        for i in range(10):
+            writer.write("%d," % i)
+        writer.close()
+        self.assertEqual(f.data, "0,1,2,3,4,5,6,7,8,9,")
+        self.assertTrue(f.closed)
+
+    def test_write_invalidates_readahead(self):
+        f = _FakeFile("aaaaaaaa")
+        raw = gfapi.GlusterRawIO(f, "r+", readahead=8)
+        self.assertEqual(raw.read(2), "aa")
+        raw.write("bb")
+        raw.seek(0)
+        self.assertEqual(raw.read(), "aabbaaaa")
+        raw.close()
+
+    def test_close_waits_for_dropped_prefetch(self):
+        resume = threading.Event()
+
+        class SlowFile(_FakeFile):
+            preads_done = 0
+
+            def pread(self, buflen, offset, flags=0):
+                if offset:
+                    resume.wait()
+                data = _FakeFile.pread(self, buflen, offset, flags)
+                self.preads_done += 1
+                return data
+
+            def close(self):
+                self.preads_done_at_close = self.preads_done
+                return _FakeFile.close(self)
+
+        f = SlowFile("a" * 16)
+        raw = gfapi.GlusterRawIO(f, "r+", readahead=8)
+        self.assertEqual(raw.read(2), "aa")
+        raw.write("bb")
+        timer = threading.Timer(0.05, resume.set)
+        timer.start()
+        raw.close()
+        timer.join()
+        self.assertEqual(f.preads_done_at_close, 2)
+
+    def test_not_writable(self):
+        raw = gfapi.GlusterRawIO(_FakeFile(), "r")
+        self.assertRaises(io.UnsupportedOperation, raw.write, "x")
+
+    def test_not_readable(self):
+        raw = gfapi.GlusterRawIO(_FakeFile(), "w")
+        self.assertRaises(io.UnsupportedOperation, raw.read, 1)
+
+    def test_closefd_false(self):
+        f = _FakeFile()
+        raw = gfapi.GlusterRawIO(f, closefd=False)
+        raw.close()
+        self.assertTrue(raw.closed)
+        self.assertFalse(f.closed)
+
+
+class _FakeWriteFile(object):
+
+    def __init__(self, fail=False, short=False):
+        self.writes = []
+        self.fail = fail
+        self.short = short
+        self.closed = False
+
+    def write(self, data):
+        if self.fail:
+            raise OSError(5, "Input/output error")
+        if self.short and len(data) > 1:
+            data = data[:len(data) // 2]
+        self.writes.append(data)
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class TestWriteBehindFile(unittest.TestCase):
+
+    def test_coalesce(self):
+        f = _FakeWriteFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=8)
+        for i in range(10):
+            self.assertEqual(wb.write("ab"), 2)
+        self.assertEqual(f.writes, ["abababab", "abababab"])
+        wb.close()
+        self.assertEqual(f.writes, ["abababab", "abababab", "abab"])
+        self.assertTrue(f.closed)
+
+    def test_large_write_split(self):
+        f = _FakeWriteFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=4, closefd=False)
+        wb.write("x")
+        wb.write(bytearray("y" * 10))
+        wb.flush()
+        self.assertEqual(f.writes, ["xyyy", "yyyy", "yyy"])
+        wb.close()
+        self.assertFalse(f.closed)
+
+    def test_write_counts_bytes(self):
+        f = _FakeWriteFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=8)
+        data = array.array("i", [1, 2, 3])
+        self.assertEqual(wb.write(data), 12)
+        wb.close()
+        self.assertEqual("".join(f.writes), data.tostring())
+        self.assertEqual([len(w) for w in f.writes], [8, 4])
+
+    def test_short_writes(self):
+        f = _FakeWriteFile(short=True)
+        wb = gfapi.WriteBehindFile(f, chunk_size=8)
+        wb.write("abcdefgh")
+        self.assertEqual("".join(f.writes), "abcdefgh")
+        wb.close()
+
+    def test_max_age(self):
+        f = _FakeWriteFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=1024, max_age=0)
+        wb.write("abc")
+        self.assertEqual(f.writes, ["abc"])
+        wb.close()
+
+    def test_background(self):
+        f = _FakeWriteFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=4, max_buffer=8,
+                                   background=True)
+        for i in range(100):
+            wb.write("%02d" % i)
+        wb.flush()
+        self.assertEqual("".join(f.writes),
+                         "".join("%02d" % i for i in range(100)))
+        for chunk in f.writes:
+            self.assertEqual(len(chunk), 4)
+        wb.close()
+        self.assertTrue(f.closed)
+
+    def test_background_many_writers(self):
+        resume = threading.Event()
+
+        class SlowFile(_FakeWriteFile):
+            def write(self, data):
+                resume.wait()
+                return _FakeWriteFile.write(self, data)
+
+        f = SlowFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=4, max_buffer=8,
+                                   background=True)
+        tokens = [bytearray("t%03d" % i) for i in range(6)]
+        threads = [threading.Thread(target=wb.write, args=(token,))
+                   for token in tokens]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        # Only the chunk being written, the one queued and the one being
+        # filled have been copied; the other writers wait with theirs.
+        for token in tokens:
+            token[:] = "----"
+        resume.set()
+        for thread in threads:
+            thread.join()
+        wb.close()
+        data = "".join(f.writes)
+        self.assertEqual(len(data), 24)
+        self.assertEqual(data.count("----"), 3)
+
+    def test_background_max_age(self):
+        f = _FakeWriteFile()
+        wb = gfapi.WriteBehindFile(f, chunk_size=1024, max_age=0.01,
+                                   background=True)
+        wb.write("abc")
+        for i in range(100):
+            if f.writes:
+                break
+            time.sleep(0.01)
+        self.assertEqual(f.writes, ["abc"])
+        wb.close()
+
+    def test_background_error(self):
+        f = _FakeWriteFile(fail=True)
+        wb = gfapi.WriteBehindFile(f, chunk_size=2, background=True)
+        wb.write("ab")
+        self.assertRaises(OSError, wb.flush)
+        wb.write("cd")
+        self.assertRaises(OSError, wb.close)
+        self.assertTrue(f.closed)
+
+    def test_background_max_age_error(self):
+        started = threading.Event()
+        resume = threading.Event()
+
+        class SlowFailingFile(_FakeWriteFile):
+            def write(self, data):
+                started.set()
+                resume.wait()
+                return _FakeWriteFile.write(self, data)
+
+        f = SlowFailingFile(fail=True)
+        wb = gfapi.WriteBehindFile(f, chunk_size=1024, max_age=0.01,
+                                   background=True)
+        wb.write("ab")
+        started.wait(5)
+        # Buffered while "ab" is being written, and old enough to go once
+        # that write has failed.
+        wb.write("cd")
+        resume.set()
+        for i in range(100):
+            if wb._error is not None:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertTrue(wb._thread.is_alive())
+        self.assertRaises(OSError, wb.write, "ef")
+        self.assertRaises(OSError, wb.close)
+        self.assertTrue(f.closed)
+
+    def test_error_on_close(self):
+        f = _FakeWriteFile(fail=True)
+        wb = gfapi.WriteBehindFile(f, chunk_size=8)
+        wb.write("ab")
+        self.assertRaises(OSError, wb.close)
+        self.assertTrue(f.closed)
+
+
+class TestStatResult(unittest.TestCase):
+
+    def test_from_stat(self):
+        s = gfapi.Stat()
+        s.st_dev = 1
+        s.st_ino = 2
+        s.st_nlink = 3
+        s.st_mode = stat.S_IFREG | 0644
+        s.st_uid = 4
+        s.st_gid = 5
+        s.st_rdev = 6
+        s.st_size = 7
+        s.st_blksize = 8
+        s.st_blocks = 9
+        s.st_atime = 10
+        s.st_atimensec = 500000000
+        s.st_mtime = 11
+        s.st_mtimensec = 1
+        s.st_ctime = 12
+        s.st_ctimensec = 0
+        st = gfapi.StatResult.from_stat(s)
+        self.assertEqual(st.st_dev, 1)
+        self.assertEqual(st.st_ino, 2)
+        self.assertEqual(st.st_nlink, 3)
+        self.assertEqual(st.st_mode, stat.S_IFREG | 0644)
+        self.assertEqual(st.st_uid, 4)
+        self.assertEqual(st.st_gid, 5)
+        self.assertEqual(st.st_rdev, 6)
+        self.assertEqual(st.st_size, 7)
+        self.assertEqual(st.st_blksize, 8)
+        self.assertEqual(st.st_blocks, 9)
+        self.assertEqual(st.st_atime_ns, 10500000000)
+        self.assertEqual(st.st_mtime_ns, 11000000001)
+        self.assertEqual(st.st_ctime_ns, 12000000000)
+        self.assertEqual(st.st_atime, 10.5)
+        self.assertEqual(st.st_ctime, 12.0)
+        # Laid out like os.stat_result.
+        self.assertEqual(len(st), 10)
+        self.assertEqual(st[stat.ST_MODE], stat.S_IFREG | 0644)
+        self.assertEqual(st[stat.ST_SIZE], 7)
+        self.assertEqual(st[stat.ST_ATIME], 10)
+        self.assertEqual(st[stat.ST_MTIME], 11)
+        self.assertEqual(st[stat.ST_CTIME], 12)
+        self.assertEqual(st[stat.ST_DEV], 1)
+
+    def test_immutable(self):
+        st = gfapi.StatResult.from_stat(gfapi.Stat())
+        self.assertRaises(AttributeError, setattr, st, "st_size", 1)
+        self.assertRaises(AttributeError, setattr, st, "st_blocks", 1)
+        self.assertRaises(AttributeError, delattr, st, "st_rdev")
+
+    def test_pickle(self):
+        s = gfapi.Stat()
+        s.st_size = 7
+        s.st_mtime = 11
+        s.st_mtimensec = 1
+        st = pickle.loads(pickle.dumps(gfapi.StatResult.from_stat(s), 2))
+        self.assertEqual(st.st_size, 7)
+        self.assertEqual(st.st_mtime_ns, 11000000001)
+
+
 class TestDir(unittest.TestCase):
 
     def setUp(self):
@@ -205,6 +1168,26 @@ class TestVolume(unittest.TestCase):
         gluster.gfapi.api.glfs_close = self._saved_glfs_close
         gluster.gfapi.api.glfs_closedir = self._saved_glfs_closedir
 
+    def test_umount_success(self):
+        mock_glfs_fini = Mock()
+        mock_glfs_fini.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_fini", mock_glfs_fini):
+            vol = gfapi.Volume("localhost", "test")
+            ret = vol.umount()
+            self.assertEqual(ret, 0)
+            self.assertEqual(vol.fs, None)
+            del vol
+            mock_glfs_fini.assert_called_once_with(2)
+
+    def test_umount_fail_exception(self):
+        mock_glfs_fini = Mock()
+        mock_glfs_fini.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_fini", mock_glfs_fini):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertRaises(OSError, vol.umount)
+
     def test_creat_success(self):
         mock_glfs_creat = Mock()
         mock_glfs_creat.return_value = 2
@@ -340,6 +1323,37 @@ class TestVolume(unittest.TestCase):
             ret = vol.islink("linkdoesnotexist")
             self.assertFalse(ret)
 
+    def test_fopen_read(self):
+        mock_glfs_open = Mock()
+        mock_glfs_open.return_value = 2
+
+        with patch("gluster.gfapi.api.glfs_open", mock_glfs_open):
+            vol = gfapi.Volume("localhost", "test")
+            f = vol.fopen("file.txt", "rb")
+            self.assertTrue(isinstance(f, io.BufferedReader))
+            mock_glfs_open.assert_called_once_with(2, "file.txt", os.O_RDONLY)
+            f.close()
+
+    def test_fopen_write(self):
+        mock_glfs_creat = Mock()
+        mock_glfs_creat.return_value = 2
+
+        with patch("gluster.gfapi.api.glfs_creat", mock_glfs_creat):
+            vol = gfapi.Volume("localhost", "test")
+            f = vol.fopen("file.txt", "w")
+            self.assertTrue(isinstance(f, io.TextIOWrapper))
+            mock_glfs_creat.assert_called_once_with(
+                2, "file.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+            f.close()
+
+    def test_fopen_fail_exception(self):
+        mock_glfs_open = Mock()
+        mock_glfs_open.return_value = None
+
+        with patch("gluster.gfapi.api.glfs_open", mock_glfs_open):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertRaises(OSError, vol.fopen, "file.txt")
+
     def test_getxattr_success(self):
         def mock_glfs_getxattr(fs, path, key, buf, maxlen):
             buf.value = "fake_xattr"
@@ -358,6 +1372,67 @@ class TestVolume(unittest.TestCase):
             vol = gfapi.Volume("localhost", "test")
             self.assertRaises(IOError, vol.getxattr, "file.txt", "key1", 32)
 
+    def test_getxattr_probe_size(self):
+        value = "x" * (gfapi.XATTR_SIZE_HINT + 10)
+        calls = []
+
+        def mock_glfs_getxattr(fs, path, key, buf, maxlen):
+            calls.append(maxlen)
+            if maxlen == 0:
+                return len(value)
+            if maxlen < len(value):
+                ctypes.set_errno(errno.ERANGE)
+                return -1
+            buf.raw = value
+            return len(value)
+
+        with patch("gluster.gfapi.api.glfs_getxattr", mock_glfs_getxattr):
+            vol = gfapi.Volume("localhost", "test")
+            buf = vol.getxattr("file.txt", "key1")
+            self.assertEqual(buf, value)
+            self.assertEqual(calls, [gfapi.XATTR_SIZE_HINT, 0, len(value)])
+
+    def test_getxattr_binary(self):
+        def mock_glfs_getxattr(fs, path, key, buf, maxlen):
+            buf.raw = "a\0b"
+            return 3
+
+        with patch("gluster.gfapi.api.glfs_getxattr", mock_glfs_getxattr):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertEqual(vol.getxattr("file.txt", "key1"), "a\0b")
+
+    def test_getxattr_erange_maxlen(self):
+        def mock_glfs_getxattr(fs, path, key, buf, maxlen):
+            ctypes.set_errno(errno.ERANGE)
+            return -1
+
+        with patch("gluster.gfapi.api.glfs_getxattr", mock_glfs_getxattr):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertRaises(IOError, vol.getxattr, "file.txt", "key1", 2)
+
+    def test_getxattrs_success(self):
+        values = {"key1": "v1", "key2": "v2"}
+
+        def mock_glfs_listxattr(fs, path, buf, buflen):
+            buf.raw = "key2\0key1\0"
+            return 10
+
+        def mock_glfs_getxattr(fs, path, key, buf, maxlen):
+            if key not in values:
+                ctypes.set_errno(errno.ENODATA)
+                return -1
+            buf.value = values[key]
+            return len(values[key])
+
+        with nested(patch("gluster.gfapi.api.glfs_listxattr",
+                          mock_glfs_listxattr),
+                    patch("gluster.gfapi.api.glfs_getxattr",
+                          mock_glfs_getxattr)):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertEqual(vol.getxattrs("file.txt"), values)
+            self.assertEqual(vol.getxattrs("file.txt", ["key1", "key3"]),
+                             {"key1": "v1"})
+
     def test_listxattr_success(self):
         def mock_glfs_listxattr(fs, path, buf, buflen):
             buf.raw = "key1\0key2\0"
@@ -366,8 +1441,33 @@ class TestVolume(unittest.TestCase):
         with patch("gluster.gfapi.api.glfs_listxattr", mock_glfs_listxattr):
             vol = gfapi.Volume("localhost", "test")
             xattrs = vol.listxattr("file.txt")
-            self.assertTrue("key1" in xattrs)
-            self.assertTrue("key2" in xattrs)
+            self.assertEqual(xattrs, ["key1", "key2"])
+
+    def test_listxattr_empty(self):
+        mock_glfs_listxattr = Mock()
+        mock_glfs_listxattr.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_listxattr", mock_glfs_listxattr):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertEqual(vol.listxattr("file.txt"), [])
+
+    def test_listxattr_probe_size(self):
+        names = "".join("key%04d\0" % i for i in range(1000))
+
+        def mock_glfs_listxattr(fs, path, buf, buflen):
+            if buflen == 0:
+                return len(names)
+            if buflen < len(names):
+                ctypes.set_errno(errno.ERANGE)
+                return -1
+            buf.raw = names
+            return len(names)
+
+        with patch("gluster.gfapi.api.glfs_listxattr", mock_glfs_listxattr):
+            vol = gfapi.Volume("localhost", "test")
+            xattrs = vol.listxattr("file.txt")
+            self.assertEqual(len(xattrs), 1000)
+            self.assertEqual(xattrs[-1], "key0999")
 
     def test_listxattr_fail_exception(self):
         mock_glfs_listxattr = Mock()
@@ -384,6 +1484,15 @@ class TestVolume(unittest.TestCase):
         with patch("gluster.gfapi.api.glfs_lstat", mock_glfs_lstat):
             vol = gfapi.Volume("localhost", "test")
             stat = vol.lstat("file.txt")
+            self.assertTrue(isinstance(stat, gfapi.StatResult))
+
+    def test_lstat_raw(self):
+        mock_glfs_lstat = Mock()
+        mock_glfs_lstat.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_lstat", mock_glfs_lstat):
+            vol = gfapi.Volume("localhost", "test")
+            stat = vol.lstat("file.txt", raw=True)
             self.assertTrue(isinstance(stat, gfapi.Stat))
 
     def test_lstat_fail_exception(self):
@@ -401,6 +1510,15 @@ class TestVolume(unittest.TestCase):
         with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
             vol = gfapi.Volume("localhost", "test")
             stat = vol.stat("file.txt")
+            self.assertTrue(isinstance(stat, gfapi.StatResult))
+
+    def test_stat_raw(self):
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            stat = vol.stat("file.txt", raw=True)
             self.assertTrue(isinstance(stat, gfapi.Stat))
 
     def test_stat_fail_exception(self):
@@ -411,6 +1529,155 @@ class TestVolume(unittest.TestCase):
             vol = gfapi.Volume("localhost", "test")
             self.assertRaises(OSError, vol.stat, "file.txt")
 
+    def test_stat_cache(self):
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            cache = vol.set_stat_cache(60)
+            s = vol.stat("file.txt")
+            self.assertTrue(vol.exists("file.txt"))
+            self.assertTrue(vol.stat("file.txt") is s)
+            self.assertEqual(mock_glfs_stat.call_count, 1)
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+            vol.set_stat_cache(None)
+            vol.stat("file.txt")
+            self.assertEqual(mock_glfs_stat.call_count, 2)
+
+    def test_stat_cache_invalidate(self):
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+        mock_glfs_lstat = Mock()
+        mock_glfs_lstat.return_value = 0
+        mock_glfs_unlink = Mock()
+        mock_glfs_unlink.return_value = 0
+        mock_glfs_rename = Mock()
+        mock_glfs_rename.return_value = 0
+
+        with nested(patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat),
+                    patch("gluster.gfapi.api.glfs_lstat", mock_glfs_lstat),
+                    patch("gluster.gfapi.api.glfs_unlink", mock_glfs_unlink),
+                    patch("gluster.gfapi.api.glfs_rename", mock_glfs_rename)):
+            vol = gfapi.Volume("localhost", "test")
+            vol.set_stat_cache(60)
+            vol.stat("dir")
+            vol.stat("dir/file.txt")
+            vol.lstat("dir/file.txt")
+            vol.unlink("dir/file.txt")
+            vol.stat("dir")
+            vol.stat("dir/file.txt")
+            vol.lstat("dir/file.txt")
+            self.assertEqual(mock_glfs_stat.call_count, 4)
+            self.assertEqual(mock_glfs_lstat.call_count, 2)
+            vol.rename("dir", "newdir")
+            vol.stat("dir/file.txt")
+            self.assertEqual(mock_glfs_stat.call_count, 5)
+
+    def test_stat_cache_file_write(self):
+        mock_glfs_creat = Mock()
+        mock_glfs_creat.return_value = 2
+        mock_glfs_write = Mock()
+        mock_glfs_write.return_value = 5
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+
+        with nested(patch("gluster.gfapi.api.glfs_creat", mock_glfs_creat),
+                    patch("gluster.gfapi.api.glfs_write", mock_glfs_write),
+                    patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat)):
+            vol = gfapi.Volume("localhost", "test")
+            vol.set_stat_cache(60)
+            with vol.creat("file.txt", os.O_WRONLY, 0644) as fd:
+                vol.stat("file.txt")
+                fd.write("hello")
+                vol.stat("file.txt")
+                vol.stat("file.txt")
+            self.assertEqual(mock_glfs_stat.call_count, 2)
+
+    def test_negative_cache(self):
+        def _mock_glfs_stat(fs, path, buf):
+            ctypes.set_errno(errno.ENOENT)
+            return -1
+
+        mock_glfs_stat = Mock(side_effect=_mock_glfs_stat)
+        mock_glfs_mkdir = Mock()
+        mock_glfs_mkdir.return_value = 0
+
+        with nested(patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat),
+                    patch("gluster.gfapi.api.glfs_mkdir", mock_glfs_mkdir)):
+            vol = gfapi.Volume("localhost", "test")
+            cache = vol.set_negative_cache(60)
+            self.assertFalse(vol.exists("dir"))
+            self.assertFalse(vol.exists("dir"))
+            self.assertRaises(OSError, vol.stat, "dir")
+            self.assertEqual(mock_glfs_stat.call_count, 1)
+            self.assertEqual(cache.hits, 2)
+            vol.mkdir("dir", 0755)
+            self.assertFalse(vol.exists("dir"))
+            self.assertEqual(mock_glfs_stat.call_count, 2)
+
+    def test_negative_cache_other_errors(self):
+        def _mock_glfs_stat(fs, path, buf):
+            ctypes.set_errno(errno.EACCES)
+            return -1
+
+        mock_glfs_stat = Mock(side_effect=_mock_glfs_stat)
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            vol.set_negative_cache(60)
+            self.assertFalse(vol.exists("file.txt"))
+            self.assertFalse(vol.exists("file.txt"))
+            self.assertEqual(mock_glfs_stat.call_count, 2)
+
+    def _mock_stat_modes(self, modes, errors={}):
+        def _mock_glfs_stat(fs, path, buf):
+            if path in modes:
+                buf._obj.st_mode = modes[path]
+                return 0
+            ctypes.set_errno(errors.get(path, errno.ENOENT))
+            return -1
+        return _mock_glfs_stat
+
+    def test_stat_many(self):
+        modes = {"a": stat.S_IFREG, "b": stat.S_IFDIR}
+        paths = ["a", "missing", "b"] * 10
+
+        with patch("gluster.gfapi.api.glfs_stat",
+                   self._mock_stat_modes(modes)):
+            vol = gfapi.Volume("localhost", "test")
+            for workers in (1, 4):
+                ret = vol.stat_many(paths, workers=workers)
+                self.assertEqual(len(ret), 30)
+                self.assertEqual(ret[0].st_mode, stat.S_IFREG)
+                self.assertTrue(isinstance(ret[1], OSError))
+                self.assertEqual(ret[1].errno, errno.ENOENT)
+                self.assertEqual(ret[29].st_mode, stat.S_IFDIR)
+
+    def test_stat_many_lstat(self):
+        modes = {"l": stat.S_IFLNK}
+
+        with patch("gluster.gfapi.api.glfs_lstat",
+                   self._mock_stat_modes(modes)):
+            vol = gfapi.Volume("localhost", "test")
+            ret = vol.stat_many(["l"], follow_symlinks=False)
+            self.assertEqual(ret[0].st_mode, stat.S_IFLNK)
+
+    def test_classify_many(self):
+        modes = {"f": stat.S_IFREG, "d": stat.S_IFDIR, "l": stat.S_IFLNK,
+                 "s": stat.S_IFSOCK}
+        errors = {"notdir/x": errno.ENOTDIR, "denied": errno.EACCES}
+        paths = ["f", "d", "l", "s", "missing", "notdir/x", "denied"]
+
+        with patch("gluster.gfapi.api.glfs_lstat",
+                   self._mock_stat_modes(modes, errors)):
+            vol = gfapi.Volume("localhost", "test")
+            ret = vol.classify_many(paths, workers=3)
+            self.assertEqual(ret[:6], ["file", "dir", "link", "other",
+                                       "missing", "missing"])
+            self.assertTrue(isinstance(ret[6], OSError))
+            self.assertEqual(ret[6].errno, errno.EACCES)
+
     def test_mkdir_success(self):
         mock_glfs_mkdir = Mock()
         mock_glfs_mkdir.return_value = 0
@@ -469,6 +1736,140 @@ class TestVolume(unittest.TestCase):
             vol = gfapi.Volume("localhost", "test")
             self.assertRaises(OSError, vol.opendir, "testdir")
 
+    def _mock_glfs_readdir_r(self, entries):
+        entries = list(entries)
+
+        def _readdir_r(fd, ent, cursor):
+            if not entries:
+                ctypes.memset(ctypes.addressof(cursor._obj), 0,
+                              ctypes.sizeof(cursor._obj))
+                return 0
+            name, d_type = entries.pop(0)
+            ent._obj.d_name = name
+            ent._obj.d_type = chr(d_type)
+            cursor._obj.contents = ent._obj
+            return 0
+        return _readdir_r
+
+    def test_scandir_success(self):
+        mock_glfs_opendir = Mock()
+        mock_glfs_opendir.return_value = 2
+        entries = [(".", gfapi.DT_DIR), ("..", gfapi.DT_DIR),
+                   ("file.txt", gfapi.DT_REG), ("dir", gfapi.DT_DIR),
+                   ("link", gfapi.DT_LNK)]
+        mock_glfs_lstat = Mock()
+
+        with nested(patch("gluster.gfapi.api.glfs_opendir", mock_glfs_opendir),
+                    patch("gluster.gfapi.api.glfs_readdir_r",
+                          self._mock_glfs_readdir_r(entries)),
+                    patch("gluster.gfapi.api.glfs_lstat", mock_glfs_lstat)):
+            vol = gfapi.Volume("localhost", "test")
+            ents = list(vol.scandir("testdir"))
+            self.assertEqual([e.name for e in ents],
+                             ["file.txt", "dir", "link"])
+            self.assertEqual(ents[0].path, "testdir/file.txt")
+            self.assertTrue(ents[0].is_file())
+            self.assertFalse(ents[0].is_dir())
+            self.assertTrue(ents[1].is_dir())
+            self.assertFalse(ents[1].is_symlink())
+            self.assertTrue(ents[2].is_symlink())
+            self.assertFalse(ents[2].is_dir(follow_symlinks=False))
+            self.assertEqual(mock_glfs_lstat.call_count, 0)
+
+    def test_scandir_unknown_type(self):
+        mock_glfs_opendir = Mock()
+        mock_glfs_opendir.return_value = 2
+        s = gfapi.Stat()
+        s.st_mode = stat.S_IFDIR
+        mock_lstat = Mock()
+        mock_lstat.return_value = s
+
+        with nested(patch("gluster.gfapi.api.glfs_opendir", mock_glfs_opendir),
+                    patch("gluster.gfapi.api.glfs_readdir_r",
+                          self._mock_glfs_readdir_r(
+                              [("sub", gfapi.DT_UNKNOWN)])),
+                    patch("gluster.gfapi.Volume.lstat", mock_lstat)):
+            vol = gfapi.Volume("localhost", "test")
+            ent, = list(vol.scandir("testdir"))
+            self.assertTrue(ent.is_dir())
+            self.assertFalse(ent.is_file())
+            self.assertFalse(ent.is_symlink())
+            mock_lstat.assert_called_once_with("testdir/sub")
+
+    def _mock_glfs_readdirplus_r(self, entries):
+        readdir_r = self._mock_glfs_readdir_r(
+            [(name, d_type) for name, d_type, size in entries])
+        sizes = [size for name, d_type, size in entries]
+
+        def _readdirplus_r(fd, st, ent, cursor):
+            if sizes:
+                st._obj.st_mode = stat.S_IFREG
+                st._obj.st_size = sizes.pop(0)
+            return readdir_r(fd, ent, cursor)
+        return _readdirplus_r
+
+    def test_listdir_stat_success(self):
+        mock_glfs_opendir = Mock()
+        mock_glfs_opendir.return_value = 2
+        entries = [(".", gfapi.DT_DIR, 0), ("..", gfapi.DT_DIR, 0),
+                   ("a", gfapi.DT_REG, 10), ("b", gfapi.DT_REG, 20)]
+        mock_lstat = Mock()
+
+        with nested(patch("gluster.gfapi.api.glfs_opendir", mock_glfs_opendir),
+                    patch("gluster.gfapi.api.glfs_readdirplus_r",
+                          self._mock_glfs_readdirplus_r(entries)),
+                    patch("gluster.gfapi.Volume.lstat", mock_lstat)):
+            vol = gfapi.Volume("localhost", "test")
+            ret = vol.listdir_stat("testdir")
+            self.assertEqual([(name, st.st_size) for name, st in ret],
+                             [("a", 10), ("b", 20)])
+            self.assertEqual(mock_lstat.call_count, 0)
+
+    def test_scandir_readdirplus_no_stat(self):
+        mock_glfs_opendir = Mock()
+        mock_glfs_opendir.return_value = 2
+        s = gfapi.Stat()
+        s.st_size = 5
+        mock_lstat = Mock()
+        mock_lstat.return_value = s
+
+        def _readdirplus_r(fd, st, ent, cursor):
+            return readdir_r(fd, ent, cursor)
+        readdir_r = self._mock_glfs_readdir_r([("a", gfapi.DT_REG)])
+
+        with nested(patch("gluster.gfapi.api.glfs_opendir", mock_glfs_opendir),
+                    patch("gluster.gfapi.api.glfs_readdirplus_r",
+                          _readdirplus_r),
+                    patch("gluster.gfapi.Volume.lstat", mock_lstat)):
+            vol = gfapi.Volume("localhost", "test")
+            ent, = list(vol.scandir("testdir", readdirplus=True))
+            self.assertEqual(ent.stat(follow_symlinks=False).st_size, 5)
+            mock_lstat.assert_called_once_with("testdir/a")
+
+    def test_listdir_stat_fail_exception(self):
+        mock_glfs_opendir = Mock()
+        mock_glfs_opendir.return_value = 2
+        mock_glfs_readdirplus_r = Mock()
+        mock_glfs_readdirplus_r.return_value = -1
+
+        with nested(patch("gluster.gfapi.api.glfs_opendir", mock_glfs_opendir),
+                    patch("gluster.gfapi.api.glfs_readdirplus_r",
+                          mock_glfs_readdirplus_r)):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertRaises(OSError, vol.listdir_stat, "testdir")
+
+    def test_scandir_fail_exception(self):
+        mock_glfs_opendir = Mock()
+        mock_glfs_opendir.return_value = 2
+        mock_glfs_readdir_r = Mock()
+        mock_glfs_readdir_r.return_value = -1
+
+        with nested(patch("gluster.gfapi.api.glfs_opendir", mock_glfs_opendir),
+                    patch("gluster.gfapi.api.glfs_readdir_r",
+                          mock_glfs_readdir_r)):
+            vol = gfapi.Volume("localhost", "test")
+            self.assertRaises(OSError, list, vol.scandir("testdir"))
+
     def test_rename_success(self):
         mock_glfs_rename = Mock()
         mock_glfs_rename.return_value = 0
@@ -573,3 +1974,797 @@ class TestVolume(unittest.TestCase):
         with patch("gluster.gfapi.api.glfs_symlink", mock_glfs_symlink):
             vol = gfapi.Volume("localhost", "test")
             self.assertRaises(OSError, vol.symlink, "file.txt", "filelink")
+
+    def test_stats_disabled(self):
+        vol = gfapi.Volume("localhost", "test")
+        self.assertEqual(vol.stats(), {})
+        self.assertTrue(vol._api is gluster.gfapi.api)
+
+    def test_stats_volume_calls(self):
+        def mock_glfs_stat(fs, path, buf):
+            if path == "missing":
+                ctypes.set_errno(errno.ENOENT)
+                return -1
+            return 0
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            stats = vol.enable_stats()
+            self.assertTrue(isinstance(stats, gfapi.OpStats))
+            vol.stat("file.txt")
+            self.assertRaises(OSError, vol.stat, "missing")
+            snap = vol.stats()
+            self.assertEqual(snap["stat"]["calls"], 2)
+            self.assertEqual(snap["stat"]["errors"], {errno.ENOENT: 1})
+            self.assertEqual(sum(snap["stat"]["buckets"]), 2)
+            self.assertTrue(snap["stat"]["p50"] <= snap["stat"]["max"])
+
+            self.assertEqual(vol.stats(reset=True)["stat"]["calls"], 2)
+            self.assertEqual(vol.stats(), {})
+            vol.enable_stats(False)
+            vol.stat("file.txt")
+            self.assertEqual(vol.stats(), {})
+
+    def test_hooks(self):
+        calls = []
+        durations = []
+
+        class Hook(gfapi.CallHook):
+            def before_call(self, op, target, size):
+                calls.append(("before", op, target, size))
+
+            def after_call(self, op, target, size, duration, ret, err):
+                durations.append(duration)
+                calls.append(("after", op, target, size, ret, err))
+
+        def mock_glfs_stat(fs, path, buf):
+            ctypes.set_errno(errno.ENOENT)
+            return -1
+
+        mock_glfs_open = Mock()
+        mock_glfs_open.return_value = 5
+        mock_glfs_pread = Mock()
+        mock_glfs_pread.return_value = 4
+
+        with nested(patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat),
+                    patch("gluster.gfapi.api.glfs_open", mock_glfs_open),
+                    patch("gluster.gfapi.api.glfs_pread", mock_glfs_pread)):
+            vol = gfapi.Volume("localhost", "test")
+            hook = vol.add_hook(Hook())
+            self.assertRaises(OSError, vol.stat, "missing")
+            with vol.open("file.txt", os.O_RDONLY) as fd:
+                fd.pread(16, 0)
+            vol.remove_hook(hook)
+            self.assertTrue(vol._api is gluster.gfapi.api)
+
+        self.assertEqual(calls, [
+            ("before", "stat", "missing", None),
+            ("after", "stat", "missing", None, -1, errno.ENOENT),
+            ("before", "open", "file.txt", None),
+            ("after", "open", "file.txt", None, 5, None),
+            ("before", "pread", 5, 16),
+            ("after", "pread", 5, 16, 4, None),
+            ("before", "close", 5, None),
+            ("after", "close", 5, None, 0, None)])
+        self.assertTrue(min(durations) >= 0)
+
+    def test_hooks_iovec_size(self):
+        sizes = []
+
+        class Hook(gfapi.CallHook):
+            def after_call(self, op, target, size, duration, ret, err):
+                sizes.append(size)
+
+        mock_glfs_writev = Mock()
+        mock_glfs_writev.return_value = 5
+
+        with patch("gluster.gfapi.api.glfs_writev", mock_glfs_writev):
+            vol = gfapi.Volume("localhost", "test")
+            vol.add_hook(Hook())
+            fd = gfapi.File(2, lib=vol._api)
+            fd.writev(["ab", "cde"])
+            self.assertEqual(sizes, [5])
+
+    def test_slow_call_logger(self):
+        logger = Mock()
+
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            slow = vol.add_hook(gfapi.SlowCallLogger(0, logger))
+            vol.stat("file.txt")
+            self.assertEqual(len(slow.calls), 1)
+            op, target, size, duration, err, site = slow.calls[0]
+            self.assertEqual((op, target, size, err),
+                             ("stat", "file.txt", None, None))
+            self.assertEqual(site[2], "test_slow_call_logger")
+            self.assertEqual(logger.warning.call_count, 1)
+
+            slow.threshold = 60
+            vol.stat("file.txt")
+            self.assertEqual(len(slow.calls), 1)
+
+    def test_slow_call_site(self):
+        mock_glfs_open = Mock()
+        mock_glfs_open.return_value = 2
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+
+        with nested(patch("gluster.gfapi.api.glfs_open", mock_glfs_open),
+                    patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat)):
+            vol = gfapi.Volume("localhost", "test")
+            slow = vol.add_hook(gfapi.SlowCallLogger(0, Mock()))
+            with vol.open("file.txt", os.O_RDONLY):
+                pass
+            vol.stat_many(["a", "b"], workers=2)
+            sites = dict((op, site[2]) for op, target, size, duration,
+                         err, site in slow.calls)
+            # Not contextlib's __exit__() nor the thread pool's worker.
+            self.assertEqual(sites, {"open": "test_slow_call_site",
+                                     "close": "test_slow_call_site",
+                                     "stat": "test_slow_call_site"})
+
+    def test_stats_file_calls(self):
+        mock_glfs_open = Mock()
+        mock_glfs_open.return_value = 2
+        mock_glfs_read = Mock()
+        mock_glfs_read.return_value = 5
+        mock_glfs_write = Mock()
+        mock_glfs_write.return_value = 3
+
+        with nested(patch("gluster.gfapi.api.glfs_open", mock_glfs_open),
+                    patch("gluster.gfapi.api.glfs_read", mock_glfs_read),
+                    patch("gluster.gfapi.api.glfs_write", mock_glfs_write)):
+            vol = gfapi.Volume("localhost", "test")
+            vol.enable_stats()
+            with vol.open("file.txt", os.O_RDWR) as fd:
+                fd.read(10)
+                fd.read(10)
+                fd.write("abc")
+            snap = vol.stats()
+            self.assertEqual(snap["open"]["calls"], 1)
+            self.assertEqual(snap["read"]["calls"], 2)
+            self.assertEqual(snap["read"]["bytes"], 10)
+            self.assertEqual(snap["write"]["bytes"], 3)
+            self.assertEqual(snap["close"]["calls"], 1)
+
+
+class TestStatCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = gfapi.StatCache(ttl=60)
+        self.assertEqual(cache.get("a"), None)
+        cache.put("a", True, "st", cache.generation)
+        self.assertEqual(cache.get("a"), "st")
+        self.assertEqual(cache.get("./a"), "st")
+        self.assertEqual(cache.get("/a"), "st")
+        self.assertEqual(cache.get("//a"), "st")
+        self.assertEqual(cache.get("a", False), None)
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+
+    def test_ttl(self):
+        cache = gfapi.StatCache(ttl=0.01)
+        cache.put("a", True, "st", cache.generation)
+        time.sleep(0.02)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        cache = gfapi.StatCache(ttl=60, maxsize=2)
+        cache.put("a", True, "a", cache.generation)
+        cache.put("b", True, "b", cache.generation)
+        cache.get("a")
+        cache.put("c", True, "c", cache.generation)
+        self.assertEqual(cache.get("a"), "a")
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("c"), "c")
+
+    def test_stale_put(self):
+        cache = gfapi.StatCache(ttl=60)
+        generation = cache.generation
+        cache.invalidate("a")
+        cache.put("a", True, "st", generation)
+        self.assertEqual(cache.get("a"), None)
+
+    def test_invalidate(self):
+        cache = gfapi.StatCache(ttl=60)
+        for path in ("d", "d/a", "d/a/b", "d/ab", "e"):
+            cache.put(path, True, path, cache.generation)
+            cache.put(path, False, path, cache.generation)
+        cache.invalidate("d/a", parent=True)
+        self.assertEqual(cache.get("d"), None)
+        self.assertEqual(cache.get("d/a", False), None)
+        self.assertEqual(cache.get("d/a/b"), "d/a/b")
+        cache.invalidate("d/a", tree=True)
+        self.assertEqual(cache.get("d/a/b"), None)
+        self.assertEqual(cache.get("d/ab"), "d/ab")
+        self.assertEqual(cache.get("e"), "e")
+        self.assertEqual(cache.info()["size"], 4)
+
+    def test_invalidate_absolute(self):
+        cache = gfapi.StatCache(ttl=60)
+        for path in ("/", "/d", "/d/a", "e"):
+            cache.put(path, True, path, cache.generation)
+        cache.invalidate("d/a", parent=True)
+        self.assertEqual(cache.get("/d"), None)
+        self.assertEqual(cache.get("/d/a"), None)
+        cache.invalidate("/e", parent=True)
+        self.assertEqual(cache.get("e"), None)
+        self.assertEqual(cache.get("/"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate_bytes(self):
+        cache = gfapi.StatCache(ttl=60)
+        for path in (b"d", b"d/a", b"d/a/b", b"d/ab", b"e"):
+            cache.put(path, True, path, cache.generation)
+        cache.invalidate(b"e", parent=True)
+        self.assertEqual(cache.get(b"e"), None)
+        cache.invalidate(b"d/a", parent=True, tree=True)
+        self.assertEqual(cache.get(b"d"), None)
+        self.assertEqual(cache.get(b"d/a/b"), None)
+        self.assertEqual(cache.get(b"d/ab"), b"d/ab")
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def test_get_put(self):
+        cache = gfapi.NegativeCache(ttl=60)
+        self.assertFalse(cache.get("d/a"))
+        cache.put("d/a", True, cache.generation)
+        self.assertTrue(cache.get("d/a"))
+        self.assertTrue(cache.get("d/./a"))
+        self.assertTrue(cache.get("/d/a"))
+        self.assertTrue(cache.get("//d/a"))
+        self.assertFalse(cache.get("d/a", False))
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+
+    def test_ttl(self):
+        cache = gfapi.NegativeCache(ttl=0.01)
+        cache.put("a", True, cache.generation)
+        time.sleep(0.02)
+        self.assertFalse(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_maxsize(self):
+        cache = gfapi.NegativeCache(ttl=60, maxsize=2)
+        for path in ("a", "b", "c"):
+            cache.put(path, True, cache.generation)
+        self.assertFalse(cache.get("a"))
+        self.assertTrue(cache.get("b"))
+        self.assertTrue(cache.get("c"))
+
+    def test_stale_put(self):
+        cache = gfapi.NegativeCache(ttl=60)
+        generation = cache.generation
+        cache.invalidate("a")
+        cache.put("a", True, generation)
+        self.assertFalse(cache.get("a"))
+
+    def test_invalidate(self):
+        cache = gfapi.NegativeCache(ttl=60)
+        for path in ("d", "d/a", "d/b", "d/a/x", "d/a/x/y", "d/ab/x"):
+            cache.put(path, True, cache.generation)
+        cache.invalidate("d/a")
+        self.assertFalse(cache.get("d/a"))
+        self.assertTrue(cache.get("d/a/x"))
+        cache.invalidate("d/a", tree=True)
+        self.assertTrue(cache.get("d"))
+        self.assertTrue(cache.get("d/b"))
+        self.assertFalse(cache.get("d/a/x"))
+        self.assertFalse(cache.get("d/a/x/y"))
+        self.assertTrue(cache.get("d/ab/x"))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(sorted(cache._below), ["d"])
+
+    def test_invalidate_absolute(self):
+        cache = gfapi.NegativeCache(ttl=60)
+        for path in ("/a", "/d/a/x", "/d/b"):
+            cache.put(path, True, cache.generation)
+        cache.invalidate("/d", tree=True)
+        self.assertTrue(cache.get("/a"))
+        self.assertFalse(cache.get("/d/a/x"))
+        self.assertFalse(cache.get("/d/b"))
+        cache.put("x", True, cache.generation)
+        cache.invalidate("/x")
+        self.assertFalse(cache.get("x"))
+        cache.invalidate("a")
+        self.assertEqual((len(cache), cache._dirs, cache._below),
+                         (0, {}, {}))
+
+    def test_invalidate_bytes(self):
+        cache = gfapi.NegativeCache(ttl=60)
+        for path in (b"d/a", b"d/a/x", b"d/ab/x"):
+            cache.put(path, True, cache.generation)
+        cache.invalidate(b"d/a", tree=True)
+        self.assertFalse(cache.get(b"d/a"))
+        self.assertFalse(cache.get(b"d/a/x"))
+        self.assertTrue(cache.get(b"d/ab/x"))
+
+
+class TestOpStats(unittest.TestCase):
+
+    def test_record(self):
+        stats = gfapi.OpStats()
+        stats.record("pread", 0.0000005, nbytes=100)
+        stats.record("pread", 0.003, nbytes=50)
+        stats.record("pread", 0.001, err=errno.EIO)
+        snap = stats.snapshot()["pread"]
+        self.assertEqual(snap["calls"], 3)
+        self.assertEqual(snap["bytes"], 150)
+        self.assertEqual(snap["errors"], {errno.EIO: 1})
+        self.assertEqual(snap["max"], 0.003)
+        self.assertAlmostEqual(snap["mean"], 0.0040005 / 3)
+        self.assertEqual(snap["buckets"][0], 1)
+        self.assertEqual(snap["buckets"][10], 1)
+        self.assertEqual(snap["buckets"][12], 1)
+        self.assertEqual(snap["p50"], 1024 / 1000000.0)
+        self.assertEqual(snap["p99"], 0.003)
+
+    def test_slowest_bucket(self):
+        stats = gfapi.OpStats()
+        stats.record("fsync", 1000000.0)
+        buckets = stats.snapshot()["fsync"]["buckets"]
+        self.assertEqual(len(buckets), gfapi.OpStats.NBUCKETS)
+        self.assertEqual(buckets[-1], 1)
+
+    def test_snapshot_is_a_copy(self):
+        stats = gfapi.OpStats()
+        stats.record("stat", 0.001)
+        snap = stats.snapshot()
+        stats.record("stat", 0.001, err=errno.ENOENT)
+        self.assertEqual(snap["stat"]["calls"], 1)
+        self.assertEqual(snap["stat"]["errors"], {})
+
+    def test_reset(self):
+        stats = gfapi.OpStats()
+        stats.record("stat", 0.001)
+        self.assertEqual(stats.snapshot(reset=True)["stat"]["calls"], 1)
+        self.assertEqual(stats.snapshot(), {})
+        stats.record("stat", 0.001)
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {})
+
+
+class TestVolumeWalk(unittest.TestCase):
+
+    tree = {
+        "top": (["b", "a"], ["f1"]),
+        "top/b": ([], ["f2", "f3"]),
+        "top/a": (["c"], []),
+        "top/a/c": ([], ["f4"]),
+    }
+
+    def setUp(self):
+        self._saved_glfs_new = gluster.gfapi.api.glfs_new
+        gluster.gfapi.api.glfs_new = _mock_glfs_new
+
+        self._saved_glfs_set_volfile_server = \
+                gluster.gfapi.api.glfs_set_volfile_server
+        gluster.gfapi.api.glfs_set_volfile_server = \
+                _mock_glfs_set_volfile_server
+
+        self._saved_glfs_fini = gluster.gfapi.api.glfs_fini
+        gluster.gfapi.api.glfs_fini = _mock_glfs_fini
+
+        self.vol = gfapi.Volume("localhost", "test")
+        self.vol._walk_listdir = self._mock_walk_listdir
+
+    def tearDown(self):
+        gluster.gfapi.api.glfs_new = self._saved_glfs_new
+        gluster.gfapi.api.glfs_set_volfile_server = \
+            self._saved_glfs_set_volfile_server
+        gluster.gfapi.api.glfs_fini = self._saved_glfs_fini
+
+    def _mock_walk_listdir(self, path, followlinks, sort):
+        if path not in self.tree:
+            raise OSError(2, "No such file or directory")
+        dirs, nondirs = self.tree[path]
+        if sort:
+            return sorted(dirs), sorted(nondirs), set()
+        return list(dirs), list(nondirs), set()
+
+    def test_walk_topdown(self):
+        ret = list(self.vol.walk("top"))
+        self.assertEqual(ret, [("top", ["b", "a"], ["f1"]),
+                               ("top/b", [], ["f2", "f3"]),
+                               ("top/a", ["c"], []),
+                               ("top/a/c", [], ["f4"])])
+
+    def test_walk_bottomup(self):
+        ret = [path for path, dirs, files in
+               self.vol.walk("top", topdown=False)]
+        self.assertEqual(ret, ["top/b", "top/a/c", "top/a", "top"])
+
+    def test_walk_sort(self):
+        ret = [path for path, dirs, files in self.vol.walk("top", sort=True)]
+        self.assertEqual(ret, ["top", "top/a", "top/a/c", "top/b"])
+
+    def test_walk_prune(self):
+        ret = []
+        for path, dirs, files in self.vol.walk("top", workers=4):
+            ret.append(path)
+            if "a" in dirs:
+                dirs.remove("a")
+        self.assertEqual(ret, ["top", "top/b"])
+
+    def test_walk_workers(self):
+        if gfapi.ThreadPoolExecutor is None:
+            raise SkipTest("concurrent.futures is not available")
+        for topdown in (True, False):
+            serial = list(self.vol.walk("top", topdown=topdown))
+            parallel = list(self.vol.walk("top", topdown=topdown, workers=4,
+                                          max_pending=1))
+            self.assertEqual(serial, parallel)
+
+    def test_walk_listdir_links(self):
+        def _entry(name, d_type):
+            return gfapi.DirEntry(self.vol, "top/" + name, name, 0, d_type)
+
+        s = gfapi.Stat()
+        s.st_mode = stat.S_IFDIR
+        mock_scandir = Mock()
+        mock_scandir.return_value = [_entry("f", gfapi.DT_REG),
+                                     _entry("d", gfapi.DT_DIR),
+                                     _entry("l", gfapi.DT_LNK)]
+        with nested(patch("gluster.gfapi.Volume.scandir", mock_scandir),
+                    patch("gluster.gfapi.Volume.stat", Mock(return_value=s))):
+            vol = gfapi.Volume("localhost", "test")
+            ret = vol._walk_listdir("top", False, False)
+            self.assertEqual(ret, (["d", "l"], ["f"], set(["l"])))
+            ret = vol._walk_listdir("top", True, False)
+            self.assertEqual(ret, (["d", "l"], ["f"], set()))
+
+    def test_walk_onerror(self):
+        self.tree = dict(self.tree)
+        del self.tree["top/a"]
+        errors = []
+        ret = [path for path, dirs, files in
+               self.vol.walk("top", onerror=errors.append, workers=2)]
+        self.assertEqual(ret, ["top", "top/b"])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(isinstance(errors[0], OSError))
+
+
+class TestVolumePool(unittest.TestCase):
+
+    def setUp(self):
+        self._saved_glfs_new = gluster.gfapi.api.glfs_new
+        gluster.gfapi.api.glfs_new = _mock_glfs_new
+
+        self._saved_glfs_set_volfile_server = \
+                gluster.gfapi.api.glfs_set_volfile_server
+        gluster.gfapi.api.glfs_set_volfile_server = \
+                _mock_glfs_set_volfile_server
+
+        self._saved_glfs_fini = gluster.gfapi.api.glfs_fini
+        gluster.gfapi.api.glfs_fini = _mock_glfs_fini
+
+    def tearDown(self):
+        gluster.gfapi.api.glfs_new = self._saved_glfs_new
+        gluster.gfapi.api.glfs_set_volfile_server = \
+            self._saved_glfs_set_volfile_server
+        gluster.gfapi.api.glfs_fini = self._saved_glfs_fini
+
+    def test_invalid_policy(self):
+        self.assertRaises(ValueError, gfapi.VolumePool, "localhost", "test",
+                          policy="random")
+
+    def test_mount_success(self):
+        mock_glfs_init = Mock()
+        mock_glfs_init.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_init", mock_glfs_init):
+            pool = gfapi.VolumePool("localhost", "test", size=3)
+            self.assertEqual(pool.mount(), 0)
+            self.assertEqual(mock_glfs_init.call_count, 3)
+
+    def test_mount_fail_exception(self):
+        mock_glfs_init = Mock()
+        mock_glfs_init.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_init", mock_glfs_init):
+            pool = gfapi.VolumePool("localhost", "test", size=2)
+            self.assertRaises(OSError, pool.mount)
+
+    def test_umount(self):
+        mock_glfs_fini = Mock()
+        mock_glfs_fini.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_fini", mock_glfs_fini):
+            pool = gfapi.VolumePool("localhost", "test", size=2)
+            pool.umount()
+            self.assertEqual(mock_glfs_fini.call_count, 2)
+            for vol in pool.volumes:
+                self.assertEqual(vol.fs, None)
+
+    def test_round_robin(self):
+        pool = gfapi.VolumePool("localhost", "test", size=3)
+        used = []
+        for i in range(6):
+            with pool.volume() as vol:
+                used.append(pool.volumes.index(vol))
+        self.assertEqual(used, [0, 1, 2, 0, 1, 2])
+
+    def test_least_busy(self):
+        pool = gfapi.VolumePool("localhost", "test", size=3,
+                                policy="least-busy")
+        with pool.volume() as vol0:
+            with pool.volume() as vol1:
+                self.assertNotEqual(vol0, vol1)
+                with pool.volume() as vol2:
+                    self.assertTrue(vol2 not in (vol0, vol1))
+            with pool.volume() as vol:
+                self.assertTrue(vol is not vol0)
+        self.assertEqual(pool._busy, [0, 0, 0])
+
+    def test_stat_dispatch(self):
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = 0
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            pool = gfapi.VolumePool("localhost", "test", size=2)
+            s = pool.stat("file.txt")
+            self.assertTrue(isinstance(s, gfapi.StatResult))
+            self.assertEqual(pool._busy, [0, 0])
+
+    def test_stat_fail_exception(self):
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.return_value = -1
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            pool = gfapi.VolumePool("localhost", "test", size=2)
+            self.assertRaises(OSError, pool.stat, "file.txt")
+            self.assertEqual(pool._busy, [0, 0])
+
+
+class _FakeVolume(object):
+    pass
+
+
+class TestAsyncVolume(unittest.TestCase):
+
+    def setUp(self):
+        if gfapi.asyncio is None or gfapi.ThreadPoolExecutor is None:
+            raise SkipTest("asyncio is not available")
+        self.loop = gfapi.asyncio.new_event_loop()
+        gfapi.asyncio.set_event_loop(self.loop)
+        self.vol = _FakeVolume()
+        self.avol = gfapi.AsyncVolume(self.vol, workers=4)
+
+    def tearDown(self):
+        self.avol.close()
+        gfapi.asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def test_stat_success(self):
+        s = gfapi.Stat()
+        self.vol.stat = lambda path: (path, s)
+        ret = self.loop.run_until_complete(self.avol.stat("file.txt"))
+        self.assertEqual(ret, ("file.txt", s))
+
+    def test_mkdir_fail_exception(self):
+        def _mkdir(path, mode):
+            raise OSError(17, "File exists")
+
+        self.vol.mkdir = _mkdir
+        future = self.avol.mkdir("testdir", 0755)
+        self.assertRaises(OSError, self.loop.run_until_complete, future)
+
+    def test_max_pending(self):
+        avol = gfapi.AsyncVolume(self.vol, workers=4, max_pending=2)
+        lock = threading.Lock()
+        state = {"running": 0, "peak": 0}
+
+        def _op(path):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.01)
+            with lock:
+                state["running"] -= 1
+            return path
+
+        futures = [avol.submit(_op, i) for i in range(8)]
+        ret = self.loop.run_until_complete(
+            gfapi.asyncio.gather(*futures))
+        avol.close()
+        self.assertEqual(ret, list(range(8)))
+        self.assertEqual(state["peak"], 2)
+
+    def test_cancel_waiting(self):
+        avol = gfapi.AsyncVolume(self.vol, workers=1, max_pending=1)
+        calls = []
+        first = avol.submit(calls.append, 1)
+        second = avol.submit(calls.append, 2)
+        second.cancel()
+        self.loop.run_until_complete(first)
+        avol.close()
+        self.assertEqual(calls, [1])
+
+    def test_max_queued(self):
+        avol = gfapi.AsyncVolume(self.vol, workers=1, max_pending=1,
+                                 max_queued=1)
+        event = threading.Event()
+        first = avol.submit(event.wait)
+        second = avol.submit(int, 2)
+        self.assertRaises(gfapi.asyncio.QueueFull, avol.submit, int, 3)
+        admitted = avol.admit()
+        self.assertFalse(admitted.done())
+        event.set()
+        self.loop.run_until_complete(admitted)
+        third = avol.submit(int, 3)
+        ret = self.loop.run_until_complete(
+            gfapi.asyncio.gather(first, second, third))
+        avol.close()
+        self.assertEqual(ret, [True, 2, 3])
+
+
+class TestLibrary(unittest.TestCase):
+
+    def test_import_does_not_load(self):
+        root = os.path.dirname(os.path.dirname(gluster.__file__))
+        env = dict(os.environ, PYTHONPATH=root)
+        out = subprocess.check_output(
+            [sys.executable, "-c",
+             "from gluster import gfapi; print(gfapi.api._lib is None)"],
+            cwd=root, env=env)
+        self.assertEqual(out.strip(), b"True")
+
+    def test_load_applies_prototypes(self):
+        lib = gfapi._Library("gfapi")
+        self.assertTrue(lib._lib is None)
+        pread = lib.glfs_pread
+        self.assertFalse(lib._lib is None)
+        self.assertEqual(lib.gfapi6,
+                         hasattr(lib._lib, "glfs_copy_file_range"))
+        func = getattr(pread, "func", pread)
+        self.assertEqual(func.restype, ctypes.c_ssize_t)
+        self.assertEqual(func.argtypes[3], ctypes.c_longlong)
+        self.assertTrue(func.errcheck is gfapi._errcheck)
+        self.assertEqual(lib.glfs_open.restype, ctypes.c_void_p)
+        self.assertTrue(lib.__dict__["glfs_pread"] is pread)
+
+    def _fake_lib(self):
+        class FakeLib(object):
+            pass
+        lib = FakeLib()
+        for name in ("glfs_pread", "glfs_pwrite", "glfs_fsync",
+                     "glfs_ftruncate", "glfs_open", "glfs_read_async"):
+            func = Mock(return_value=0)
+            func.__name__ = name
+            setattr(lib, name, func)
+        return lib
+
+    def test_prototypes_before_gfapi6(self):
+        fake = self._fake_lib()
+        lib = gfapi._Library("gfapi")
+        lib._apply_prototypes(fake, False)
+        lib._lib = fake
+        self.assertFalse(lib.gfapi6)
+        self.assertTrue(lib.glfs_pread is fake.glfs_pread)
+        self.assertEqual(len(fake.glfs_pread.argtypes), 5)
+        self.assertEqual(len(fake.glfs_ftruncate.argtypes), 2)
+        self.assertTrue(gfapi.glfs_io_cbk in fake.glfs_read_async.argtypes)
+
+    def test_prototypes_gfapi6(self):
+        fake = self._fake_lib()
+        lib = gfapi._Library("gfapi")
+        lib._apply_prototypes(fake, True)
+        lib._lib = fake
+        self.assertTrue(lib.gfapi6)
+        self.assertEqual(len(fake.glfs_pread.argtypes), 6)
+        self.assertEqual(len(fake.glfs_pwrite.argtypes), 7)
+        self.assertEqual(len(fake.glfs_fsync.argtypes), 3)
+        self.assertEqual(len(fake.glfs_ftruncate.argtypes), 4)
+        self.assertTrue(lib.glfs_open is fake.glfs_open)
+
+        lib.glfs_pread(2, "buf", 10, 0, 0)
+        fake.glfs_pread.assert_called_once_with(2, "buf", 10, 0, 0, None)
+        lib.glfs_fsync(2)
+        fake.glfs_fsync.assert_called_once_with(2, None, None)
+        lib.glfs_ftruncate(2, 4096)
+        fake.glfs_ftruncate.assert_called_once_with(2, 4096, None, None)
+
+        argtypes = fake.glfs_read_async.argtypes
+        self.assertTrue(gfapi.glfs_io_cbk6 in argtypes)
+        self.assertFalse(gfapi.glfs_io_cbk in argtypes)
+        lib.glfs_read_async(2, "buf", 10, 0, gfapi._aio_callback, 7)
+        fake.glfs_read_async.assert_called_once_with(
+            2, "buf", 10, 0, gfapi._aio_callback6, 7)
+
+    def test_missing_library(self):
+        lib = gfapi._Library("no-such-library-for-gfapi-tests")
+        try:
+            lib.glfs_new
+        except OSError as e:
+            self.assertEqual(e.errno, errno.ENOENT)
+        else:
+            self.fail("loading a missing library succeeded")
+
+    def test_errcheck(self):
+        func = Mock()
+        func.__name__ = "glfs_stat"
+        self.assertEqual(gfapi._errcheck(5, func, ()), 5)
+        self.assertEqual(gfapi._errcheck(0, func, ()), 0)
+        ctypes.set_errno(errno.ENOENT)
+        try:
+            gfapi._errcheck(-1, func, ())
+        except OSError as e:
+            self.assertEqual(e.errno, errno.ENOENT)
+        else:
+            self.fail("_errcheck() did not raise")
+        ctypes.set_errno(errno.EBADF)
+        self.assertRaises(OSError, gfapi._errcheck, None, func, ())
+
+        func.__name__ = "glfs_getxattr"
+        ctypes.set_errno(errno.ENODATA)
+        self.assertRaises(IOError, gfapi._errcheck, -1, func, ())
+
+    def test_xattr_call_raising(self):
+        calls = []
+
+        def mock_glfs_getxattr(fs, path, key, buf, size):
+            calls.append(size)
+            if size == 0:
+                return 5000
+            if size < 5000:
+                raise IOError(errno.ERANGE, os.strerror(errno.ERANGE))
+            buf.raw = b"x" * 5000
+            return 5000
+
+        self.assertEqual(gfapi._xattr_call(mock_glfs_getxattr,
+                                           (1, "path", "key")), b"x" * 5000)
+        self.assertEqual(calls, [gfapi.XATTR_SIZE_HINT, 0, 5000])
+        self.assertRaises(IOError, gfapi._xattr_call, mock_glfs_getxattr,
+                          (1, "path", "key"), 10)
+
+
+class TestVolumeRaisingApi(unittest.TestCase):
+    """
+    With the real library, failed calls raise from their errcheck instead
+    of returning -1.
+    """
+
+    def setUp(self):
+        self._patches = [patch("gluster.gfapi.api.glfs_new", _mock_glfs_new),
+                         patch("gluster.gfapi.api.glfs_set_volfile_server",
+                               _mock_glfs_set_volfile_server),
+                         patch("gluster.gfapi.api.glfs_fini",
+                               _mock_glfs_fini)]
+        for p in self._patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self._patches):
+            p.stop()
+
+    def test_stat_negative_cache(self):
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.side_effect = OSError(errno.ENOENT, "missing")
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            vol.set_negative_cache(60)
+            self.assertRaises(OSError, vol.stat, "missing")
+            self.assertRaises(OSError, vol.stat, "missing")
+            self.assertEqual(mock_glfs_stat.call_count, 1)
+
+    def test_hooks(self):
+        errors = []
+
+        class Hook(gfapi.CallHook):
+            def after_call(self, op, target, size, duration, ret, err):
+                errors.append((op, ret, err))
+
+        mock_glfs_stat = Mock()
+        mock_glfs_stat.side_effect = OSError(errno.EIO, "io error")
+
+        with patch("gluster.gfapi.api.glfs_stat", mock_glfs_stat):
+            vol = gfapi.Volume("localhost", "test")
+            vol.add_hook(Hook())
+            vol.enable_stats()
+            self.assertRaises(OSError, vol.stat, "file.txt")
+            self.assertEqual(errors, [("stat", -1, errno.EIO)])
+            self.assertEqual(vol.stats()["stat"]["errors"], {errno.EIO: 1})
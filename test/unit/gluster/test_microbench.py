@@ -0,0 +1,100 @@
+# Copyright (c) 2014 Red Hat, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from gluster import gfapi
+from gluster import microbench
+from mock import patch
+
+
+class TestNullApi(unittest.TestCase):
+
+    def test_calls(self):
+        with microbench.null_api(entries=2):
+            vol = gfapi.Volume("localhost", "null")
+            self.assertTrue(isinstance(vol._api, microbench.NullApi))
+            self.assertEqual(vol.stat(b"file").st_size, 0)
+            self.assertEqual([e.name for e in vol.scandir(b"dir")],
+                             [b"e000000", b"e000001"])
+            with vol.open(b"file", os.O_RDWR) as f:
+                self.assertEqual(f.read(10), b"\0" * 10)
+                self.assertEqual(f.writev([b"ab", b"cde"]), 5)
+        self.assertFalse(isinstance(gfapi.api, microbench.NullApi))
+
+
+class TestMicrobench(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_measure(self):
+        ratios, ref = microbench.measure(
+            number=10, repeat=1, names=set(["Volume.stat", "File.read"]))
+        self.assertEqual(sorted(ratios), ["File.read", "Volume.stat"])
+        self.assertTrue(ref > 0)
+
+    def test_cases_cover_public_methods(self):
+        with microbench.null_api():
+            vol = gfapi.Volume("localhost", "null")
+            names = set(name for name, func in
+                        microbench._cases(vol, gfapi.File(1)))
+        for cls in (gfapi.Volume, gfapi.File):
+            for attr, value in vars(cls).items():
+                name = "%s.%s" % (cls.__name__, attr)
+                if attr.startswith("_") or not callable(value):
+                    continue
+                self.assertTrue(name in names or name in microbench.UNTIMED,
+                                "no microbenchmark of %s" % name)
+        ratios, ref = microbench.measure(number=1, repeat=1)
+        self.assertEqual(set(ratios), names)
+
+    def test_compare(self):
+        ratios = {"a": 10.0, "b": 13.0, "c": 5.0}
+        baseline = {"a": 10.0, "b": 10.0}
+        self.assertEqual(microbench.compare(ratios, baseline, 0.25),
+                         [("b", 13.0, 10.0)])
+        self.assertEqual(microbench.compare(ratios, baseline, 0.5), [])
+
+    def _main(self, *args):
+        with patch.object(sys, "stdout"):
+            return microbench.main(["--number", "10", "--repeat", "1",
+                                    "--only", "Volume.stat"] + list(args))
+
+    def test_save_and_check(self):
+        path = os.path.join(self.tmp, "baseline.json")
+        self.assertEqual(self._main("--save", path), 0)
+        with open(path) as f:
+            doc = json.load(f)
+        key = microbench.baseline_key()
+        self.assertEqual(list(doc[key]), ["Volume.stat"])
+
+        doc[key]["Volume.stat"] = 1e6
+        with open(path, "w") as f:
+            json.dump(doc, f)
+        self.assertEqual(self._main("--baseline", path), 0)
+
+        doc[key]["Volume.stat"] = 1e-6
+        with open(path, "w") as f:
+            json.dump(doc, f)
+        self.assertEqual(self._main("--baseline", path), 1)